@@ -1,21 +1,32 @@
 import logging
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
 
 import uvicorn
 from fastapi import FastAPI
 from starlette.requests import Request
-from starlette.responses import JSONResponse
 
 from app.config import get_config
-from app.container import get_scheduler, setup_container
+from app.container import (
+    get_bulk_registration_service,
+    get_bundle_registration_service,
+    get_notification_service,
+    get_referral_registration_service,
+    get_scheduler,
+    setup_container,
+)
 from app.exceptions.fhir_exception import (
     OperationOutcome,
     OperationOutcomeDetail,
     OperationOutcomeIssue,
 )
+from app.responses import OrjsonResponse
+from app.routers.admission import router as admission_router
+from app.routers.bulk_registration import router as bulk_registration_router
 from app.routers.cache import router as cache_router
 from app.routers.default import router as default_router
 from app.routers.health import router as health_router
+from app.routers.notifications import router as notifications_router
 from app.routers.registration import router as registration_router
 from app.routers.scheduler import router as scheduler_router
 from app.routers.synchronize import router as synchronization_router
@@ -58,6 +69,9 @@ def application_init() -> None:
     config = get_config()
     setup_container()
     setup_logging()
+    get_bulk_registration_service().resume()
+    if config.notifications.enabled:
+        get_notification_service().start()
     if config.scheduler.automatic_background_update:
         scheduler = get_scheduler()
         scheduler.start()
@@ -74,6 +88,13 @@ def setup_logging() -> None:
     )
 
 
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    yield
+    get_bundle_registration_service().shutdown()
+    get_referral_registration_service().shutdown()
+
+
 def setup_fastapi() -> FastAPI:
     config = get_config()
 
@@ -83,18 +104,24 @@ def setup_fastapi() -> FastAPI:
             redoc_url=config.uvicorn.redoc_url,
             title="Nationale Verwijsindex Registratie Service API",
             description="API for the NVI-RS\n\nProvides endpoints for patient registration, data synchronization and permission checks",
+            default_response_class=OrjsonResponse,
+            lifespan=lifespan,
         )
     else:
-        fastapi = FastAPI(docs_url=None, redoc_url=None)
+        fastapi = FastAPI(docs_url=None, redoc_url=None, default_response_class=OrjsonResponse, lifespan=lifespan)
     routers = [
         default_router,
         health_router,
         registration_router,
+        bulk_registration_router,
         synchronization_router,
         cache_router,
         scheduler_router,
+        admission_router,
         test_router,
     ]
+    if config.notifications.enabled:
+        routers.append(notifications_router)
     for router in routers:
         fastapi.include_router(router)
 
@@ -103,7 +130,7 @@ def setup_fastapi() -> FastAPI:
     return fastapi
 
 
-def default_fhir_exception_handler(_: Request, exc: Exception) -> JSONResponse:
+def default_fhir_exception_handler(_: Request, exc: Exception) -> OrjsonResponse:
     """
     Default handler to convert generic exceptions to FHIR exceptions
     """
@@ -117,4 +144,4 @@ def default_fhir_exception_handler(_: Request, exc: Exception) -> JSONResponse:
         ]
     )
 
-    return JSONResponse(status_code=500, content=outcome.model_dump())
+    return OrjsonResponse(status_code=500, content=outcome.model_dump())
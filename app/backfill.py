@@ -0,0 +1,60 @@
+"""
+Backfills the patients of a data domain over a _lastUpdated date range, in windows processed in parallel.
+Running it again for the same domain and range resumes with the windows that did not finish.
+
+Usage: python -m app.backfill ImagingStudy --start 2015-01-01 --end 2025-01-01 [--strategy bisect]
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta, timezone
+
+from app.application import setup_logging
+from app.config import get_config
+from app.container import get_backfill_service, setup_container
+from app.models.backfill import WindowStrategy
+
+
+def parse_date(value: str) -> datetime:
+    date = datetime.fromisoformat(value)
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+
+def main(args: list[str] | None = None) -> int:
+    config = get_config()
+    parser = argparse.ArgumentParser(prog="python -m app.backfill", description="Backfill a data domain")
+    parser.add_argument("data_domain", choices=config.app.data_domains)
+    parser.add_argument("--start", type=parse_date, required=True, help="first _lastUpdated included (ISO 8601)")
+    parser.add_argument("--end", type=parse_date, required=True, help="first _lastUpdated not included (ISO 8601)")
+    parser.add_argument(
+        "--strategy",
+        type=WindowStrategy,
+        choices=[strategy.value for strategy in WindowStrategy],
+        default=config.backfill.strategy,
+    )
+    parser.add_argument("--window-days", type=float, default=config.backfill.window_days)
+    parsed = parser.parse_args(args)
+
+    setup_container()
+    setup_logging()
+    state = get_backfill_service().backfill(
+        parsed.data_domain,
+        parsed.start,
+        parsed.end,
+        strategy=parsed.strategy,
+        window=timedelta(days=parsed.window_days),
+    )
+
+    unfinished = [window for window in state.windows if not window.done]
+    print(
+        f"{parsed.data_domain}: {len(state.windows) - len(unfinished)} of {len(state.windows)} windows done, "
+        f"{sum(window.resources for window in state.windows)} resources, "
+        f"{sum(window.patients for window in state.windows)} patients"
+    )
+    for window in unfinished:
+        print(f"unfinished: {window.start} - {window.end}")
+    return 1 if unfinished else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,12 @@
 import configparser
 import os
 from enum import Enum
-from typing import Any, List
+from typing import Any, Dict, List
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from app.models.backfill import WindowStrategy
+from app.models.domains_map import SyncMode
 
 _PATH = "app.conf"
 _CONFIG = None
@@ -21,6 +24,7 @@ class LogLevel(str, Enum):
 class ConfigApp(BaseModel):
     loglevel: LogLevel = Field(default=LogLevel.info)
     data_domains: List[str] = Field(default=[])
+    data_domain_modes: Dict[str, SyncMode] = Field(default={})
     org_registration_ura: str = Field(default="")
     org_registration_oin: str = Field(default="")
     source_id: str = Field(default="")
@@ -38,12 +42,94 @@ class ConfigApp(BaseModel):
 
         return value
 
+    @model_validator(mode="after")
+    def split_modes(self) -> "ConfigApp":
+        """
+        A data domain is synchronized by search, unless configured as {resource type}:{mode}.
+        """
+        data_domains: List[str] = []
+        for data_domain in self.data_domains:
+            name, _, mode = data_domain.partition(":")
+            data_domains.append(name)
+            if mode:
+                self.data_domain_modes[name] = SyncMode(mode)
+        self.data_domains = data_domains
+        return self
+
 
 class ConfigScheduler(BaseModel):
     scheduled_delay: int = Field(default=5)
+    safety_net_delay: int = Field(default=300, gt=0)
     automatic_background_update: bool = Field(default=True)
 
 
+class ConfigRegistration(BaseModel):
+    bundle_workers: int = Field(default=8, gt=0)
+    process_pool_threshold_bytes: int = Field(default=1_048_576, ge=0)
+    process_pool_workers: int = Field(default=0, ge=0)
+    batching_enabled: bool = Field(default=False)
+    batch_window_ms: float = Field(default=5, ge=0)
+    batch_max_items: int = Field(default=50, gt=0)
+    batch_workers: int = Field(default=8, gt=0)
+    bsn_list_max_items: int = Field(default=1000, gt=0)
+
+
+class ConfigBulkRegistration(BaseModel):
+    storage_dir: str | None = Field(default=None)
+    workers: int = Field(default=4, gt=0)
+    max_page_size: int = Field(default=1000, gt=0)
+
+
+class ConfigIdempotency(BaseModel):
+    storage_path: str | None = Field(default=None)
+    max_entries: int = Field(default=1000, gt=0)
+    ttl_seconds: float = Field(default=86400, gt=0)
+    wait_timeout_seconds: float = Field(default=30, ge=0)
+    in_progress_timeout_seconds: float = Field(default=300, gt=0)
+
+
+class ConfigAdmission(BaseModel):
+    registration_max_in_flight: int = Field(default=16, gt=0)
+    registration_max_queue: int = Field(default=32, ge=0)
+    synchronization_max_in_flight: int = Field(default=2, gt=0)
+    synchronization_max_queue: int = Field(default=4, ge=0)
+    max_wait_seconds: float = Field(default=5, ge=0)
+    retry_after_seconds: int = Field(default=5, ge=0)
+
+
+class ConfigNotifications(BaseModel):
+    enabled: bool = Field(default=False)
+    debounce_ms: float = Field(default=500, ge=0)
+    max_pending: int = Field(default=1000, gt=0)
+
+
+class ConfigBackfill(BaseModel):
+    strategy: WindowStrategy = Field(default=WindowStrategy.fixed)
+    window_days: float = Field(default=30, gt=0)
+    max_window_resources: int = Field(default=10_000, gt=0)
+    workers: int = Field(default=4, gt=0)
+    state_dir: str | None = Field(default=None)
+
+
+class ConfigSynchronization(BaseModel):
+    queue_size: int = Field(default=100, gt=0)
+    extract_workers: int = Field(default=1, gt=0)
+    extract_batch_size: int = Field(default=1, gt=0)
+    pseudonym_workers: int = Field(default=4, gt=0)
+    pseudonym_batch_size: int = Field(default=10, gt=0)
+    referral_workers: int = Field(default=4, gt=0)
+    referral_batch_size: int = Field(default=10, gt=0)
+    page_size: int = Field(default=100, gt=0)
+    precheck: bool = Field(default=False)
+    system_search: bool = Field(default=False)
+    elements: bool = Field(default=True)
+    state_path: str | None = Field(default=None)
+    patient_cache_path: str | None = Field(default=None)
+    seed_with_export: bool = Field(default=False)
+    export_poll_interval: float = Field(default=5, gt=0)
+    export_timeout: float = Field(default=3600, gt=0)
+
+
 class ConfigMetadataApi(BaseModel):
     mock: bool = Field(default=False)
     endpoint: str = Field(default="")
@@ -115,6 +201,13 @@ class ConfigUvicorn(BaseModel):
 class Config(BaseModel):
     app: ConfigApp
     scheduler: ConfigScheduler
+    synchronization: ConfigSynchronization = Field(default_factory=ConfigSynchronization)
+    notifications: ConfigNotifications = Field(default_factory=ConfigNotifications)
+    backfill: ConfigBackfill = Field(default_factory=ConfigBackfill)
+    registration: ConfigRegistration = Field(default_factory=ConfigRegistration)
+    bulk_registration: ConfigBulkRegistration = Field(default_factory=ConfigBulkRegistration)
+    idempotency: ConfigIdempotency = Field(default_factory=ConfigIdempotency)
+    admission: ConfigAdmission = Field(default_factory=ConfigAdmission)
     metadata_api: ConfigMetadataApi
     uvicorn: ConfigUvicorn
     pseudonym_api: ConfigPseudonymApi
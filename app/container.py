@@ -1,16 +1,39 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import inject
 
 from app.config import get_config
+from app.models.pipeline import StageSettings
+from app.services.admission import (
+    REGISTRATION_ADMISSION,
+    SYNCHRONIZATION_ADMISSION,
+    AdmissionController,
+    AdmissionService,
+)
 from app.services.fhir.fhir_mapper import FhirMapper
 from app.services.metadata import MetadataService
 from app.services.nvi import NviService
 from app.services.oauth.factory import create_oauth_classes
 from app.services.pseudonym import PseudonymService
+from app.services.registration.batching import BatchingReferralRegistrationService
+from app.services.registration.bsn_list import BsnListRegistrationService
+from app.services.registration.bulk import BulkRegistrationService
 from app.services.registration.bundle import BundleRegistrationService
+from app.services.registration.idempotency import IdempotencyStore
 from app.services.registration.referrals import ReferralRegistrationService
+from app.services.synchronization.backfill import BackfillService
 from app.services.synchronization.domain_map import DomainsMapService
+from app.services.synchronization.notifications import NotificationService
+from app.services.synchronization.patient_cache import PatientCache
 from app.services.synchronization.scheduler import Scheduler
-from app.services.synchronization.synchronizer import Synchronizer
+from app.services.synchronization.synchronizer import (
+    EXTRACT_STAGE,
+    PSEUDONYM_STAGE,
+    REFERRAL_STAGE,
+    Synchronizer,
+)
 
 
 def container_config(binder: inject.Binder) -> None:
@@ -57,31 +80,144 @@ def container_config(binder: inject.Binder) -> None:
         mtls_cert=config.metadata_api.mtls_cert,
         mtls_key=config.metadata_api.mtls_key,
         verify_ca=config.metadata_api.verify_ca,
+        page_size=config.synchronization.page_size,
+        elements=config.synchronization.elements,
+        patient_cache=PatientCache(storage_path=config.synchronization.patient_cache_path),
+        export_poll_interval=config.synchronization.export_poll_interval,
+        export_timeout=config.synchronization.export_timeout,
     )
     binder.bind(MetadataService, metadata_service)
 
-    referral_registration_service = ReferralRegistrationService(
-        nvi_service=nvi_service,
-        pseudonym_service=pseudonym_service,
-        nvi_oin=config.referral_api.nvi_oin,
+    referral_registration_service = (
+        BatchingReferralRegistrationService(
+            nvi_service=nvi_service,
+            pseudonym_service=pseudonym_service,
+            nvi_oin=config.referral_api.nvi_oin,
+            window_ms=config.registration.batch_window_ms,
+            max_items=config.registration.batch_max_items,
+            workers=config.registration.batch_workers,
+        )
+        if config.registration.batching_enabled
+        else ReferralRegistrationService(
+            nvi_service=nvi_service,
+            pseudonym_service=pseudonym_service,
+            nvi_oin=config.referral_api.nvi_oin,
+        )
     )
     binder.bind(ReferralRegistrationService, referral_registration_service)
 
-    bundle_registration_service = BundleRegistrationService(referrals_service=referral_registration_service)
+    bundle_registration_service = BundleRegistrationService(
+        referrals_service=referral_registration_service,
+        max_workers=config.registration.bundle_workers,
+        process_pool_factory=(
+            partial(
+                ProcessPoolExecutor,
+                max_workers=config.registration.process_pool_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            if config.registration.process_pool_workers > 0
+            else None
+        ),
+        process_pool_threshold_bytes=config.registration.process_pool_threshold_bytes,
+    )
     binder.bind(BundleRegistrationService, bundle_registration_service)
 
-    domain_map_service = DomainsMapService(data_domains=config.app.data_domains)
+    idempotency_store = IdempotencyStore(
+        storage_path=config.idempotency.storage_path,
+        max_entries=config.idempotency.max_entries,
+        ttl_seconds=config.idempotency.ttl_seconds,
+        wait_timeout_seconds=config.idempotency.wait_timeout_seconds,
+        in_progress_timeout_seconds=config.idempotency.in_progress_timeout_seconds,
+    )
+    binder.bind(IdempotencyStore, idempotency_store)
+
+    bsn_list_registration_service = BsnListRegistrationService(
+        referrals_service=referral_registration_service,
+        max_workers=config.registration.bundle_workers,
+        max_items=config.registration.bsn_list_max_items,
+    )
+    binder.bind(BsnListRegistrationService, bsn_list_registration_service)
+
+    bulk_registration_service = BulkRegistrationService(
+        bundle_registration_service=bundle_registration_service,
+        storage_dir=config.bulk_registration.storage_dir,
+        workers=config.bulk_registration.workers,
+        max_page_size=config.bulk_registration.max_page_size,
+    )
+    binder.bind(BulkRegistrationService, bulk_registration_service)
+
+    admission_service = AdmissionService(
+        [
+            AdmissionController(
+                name=REGISTRATION_ADMISSION,
+                max_in_flight=config.admission.registration_max_in_flight,
+                max_queue=config.admission.registration_max_queue,
+                max_wait_seconds=config.admission.max_wait_seconds,
+                retry_after_seconds=config.admission.retry_after_seconds,
+            ),
+            AdmissionController(
+                name=SYNCHRONIZATION_ADMISSION,
+                max_in_flight=config.admission.synchronization_max_in_flight,
+                max_queue=config.admission.synchronization_max_queue,
+                max_wait_seconds=config.admission.max_wait_seconds,
+                retry_after_seconds=config.admission.retry_after_seconds,
+            ),
+        ]
+    )
+    binder.bind(AdmissionService, admission_service)
+
+    domain_map_service = DomainsMapService(
+        data_domains=config.app.data_domains,
+        storage_path=config.synchronization.state_path,
+    )
 
     synchronizer = Synchronizer(
         registration_service=referral_registration_service,
         metadata_api=metadata_service,
         domains_map_service=domain_map_service,
+        stage_settings={
+            EXTRACT_STAGE: StageSettings(
+                workers=config.synchronization.extract_workers,
+                batch_size=config.synchronization.extract_batch_size,
+            ),
+            PSEUDONYM_STAGE: StageSettings(
+                workers=config.synchronization.pseudonym_workers,
+                batch_size=config.synchronization.pseudonym_batch_size,
+            ),
+            REFERRAL_STAGE: StageSettings(
+                workers=config.synchronization.referral_workers,
+                batch_size=config.synchronization.referral_batch_size,
+            ),
+        },
+        queue_size=config.synchronization.queue_size,
+        domain_modes=config.app.data_domain_modes,
+        seed_with_export=config.synchronization.seed_with_export,
+        precheck=config.synchronization.precheck,
+        system_search=config.synchronization.system_search,
     )
     binder.bind(Synchronizer, synchronizer)
 
+    notification_service = NotificationService(
+        synchronizer=synchronizer,
+        metadata_api=metadata_service,
+        registration_service=referral_registration_service,
+        debounce_ms=config.notifications.debounce_ms,
+        max_pending=config.notifications.max_pending,
+    )
+    binder.bind(NotificationService, notification_service)
+
+    backfill_service = BackfillService(
+        metadata_api=metadata_service,
+        registration_service=referral_registration_service,
+        workers=config.backfill.workers,
+        max_window_resources=config.backfill.max_window_resources,
+        state_dir=config.backfill.state_dir,
+    )
+    binder.bind(BackfillService, backfill_service)
+
     scheduler = Scheduler(
         function=synchronizer.synchronize_all_domains,
-        delay=config.scheduler.scheduled_delay,
+        delay=(config.scheduler.safety_net_delay if config.notifications.enabled else config.scheduler.scheduled_delay),
     )
     binder.bind(Scheduler, scheduler)
 
@@ -106,6 +242,22 @@ def get_bundle_registration_service() -> BundleRegistrationService:
     return inject.instance(BundleRegistrationService)
 
 
+def get_idempotency_store() -> IdempotencyStore:
+    return inject.instance(IdempotencyStore)
+
+
+def get_bsn_list_registration_service() -> BsnListRegistrationService:
+    return inject.instance(BsnListRegistrationService)
+
+
+def get_bulk_registration_service() -> BulkRegistrationService:
+    return inject.instance(BulkRegistrationService)
+
+
+def get_admission_service() -> AdmissionService:
+    return inject.instance(AdmissionService)
+
+
 def get_synchronizer() -> Synchronizer:
     return inject.instance(Synchronizer)
 
@@ -114,5 +266,13 @@ def get_scheduler() -> Scheduler:
     return inject.instance(Scheduler)
 
 
+def get_notification_service() -> NotificationService:
+    return inject.instance(NotificationService)
+
+
+def get_backfill_service() -> BackfillService:
+    return inject.instance(BackfillService)
+
+
 def setup_container() -> None:
     inject.configure(container_config, once=True)
@@ -21,6 +21,9 @@ class Pseudonym:
 class OutcomeResponseStatusCode(int, enum.Enum):
     CREATED = 201
     BAD_REQUEST = 400
+    NOT_FOUND = 404
+    CONFLICT = 409
+    UNPROCESSABLE_ENTITY = 422
     INTERNAL_SERVER_ERROR = 500
 
 
@@ -35,3 +38,5 @@ class OutcomeResponseCode(str, enum.Enum):
     DUPLICATE = "duplicate"
     INVALID = "invalid"
     EXCEPTION = "exception"
+    NOT_FOUND = "not-found"
+    CONFLICT = "conflict"
@@ -1,3 +1,5 @@
+from typing import Dict
+
 from fastapi import HTTPException
 from pydantic import BaseModel
 
@@ -18,7 +20,7 @@ class OperationOutcome(BaseModel):
 
 
 class FHIRException(HTTPException):
-    def __init__(self, status_code: int, severity: str, code: str, msg: str):
+    def __init__(self, status_code: int, severity: str, code: str, msg: str, headers: Dict[str, str] | None = None):
         outcome = OperationOutcome(
             issue=[
                 OperationOutcomeIssue(
@@ -28,4 +30,4 @@ class FHIRException(HTTPException):
                 )
             ]
         )
-        super().__init__(status_code=status_code, detail=outcome.model_dump())
+        super().__init__(status_code=status_code, detail=outcome.model_dump(), headers=headers)
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class AdmissionStats(BaseModel):
+    name: str
+    max_in_flight: int
+    max_queue: int
+    in_flight: int
+    queue_depth: int
+    admitted: int
+    queued: int
+    rejected_queue_full: int
+    rejected_wait_timeout: int
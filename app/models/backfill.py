@@ -0,0 +1,29 @@
+from enum import Enum
+from typing import List
+
+from pydantic import BaseModel, Field
+
+
+class WindowStrategy(str, Enum):
+    # windows of a fixed duration
+    fixed = "fixed"
+    # fixed windows, each split up front into as many equal windows as its count of resources needs
+    adaptive = "adaptive"
+    # fixed windows, halved while processing for as long as they count too many resources
+    bisect = "bisect"
+
+
+class BackfillWindow(BaseModel):
+    # _lastUpdated range of the window, start included and end not
+    start: str
+    end: str
+    done: bool = False
+    resources: int = 0
+    patients: int = 0
+
+
+class BackfillState(BaseModel):
+    data_domain: str
+    start: str
+    end: str
+    windows: List[BackfillWindow] = Field(default_factory=list)
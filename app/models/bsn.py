@@ -1,18 +1,85 @@
 import hashlib
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, List, NamedTuple, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+BSN_LENGTH = 9
+# weights of the 11-proof, the last digit counts negatively
+BSN_WEIGHTS = (9, 8, 7, 6, 5, 4, 3, 2, -1)
+
+BSN_LENGTH_ERROR = "BSN must be 9 digits"
+BSN_DIGITS_ERROR = "BSN must only contain digits"
+BSN_CHECKSUM_ERROR = "Invalid BSN"
+
+
+def get_bsn_error(value: str) -> str | None:
+    """
+    Checks the length, digits and 11-proof of a BSN and returns why it is invalid, or None when it is valid.
+    """
+    if len(value) != BSN_LENGTH:
+        return BSN_LENGTH_ERROR
+
+    if not value.isascii() or not value.isdigit():
+        return BSN_DIGITS_ERROR
+
+    if sum(int(digit) * weight for digit, weight in zip(value, BSN_WEIGHTS)) % 11 != 0:
+        return BSN_CHECKSUM_ERROR
+
+    return None
+
+
+class BsnValidation(NamedTuple):
+    """
+    Outcome of validating many candidate BSNs at once: a validity mask and, per invalid candidate, the reason.
+    """
+
+    valid: npt.NDArray[np.bool_]
+    reasons: List[str | None]
+
+
+def validate_bsns(values: Sequence[str]) -> BsnValidation:
+    """
+    Validates the length, digits and 11-proof of many candidate BSNs with vectorized arithmetic, instead
+    of checking them one character at a time. The reasons are the ones get_bsn_error returns.
+    """
+    count = len(values)
+    if count == 0:
+        return BsnValidation(np.zeros(0, dtype=np.bool_), [])
+
+    lengths = np.fromiter((len(value) for value in values), dtype=np.int64, count=count)
+    has_length = lengths == BSN_LENGTH
+
+    # every candidate takes exactly 9 bytes, candidates of another length are replaced by zeros
+    # and non-ascii characters by a single "?", so the buffer can be viewed as a matrix of digits
+    padding = "0" * BSN_LENGTH
+    buffer = "".join(value if len(value) == BSN_LENGTH else padding for value in values).encode("ascii", "replace")
+    digits = np.frombuffer(buffer, dtype=np.uint8).reshape(count, BSN_LENGTH).astype(np.int64) - ord("0")
+
+    is_numeric = np.asarray(((digits >= 0) & (digits <= 9)).all(axis=1))
+    passes_checksum = (digits @ np.array(BSN_WEIGHTS, dtype=np.int64)) % 11 == 0
+    valid = has_length & is_numeric & passes_checksum
+
+    reasons: List[str | None] = [None] * count
+    for index in np.flatnonzero(~valid).tolist():
+        if not has_length[index]:
+            reasons[index] = BSN_LENGTH_ERROR
+        elif not is_numeric[index]:
+            reasons[index] = BSN_DIGITS_ERROR
+        else:
+            reasons[index] = BSN_CHECKSUM_ERROR
+
+    return BsnValidation(valid, reasons)
 
 
 @dataclass
 class BSN:
     def __init__(self, value: Any) -> None:
         bsn = str(value)
-        if len(bsn) != 9:
-            raise ValueError("BSN must be 9 digits")
-
-        total = sum(int(digit) * (9 - idx) for idx, digit in enumerate(bsn[:-1])) - int(bsn[-1])
-        if total % 11 != 0:
-            raise ValueError("Invalid BSN")
+        error = get_bsn_error(bsn)
+        if error is not None:
+            raise ValueError(error)
 
         self.value = bsn
 
@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import Any, Dict, List, Literal
+
+from pydantic import BaseModel, Field
+
+BulkJobStatus = Literal["uploading", "accepted", "in-progress", "completed", "failed"]
+
+
+class BulkJob(BaseModel):
+    id: str
+    status: BulkJobStatus
+    created: datetime
+    updated: datetime
+    total_lines: int = Field(default=0, ge=0)
+    processed_lines: int = Field(default=0, ge=0)
+    error_lines: int = Field(default=0, ge=0)
+    error: str | None = None
+
+
+class BulkResultsPage(BaseModel):
+    """
+    Page of per-line results of a bulk job. Every result holds the line number of the upload and
+    the transaction-response entries registering that line produced.
+    """
+
+    job_id: str
+    offset: int
+    count: int
+    total: int
+    next_offset: int | None
+    results: List[Dict[str, Any]]
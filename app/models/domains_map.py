@@ -1,10 +1,21 @@
-from typing import Dict
+from enum import Enum
+from typing import Dict, List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+
+class SyncMode(str, Enum):
+    # _lastUpdated searches of the resource type
+    search = "search"
+    # the _history of the resource type, read with _since
+    history = "history"
 
 
 class DomainMapEntry(BaseModel):
     last_resource_update: str | None = None
+    # ids of the resources processed that were updated at exactly last_resource_update, in history mode
+    # the versions ({id}/_history/{versionId}) processed at that instant
+    last_resource_ids: List[str] = Field(default_factory=list)
 
 
 DomainsMap = Dict[str, DomainMapEntry]
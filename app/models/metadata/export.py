@@ -0,0 +1,23 @@
+from typing import List
+
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field
+
+# The completion manifest of a Bulk Data $export, with the fields needed to read the exported files.
+
+
+class ExportOutput(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    type: str
+    url: str
+
+
+class ExportManifest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    transaction_time: str = Field(
+        alias="transactionTime",
+        validation_alias=AliasChoices("transactionTime", "transaction_time"),
+    )
+    output: List[ExportOutput] = Field(default_factory=list)
+    error: List[ExportOutput] = Field(default_factory=list)
@@ -1,39 +1,56 @@
+from datetime import datetime
 from typing import List
 
 from pydantic import AliasChoices, BaseModel, ConfigDict, Field
 
 # These are not actual represetations of FHIR resources and types.
-# It is just typings for the required fields needed to run the synchronization
+# It is just typings for the required fields needed to run the synchronization.
+# Everything else in a search result is ignored while parsing, so it is neither validated nor kept.
 
 
 class Identifier(BaseModel):
-    model_config = ConfigDict(extra="allow")
+    model_config = ConfigDict(extra="ignore")
 
-    value: str
-    system: str
+    value: str | None = None
+    system: str | None = None
 
 
 class Meta(BaseModel):
-    model_config = ConfigDict(extra="allow")
+    model_config = ConfigDict(extra="ignore")
 
-    last_updated: str = Field(
+    last_updated: datetime | None = Field(
+        default=None,
         alias="lastUpdated",
         validation_alias=AliasChoices("lastUpdated", "last_updated"),
     )
+    version_id: str | None = Field(
+        default=None,
+        alias="versionId",
+        validation_alias=AliasChoices("versionId", "version_id"),
+    )
+
+
+class Reference(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    reference: str | None = None
 
 
 class Link(BaseModel):
-    model_config = ConfigDict(extra="allow")
+    model_config = ConfigDict(extra="ignore")
 
     relation: str
     url: str
 
 
 class Resource(BaseModel):
-    model_config = ConfigDict(extra="allow")
+    model_config = ConfigDict(extra="ignore")
 
-    meta: Meta
+    id: str | None = None
+    meta: Meta | None = None
     identifier: List[Identifier] | None = None
+    subject: Reference | List[Reference] | None = None
+    patient: Reference | None = None
     resource_type: str = Field(
         alias="resourceType",
         validation_alias=AliasChoices("resourceType", "resource_type"),
@@ -41,14 +58,19 @@ class Resource(BaseModel):
 
 
 class Entry(BaseModel):
-    model_config = ConfigDict(extra="allow")
+    model_config = ConfigDict(extra="ignore")
 
-    resource: Resource
-    meta: Meta | None = None
+    full_url: str | None = Field(
+        default=None,
+        alias="fullUrl",
+        validation_alias=AliasChoices("fullUrl", "full_url"),
+    )
+    resource: Resource | None = None
 
 
 class Bundle(BaseModel):
-    model_config = ConfigDict(extra="allow")
+    model_config = ConfigDict(extra="ignore")
 
-    link: List[Link]
+    total: int | None = None
+    link: List[Link] = Field(default_factory=list)
     entry: List[Entry] | None = None
@@ -1,14 +1,51 @@
+from typing import List
+
 from pydantic import AliasChoices, BaseModel, Field
 
 
 class MetadataResourceParams(BaseModel):
-    last_updated: str | None = Field(
+    id: str | None = Field(
+        alias="_id",
+        validation_alias=AliasChoices("_id", "id"),
+        default=None,
+    )
+    last_updated: str | List[str] | None = Field(
         alias="_lastUpdated",
         validation_alias=AliasChoices("_lastUpdated", "last_updated"),
         default=None,
     )
-    include: str | None = Field(
+    since: str | None = Field(
+        alias="_since",
+        validation_alias=AliasChoices("_since", "since"),
+        default=None,
+    )
+    type: str | None = Field(
+        alias="_type",
+        validation_alias=AliasChoices("_type", "type"),
+        default=None,
+    )
+    include: str | List[str] | None = Field(
         alias="_include",
         validation_alias=AliasChoices("_include", "include"),
         default=None,
     )
+    sort: str | None = Field(
+        alias="_sort",
+        validation_alias=AliasChoices("_sort", "sort"),
+        default=None,
+    )
+    elements: str | None = Field(
+        alias="_elements",
+        validation_alias=AliasChoices("_elements", "elements"),
+        default=None,
+    )
+    summary: str | None = Field(
+        alias="_summary",
+        validation_alias=AliasChoices("_summary", "summary"),
+        default=None,
+    )
+    count: int | None = Field(
+        alias="_count",
+        validation_alias=AliasChoices("_count", "count"),
+        default=None,
+    )
@@ -0,0 +1,10 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class NotificationReceipt(BaseModel):
+    # changed resources queued for registration
+    resources: int
+    # data domains queued for synchronization, for notifications without the changed resources
+    domains: List[str]
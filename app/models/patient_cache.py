@@ -0,0 +1,15 @@
+from typing import Dict
+
+from pydantic import BaseModel, Field
+
+
+class CachedPatient(BaseModel):
+    # None when the patient has no BSN identifier, so it is not looked up again
+    bsn: str | None = None
+    last_updated: str | None = None
+
+
+class PatientCacheState(BaseModel):
+    # the newest Patient _lastUpdated seen, cached patients updated after it are refreshed
+    last_updated: str | None = None
+    patients: Dict[str, CachedPatient] = Field(default_factory=dict)
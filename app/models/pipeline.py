@@ -0,0 +1,27 @@
+from pydantic import BaseModel, Field
+
+
+class StageSettings(BaseModel):
+    workers: int = Field(default=1, gt=0)
+    batch_size: int = Field(default=1, gt=0)
+
+
+class DomainRunStats(BaseModel):
+    # synchronizations of the domain that searched for updates
+    runs: int = 0
+    # synchronizations skipped because the pre-check counted no updates
+    skipped: int = 0
+
+
+class StageStats(BaseModel):
+    name: str
+    workers: int
+    batch_size: int
+    queue_depth: int
+    max_queue_depth: int
+    processed: int
+    batches: int
+    busy_seconds: float
+    elapsed_seconds: float
+    throughput: float
+    utilization: float
@@ -0,0 +1,37 @@
+from typing import Literal, NamedTuple
+
+from pydantic import BaseModel
+
+
+class ResolvedEntry(NamedTuple):
+    """
+    Compact outcome of resolving a bundle resource to the BSN of the Patient it references.
+    Either bsn or error is set.
+    """
+
+    resource_id: str | None
+    patient_reference: str | None
+    bsn: str | None
+    error: str | None = None
+
+
+class ResolveFailure(NamedTuple):
+    """
+    A FHIRException raised while resolving a bundle in a worker process, as plain data so it can be sent
+    back to the request worker.
+    """
+
+    status_code: int
+    severity: str
+    code: str
+    msg: str
+
+
+class BsnRegistrationStatus(BaseModel):
+    """
+    Compact outcome of registering a single BSN.
+    """
+
+    bsn: str
+    status: Literal["created", "exists", "invalid", "error"]
+    details: str | None = None
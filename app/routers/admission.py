@@ -0,0 +1,37 @@
+from textwrap import dedent
+from typing import AsyncIterator, Callable, List
+
+from fastapi import APIRouter, Depends
+
+from app.container import get_admission_service
+from app.models.admission import AdmissionStats
+from app.services.admission import AdmissionService
+
+router = APIRouter(prefix="/admission", tags=["Admission Control"])
+
+
+def admission_control(name: str) -> Callable[[], AsyncIterator[None]]:
+    """
+    Route dependency holding a slot of the named admission controller while the request is handled.
+    """
+
+    async def admit() -> AsyncIterator[None]:
+        async with get_admission_service().get(name).admit():
+            yield
+
+    return admit
+
+
+@router.get(
+    "/stats",
+    summary="Get Admission Statistics",
+    description=dedent("""
+    Current load and counters of the admission control in front of the registration and synchronization
+    routes: requests in flight and waiting, and the amount of requests admitted, queued and rejected
+    because the queue was full (429) or they waited too long (503).
+    """),
+)
+def get_admission_stats(
+    admission_service: AdmissionService = Depends(get_admission_service),
+) -> List[AdmissionStats]:
+    return admission_service.stats()
@@ -0,0 +1,106 @@
+import logging
+from textwrap import dedent
+
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+
+from app.container import get_bulk_registration_service
+from app.models.bulk import BulkJob, BulkResultsPage
+from app.responses import OrjsonResponse
+from app.services.registration.bulk import BulkRegistrationService
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/registration/$bulk",
+    tags=["Registration Service"],
+)
+
+
+@router.post(
+    "",
+    summary="Create Bulk Registration Job",
+    description=dedent("""
+    Register referrals for a whole population in the background.
+
+    The request body is newline delimited JSON, every line holds one of:
+    - a FHIR R4B Bundle, handled like a bundle posted to `POST /registration`
+    - an Identifier with the BSN system, e.g. `{"system": "http://fhir.nl/fhir/NamingSystem/bsn", "value": "468467543"}`
+    - a BSN as a JSON string, e.g. `"468467543"`
+
+    The upload is stored and a job is returned right away, its progress is available at the `Location`
+    of the response. Unfinished jobs continue where they left off after a restart of the service.
+    """),
+    status_code=status.HTTP_202_ACCEPTED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-ndjson": {
+                    "schema": {"type": "string"},
+                    "example": '"468467543"\n{"system": "http://fhir.nl/fhir/NamingSystem/bsn", "value": "200060429"}\n',
+                }
+            },
+        }
+    },
+    responses={
+        400: {"description": "Bulk upload without lines"},
+    },
+)
+async def create_job(
+    request: Request,
+    bulk_registration_service: BulkRegistrationService = Depends(get_bulk_registration_service),
+) -> OrjsonResponse:
+    job = await run_in_threadpool(bulk_registration_service.create_job)
+    try:
+        # the upload is written from the threadpool, so a large upload does not block the event loop
+        file = await run_in_threadpool(open, bulk_registration_service.input_path(job.id), "wb")
+        try:
+            async for chunk in request.stream():
+                await run_in_threadpool(file.write, chunk)
+        finally:
+            await run_in_threadpool(file.close)
+    except BaseException:
+        await run_in_threadpool(bulk_registration_service.delete_job, job.id)
+        raise
+
+    job = await run_in_threadpool(bulk_registration_service.submit, job.id)
+    logger.info(f"Accepted bulk registration job {job.id} with {job.total_lines} lines")
+
+    return OrjsonResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=job.model_dump(mode="json"),
+        headers={"Location": str(request.url_for("get_job", job_id=job.id))},
+    )
+
+
+@router.get(
+    "/{job_id}",
+    summary="Get Bulk Registration Job",
+    description="Status and progress of a bulk registration job",
+    responses={404: {"description": "Bulk registration job not found"}},
+)
+def get_job(
+    job_id: str,
+    bulk_registration_service: BulkRegistrationService = Depends(get_bulk_registration_service),
+) -> BulkJob:
+    return bulk_registration_service.get_job(job_id)
+
+
+@router.get(
+    "/{job_id}/results",
+    summary="Get Bulk Registration Results",
+    description=dedent("""
+    Per-line results of a bulk registration job, in the order of the upload. Every result holds the line
+    number and the transaction-response entries of that line. Results are available while the job is
+    still running, request the next page with the returned `next_offset`.
+    """),
+    responses={404: {"description": "Bulk registration job not found"}},
+)
+def get_results(
+    job_id: str,
+    offset: int = Query(0, ge=0, description="Amount of results to skip"),
+    count: int = Query(100, gt=0, description="Maximum amount of results to return"),
+    bulk_registration_service: BulkRegistrationService = Depends(get_bulk_registration_service),
+) -> BulkResultsPage:
+    return bulk_registration_service.get_results(job_id, offset, count)
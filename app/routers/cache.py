@@ -15,7 +15,9 @@ router = APIRouter(prefix="/cache", tags=["Cache Management"])
     description=dedent("""
     Clear the cache for a specific data domain or all domains.
 
-    This endpoint allows you to clear cached data either for a specific domain or globally.
+    This endpoint allows you to clear cached data either for a specific domain or globally. A synchronization
+    of a domain in progress finishes before its progress is cleared. The patient cache is shared by all domains,
+    so it is only cleared when all domains are cleared.
 
     **Use Cases:**
     - Clear specific domain cache after data updates
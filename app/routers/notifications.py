@@ -0,0 +1,41 @@
+from textwrap import dedent
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from app.container import get_notification_service
+from app.models.notifications import NotificationReceipt
+from app.services.synchronization.notifications import NotificationService
+
+router = APIRouter(prefix="/notifications", tags=["Synchronizer"])
+
+
+@router.post(
+    "",
+    response_model=NotificationReceipt,
+    summary="Receive Subscription Notification",
+    description=dedent("""
+    Rest-hook endpoint for FHIR Subscriptions of the metadata server.
+
+    Accepts full-resource and id-only notification Bundles, a single changed resource, or an empty
+    notification. The changed resources are queued and, once a burst of notifications settles, their
+    patients are registered in the NVI. An empty notification synchronizes the data_domain given on the
+    channel endpoint, or all domains.
+
+    **Use Cases:**
+    - Register patients as soon as their data changes, instead of on the next scheduled synchronization
+    """),
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def receive_notification(
+    request: Request,
+    data_domain: str | None = Query(
+        None,
+        description="The data domain an empty notification is about. If not provided, all domains are synchronized.",
+        example="ImagingStudy",
+    ),
+    service: NotificationService = Depends(get_notification_service),
+) -> NotificationReceipt:
+    try:
+        return service.notify(await request.body(), data_domain)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
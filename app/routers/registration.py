@@ -1,18 +1,62 @@
 import logging
+from contextlib import contextmanager
 from textwrap import dedent
-from typing import Any, Dict
+from typing import Iterator, List
 
-from fastapi import APIRouter, Body, Depends, status
-from fhir.resources.R4B.bundle import Bundle
-from starlette.responses import JSONResponse, Response
+from fastapi import APIRouter, Body, Depends, Header, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from starlette.responses import Response, StreamingResponse
 
 from app.container import (
+    get_bsn_list_registration_service,
     get_bundle_registration_service,
+    get_idempotency_store,
 )
 from app.exceptions.service_exceptions import InvalidResourceException
+from app.models.registration import BsnRegistrationStatus
+from app.routers.admission import admission_control
+from app.services.admission import REGISTRATION_ADMISSION
+from app.services.fhir.bundle import BundleService
+from app.services.registration.bsn_list import BsnListRegistrationService
 from app.services.registration.bundle import BundleRegistrationService
+from app.services.registration.idempotency import IdempotencyStore
 
 logger = logging.getLogger(__name__)
+
+REGISTRATION_EXAMPLE = {
+    "resourceType": "Bundle",
+    "type": "collection",
+    "entry": [
+        {
+            "resource": {
+                "resourceType": "Patient",
+                "id": "example-patient-1",
+                "name": [{"text": "Mohammed Koster"}],
+                "identifier": [{"system": "http://fhir.nl/fhir/NamingSystem/bsn", "value": "468467543"}],
+            }
+        },
+        {
+            "resource": {
+                "resourceType": "CarePlan",
+                "id": "example-careplan-1",
+                "status": "completed",
+                "intent": "plan",
+                "title": "Random CarePlan",
+                "description": "random description",
+                "subject": {"reference": "Patient/example-patient-1", "display": "Mohammed Koster"},
+                "careTeam": [
+                    {"reference": "CareTeam/example-careteam-1", "display": "Care Team 1"},
+                    {"reference": "CareTeam/example-careteam-2", "display": "Care Team 2"},
+                ],
+            }
+        },
+    ],
+}
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/fhir+ndjson", "application/ndjson")
+
 router = APIRouter(
     prefix="/registration",
     tags=["Registration Service"],
@@ -34,11 +78,31 @@ router = APIRouter(
     - Should contain referral-related resources (ImagingStudy, CarePlan, etc.)
     - Should contain the referenced Patient resource(s)
 
+    **Streaming:**
+    With `stream=true` the transaction-response bundle is streamed, every entry is written as soon as its
+    registration and those of the entries before it finished, so the entries keep the order of the request.
+    With an `Accept: application/x-ndjson` (or `application/fhir+ndjson`) header the entries are streamed as
+    newline delimited JSON instead. Should a registration fail after the response has started, the failure is
+    reported in a final entry with status 500.
+
+    **Retries:**
+    A request with an `Idempotency-Key` header is registered once. A retry with the same key and body gets the
+    result of the first request, or waits for it while the first request is still running, without registering
+    the bundle again. Reusing a key for a different body is rejected with 422.
+
     **Use Cases:**
     - Manually register new patient referrals in the NVI system
     - Specific situations where automated referral registration is not suitable
     """),
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission_control(REGISTRATION_ADMISSION))],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "description": "FHIR R4B Bundle resource containing referral information",
+            "content": {"application/json": {"schema": {"type": "object"}, "example": REGISTRATION_EXAMPLE}},
+        }
+    },
     responses={
         200: {
             "description": "Referral registered successfully",
@@ -56,7 +120,11 @@ router = APIRouter(
                             },
                         }
                     }
-                }
+                },
+                "application/x-ndjson": {
+                    "example": '{"response":{"status":"201","outcome":{"resourceType":"OperationOutcome","issue":'
+                    '[{"severity":"information","code":"created","details":{"text":"Record created successfully"}}]}}}\n'
+                },
             },
         },
         400: {
@@ -78,6 +146,8 @@ router = APIRouter(
                 }
             },
         },
+        429: {"description": "Too many registration requests waiting, retry after the Retry-After header"},
+        503: {"description": "Waited too long for a free registration slot, retry after the Retry-After header"},
         500: {
             "description": "Internal server error during registration",
             "content": {
@@ -97,46 +167,98 @@ router = APIRouter(
         },
     },
 )
-def create(
-    request: Dict[str, Any] | None = Body(
-        description="FHIR R4B Bundle resource containing referral information",
-        example={
-            "resourceType": "Bundle",
-            "type": "collection",
-            "entry": [
-                {
-                    "resource": {
-                        "resourceType": "Patient",
-                        "id": "example-patient-1",
-                        "name": [{"text": "Mohammed Koster"}],
-                        "identifier": [{"system": "http://fhir.nl/fhir/NamingSystem/bsn", "value": "468467543"}],
-                    }
-                },
-                {
-                    "resource": {
-                        "resourceType": "CarePlan",
-                        "id": "example-careplan-1",
-                        "status": "completed",
-                        "intent": "plan",
-                        "title": "Random CarePlan",
-                        "description": "random description",
-                        "subject": {"reference": "Patient/example-patient-1", "display": "Mohammed Koster"},
-                        "careTeam": [
-                            {"reference": "CareTeam/example-careteam-1", "display": "Care Team 1"},
-                            {"reference": "CareTeam/example-careteam-2", "display": "Care Team 2"},
-                        ],
-                    }
-                },
-            ],
-        },
+async def create(
+    request: Request,
+    stream: bool = Query(
+        False,
+        description="Stream the transaction-response entries as soon as each registration finishes",
+    ),
+    idempotency_key: str | None = Header(
+        None,
+        max_length=255,
+        description="Retries carrying the same key get the result of the first request instead of registering again",
     ),
     bundle_registration_service: BundleRegistrationService = Depends(get_bundle_registration_service),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store),
 ) -> Response:
-    if request is None:
+    body = await request.body()
+    if body.strip() in (b"", b"null"):
         logger.error("Resource is missing in the request")
         raise InvalidResourceException("Resource is missing in the request")
 
-    bundle = Bundle.model_validate(request)
-    results = bundle_registration_service.register(bundle)
+    ndjson = any(media_type in request.headers.get("accept", "") for media_type in NDJSON_MEDIA_TYPES)
+    if idempotency_key is not None:
+        stored = await run_in_threadpool(idempotency_store.begin, idempotency_key, body)
+        if stored is not None:
+            logger.info("Replaying registration of an earlier request with the same Idempotency-Key")
+            entries: Iterator[bytes] = iter(stored)
+        else:
+            try:
+                entries = idempotency_store.record(
+                    idempotency_key, await _register_iter(bundle_registration_service, body)
+                )
+            except BaseException:
+                idempotency_store.abandon(idempotency_key)
+                raise
+    elif stream or ndjson:
+        entries = await _register_iter(bundle_registration_service, body)
+    else:
+        content = await _register(bundle_registration_service, body)
+        return Response(status_code=200, content=content, media_type="application/json")
+
+    if ndjson:
+        return StreamingResponse(
+            BundleService.stream_entry_response_ndjson(entries),
+            media_type="application/x-ndjson",
+        )
+    if stream:
+        return StreamingResponse(BundleService.stream_entry_response(entries), media_type="application/json")
+
+    content = await run_in_threadpool(BundleService.from_entry_json, entries)
+    return Response(status_code=200, content=content, media_type="application/json")
+
+
+async def _register(bundle_registration_service: BundleRegistrationService, body: bytes) -> bytes:
+    with _request_validation_errors():
+        return await run_in_threadpool(bundle_registration_service.register_json, body)
+
+
+async def _register_iter(bundle_registration_service: BundleRegistrationService, body: bytes) -> Iterator[bytes]:
+    with _request_validation_errors():
+        return await run_in_threadpool(bundle_registration_service.register_json_iter, body)
+
+
+@contextmanager
+def _request_validation_errors() -> Iterator[None]:
+    try:
+        yield
+    except ValidationError as e:
+        # a body that is no JSON object at all is rejected like any other invalid request body
+        if any(error["type"] in ("json_invalid", "model_type") and error["loc"] == () for error in e.errors()):
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()]) from e
+        raise
 
-    return JSONResponse(status_code=200, content=results.model_dump())
+
+@router.post(
+    "/$bsn",
+    summary="Register BSN List",
+    description=dedent("""
+    Register referrals for a list of BSNs, without wrapping them in a FHIR bundle.
+
+    Every BSN is validated on its checksum and registered once. The response holds a status per BSN, in the
+    order of the request: `created`, `exists` when a referral was already registered, `invalid` for a BSN
+    that fails validation and `error` when the registration itself failed.
+    """),
+    response_model_exclude_none=True,
+    dependencies=[Depends(admission_control(REGISTRATION_ADMISSION))],
+    responses={
+        400: {"description": "Too many BSNs in a single request"},
+        429: {"description": "Too many registration requests waiting, retry after the Retry-After header"},
+        503: {"description": "Waited too long for a free registration slot, retry after the Retry-After header"},
+    },
+)
+def register_bsns(
+    bsns: List[str] = Body(..., examples=[["468467543", "200060429"]]),
+    bsn_list_registration_service: BsnListRegistrationService = Depends(get_bsn_list_registration_service),
+) -> List[BsnRegistrationStatus]:
+    return bsn_list_registration_service.register(bsns)
@@ -4,7 +4,10 @@ from typing import Dict, List
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 
 from app.container import get_synchronizer
+from app.models.pipeline import DomainRunStats, StageStats
 from app.models.update_scheme import UpdateScheme
+from app.routers.admission import admission_control
+from app.services.admission import SYNCHRONIZATION_ADMISSION
 from app.services.synchronization.synchronizer import Synchronizer
 
 router = APIRouter(prefix="/synchronize", tags=["Synchronizer"])
@@ -14,6 +17,7 @@ router = APIRouter(prefix="/synchronize", tags=["Synchronizer"])
     "",
     response_model=Dict[str, List[UpdateScheme]],
     summary="Synchronize Data Domain",
+    dependencies=[Depends(admission_control(SYNCHRONIZATION_ADMISSION))],
     description=dedent(
         """
     Synchronize local referrals with the National Referral Index (NVI) for one or all domains.
@@ -67,6 +71,8 @@ router = APIRouter(prefix="/synchronize", tags=["Synchronizer"])
                 }
             },
         },
+        429: {"description": "Too many synchronization requests waiting, retry after the Retry-After header"},
+        503: {"description": "Waited too long for a free synchronization slot, retry after the Retry-After header"},
         500: {
             "description": "Internal server error during synchronization",
             "content": {
@@ -105,3 +111,86 @@ def synchronize_domain(
         return service.synchronize_domain(data_domain)
     else:
         return service.synchronize_all_domains()
+
+
+@router.get(
+    "/stats",
+    response_model=Dict[str, List[StageStats]],
+    summary="Synchronization Pipeline Statistics",
+    description=dedent(
+        """
+    Retrieve the statistics of the synchronization pipeline per data domain.
+
+    Each synchronization runs as a pipeline of stages (metadata fetch, BSN extraction,
+    pseudonymization and NVI registration) connected by bounded queues. For the running,
+    or last finished, synchronization of every domain this endpoint returns per stage the
+    current and maximum queue depth, the amount of processed items, the throughput in items
+    per second and the utilization of the stage workers.
+
+    **Use Cases:**
+    - Find the bottleneck stage of the synchronization
+    - Tune the per-stage concurrency and batch sizes
+    """
+    ),
+    status_code=status.HTTP_200_OK,
+    responses={
+        200: {
+            "description": "Pipeline statistics retrieved successfully",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "ImagingStudy": [
+                            {
+                                "name": "pseudonym",
+                                "workers": 4,
+                                "batch_size": 10,
+                                "queue_depth": 0,
+                                "max_queue_depth": 12,
+                                "processed": 250,
+                                "batches": 31,
+                                "busy_seconds": 8.2,
+                                "elapsed_seconds": 2.4,
+                                "throughput": 104.167,
+                                "utilization": 0.854,
+                            }
+                        ]
+                    }
+                }
+            },
+        },
+    },
+)
+def get_pipeline_stats(
+    service: Synchronizer = Depends(get_synchronizer),
+) -> Dict[str, List[StageStats]]:
+    return service.get_pipeline_stats()
+
+
+@router.get(
+    "/domains/stats",
+    response_model=Dict[str, DomainRunStats],
+    summary="Synchronization Runs per Data Domain",
+    description=dedent(
+        """
+    Retrieve per data domain how many synchronizations ran and how many were skipped.
+
+    Before a data domain is synchronized its updates since the last synchronization are counted with a
+    single _summary=count search. When there are none the synchronization is skipped.
+
+    **Use Cases:**
+    - See how often domains actually change
+    - Tune the scheduled delay of the synchronization
+    """
+    ),
+    status_code=status.HTTP_200_OK,
+    responses={
+        200: {
+            "description": "Domain statistics retrieved successfully",
+            "content": {"application/json": {"example": {"ImagingStudy": {"runs": 12, "skipped": 720}}}},
+        },
+    },
+)
+def get_domain_stats(
+    service: Synchronizer = Depends(get_synchronizer),
+) -> Dict[str, DomainRunStats]:
+    return service.get_domain_stats()
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List
+
+from app.exceptions.fhir_exception import FHIRException
+from app.models.admission import AdmissionStats
+
+logger = logging.getLogger(__name__)
+
+REGISTRATION_ADMISSION = "registration"
+SYNCHRONIZATION_ADMISSION = "synchronization"
+
+
+class AdmissionController:
+    """
+    Limits the amount of requests handled at once. Requests over max_in_flight wait in a queue of at most
+    max_queue requests for at most max_wait_seconds. A request finding the queue full is rejected with 429,
+    a request waiting too long with 503, both telling the client when to retry. The controller is used from
+    the event loop only, so it needs no locking.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_in_flight: int,
+        max_queue: int,
+        max_wait_seconds: float,
+        retry_after_seconds: int,
+    ) -> None:
+        self._name = name
+        self._max_in_flight = max_in_flight
+        self._max_queue = max_queue
+        self._max_wait = max_wait_seconds
+        self._retry_after = retry_after_seconds
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future[None]] = deque()
+        self._admitted = 0
+        self._queued = 0
+        self._rejected_queue_full = 0
+        self._rejected_wait_timeout = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self) -> None:
+        if self._in_flight < self._max_in_flight and len(self._waiters) == 0:
+            self._in_flight += 1
+            self._admitted += 1
+            return
+
+        if len(self._waiters) >= self._max_queue:
+            self._rejected_queue_full += 1
+            raise self.__rejection(429, f"Too many {self._name} requests, try again later")
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(waiter, self._max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # the slot may have been handed over right before the wait ended
+            if waiter.done() and not waiter.cancelled():
+                if isinstance(e, asyncio.TimeoutError):
+                    self._admitted += 1
+                    return
+                self.release()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+            self._rejected_wait_timeout += 1
+            raise self.__rejection(503, f"Waited too long for a free {self._name} slot, try again later") from None
+
+        self._admitted += 1
+
+    def release(self) -> None:
+        # hand the slot over to the first waiter still waiting, the amount in flight stays the same
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self._in_flight -= 1
+
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(
+            name=self._name,
+            max_in_flight=self._max_in_flight,
+            max_queue=self._max_queue,
+            in_flight=self._in_flight,
+            queue_depth=len(self._waiters),
+            admitted=self._admitted,
+            queued=self._queued,
+            rejected_queue_full=self._rejected_queue_full,
+            rejected_wait_timeout=self._rejected_wait_timeout,
+        )
+
+    def __rejection(self, status_code: int, msg: str) -> FHIRException:
+        logger.warning(f"Rejected {self._name} request with {status_code}")
+        return FHIRException(
+            status_code=status_code,
+            severity="error",
+            code="throttled" if status_code == 429 else "transient",
+            msg=msg,
+            headers={"Retry-After": str(self._retry_after)},
+        )
+
+
+class AdmissionService:
+    """
+    Admission controllers per group of routes.
+    """
+
+    def __init__(self, controllers: List[AdmissionController]) -> None:
+        self._controllers: Dict[str, AdmissionController] = {controller.name: controller for controller in controllers}
+
+    def get(self, name: str) -> AdmissionController:
+        return self._controllers[name]
+
+    def stats(self) -> List[AdmissionStats]:
+        return [controller.stats() for controller in self._controllers.values()]
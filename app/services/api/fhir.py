@@ -1,9 +1,17 @@
-from typing import Any, Dict
+import logging
+import time
+from http import HTTPStatus
+from typing import Any, Dict, Iterator, List
+from urllib.parse import urljoin
 
-from fhir.resources.R4B.bundle import Bundle
+from requests import Response
 
+from app.models.metadata.export import ExportManifest
+from app.models.metadata.fhir import Bundle as MetadataBundle
 from app.services.api.http_service import HttpService
 
+logger = logging.getLogger(__name__)
+
 
 class FhirHttpService(HttpService):
     def __init__(
@@ -19,8 +27,89 @@ class FhirHttpService(HttpService):
     def server_healthy(self) -> bool:
         return self._server_healthy("metadata")
 
-    def search(self, resource_type: str, params: Dict[str, Any] | None = None) -> Bundle:
-        response = self.do_request(method="GET", sub_route=f"{resource_type}/_search", params=params)
+    def search_metadata(self, resource_type: str, params: Dict[str, Any] | None = None) -> MetadataBundle:
+        """
+        Searches resource_type and reads the result into the slim metadata models straight from the response
+        body, leaving out (and not validating) everything the synchronization does not use.
+        """
+        return MetadataBundle.model_validate_json(self.__search(resource_type, params).content)
+
+    def history_metadata(self, resource_type: str, params: Dict[str, Any] | None = None) -> MetadataBundle:
+        """
+        Reads the first page of the history of resource_type into the slim metadata models.
+        """
+        response = self.do_request(method="GET", sub_route=f"{resource_type}/_history", params=params)
+        response.raise_for_status()
+        return MetadataBundle.model_validate_json(response.content)
+
+    def get_metadata_page(self, link: str) -> MetadataBundle:
+        return MetadataBundle.model_validate_json(self.__get_page(link).content)
+
+    def kick_off_export(self, resource_types: List[str]) -> str:
+        """
+        Starts a system level Bulk Data $export of the resource types and returns its status url.
+        """
+        response = self.do_request(
+            method="GET",
+            sub_route="$export",
+            params={"_type": ",".join(resource_types)},
+            headers={"Accept": "application/fhir+json", "Prefer": "respond-async"},
+        )
         response.raise_for_status()
+        status_url = response.headers.get("Content-Location")
+        if response.status_code != HTTPStatus.ACCEPTED or not status_url:
+            raise ValueError(f"Export of {','.join(resource_types)} was not accepted")
+
+        return self.__resolve(status_url)
+
+    def wait_for_export(self, status_url: str, poll_interval: float, timeout: float) -> ExportManifest:
+        """
+        Polls the status url of an export until it completes, waiting the Retry-After of the server or
+        else poll_interval seconds between requests.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self.do_request(method="GET", url=status_url, headers={"Accept": "application/json"})
+            response.raise_for_status()
+            if response.status_code != HTTPStatus.ACCEPTED:
+                return ExportManifest.model_validate_json(response.content)
+
+            retry_after = response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else poll_interval
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Export at {status_url} did not complete within {timeout} seconds")
+
+            logger.debug(f"Export in progress: {response.headers.get('X-Progress', 'unknown')}")
+            time.sleep(delay)
+
+    def stream_ndjson(self, url: str) -> Iterator[bytes]:
+        """
+        Yields the lines of an NDJSON file as they are received.
+        """
+        response = self.do_request(
+            method="GET", url=self.__resolve(url), headers={"Accept": "application/fhir+ndjson"}, stream=True
+        )
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield line
+
+    def __search(self, resource_type: str, params: Dict[str, Any] | None) -> Response:
+        # without a resource type the search is system level, across all types
+        sub_route = f"{resource_type}/_search" if resource_type else "_search"
+        response = self.do_request(method="GET", sub_route=sub_route, params=params)
+        response.raise_for_status()
+        return response
+
+    def __get_page(self, link: str) -> Response:
+        response = self.do_request(method="GET", url=self.__resolve(link))
+        response.raise_for_status()
+        return response
+
+    def __resolve(self, link: str) -> str:
+        url = urljoin(f"{self._endpoint}/", link)
+        if not url.startswith(self._endpoint):
+            raise ValueError(f"Link {link} is not on the FHIR endpoint")
 
-        return Bundle.model_validate(response.json())
+        return url
@@ -45,13 +45,19 @@ class HttpService(ABC):
         data: Any = None,
         params: dict[str, Any] | None = None,
         headers: dict[str, Any] | None = None,
+        url: str | None = None,
+        stream: bool = False,
     ) -> Response:
+        """
+        Requests sub_route relative to the endpoint, or the absolute url when given (for instance a link
+        returned by the server). With stream the body is read as it is iterated, not up front.
+        """
         try:
             cert = (self._mtls_cert, self._mtls_key) if self._mtls_cert and self._mtls_key else None
             request_headers = {**self._extra_headers, **(headers or {})}
             response = request(
                 method=method,
-                url=f"{self._endpoint}/{sub_route}" if sub_route else self._endpoint,
+                url=url or (f"{self._endpoint}/{sub_route}" if sub_route else self._endpoint),
                 params=params,
                 headers=request_headers,
                 json=json,
@@ -59,6 +65,7 @@ class HttpService(ABC):
                 timeout=self._timeout,
                 cert=cert,
                 verify=self._verify_ca,
+                stream=stream,
             )
             return response
         except (ConnectionError, Timeout) as e:
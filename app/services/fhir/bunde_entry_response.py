@@ -1,5 +1,8 @@
 import enum
+from functools import lru_cache
+from typing import Dict, Tuple
 
+import orjson
 from fhir.resources.R4B.bundle import BundleEntryResponse
 from fhir.resources.R4B.codeableconcept import CodeableConcept
 from fhir.resources.R4B.operationoutcome import OperationOutcome, OperationOutcomeIssue
@@ -27,28 +30,51 @@ class KnownBundleRegistrationOutcome(enum.Enum):
     ERROR = enum.auto()
 
 
+KNOWN_OUTCOMES: Dict[KnownBundleRegistrationOutcome, Tuple[int, str, str]] = {
+    KnownBundleRegistrationOutcome.OK: (
+        OutcomeResponseStatusCode.CREATED.value,
+        OutcomeResponseSeverity.INFORMATION.value,
+        OutcomeResponseCode.CREATED.value,
+    ),
+    KnownBundleRegistrationOutcome.WARNING: (
+        OutcomeResponseStatusCode.BAD_REQUEST.value,
+        OutcomeResponseSeverity.WARNING.value,
+        OutcomeResponseCode.DUPLICATE.value,
+    ),
+    KnownBundleRegistrationOutcome.ERROR: (
+        OutcomeResponseStatusCode.BAD_REQUEST.value,
+        OutcomeResponseSeverity.ERROR.value,
+        OutcomeResponseCode.INVALID.value,
+    ),
+}
+
+
 def create_known_response(outcome: KnownBundleRegistrationOutcome, details: str) -> BundleEntryResponse:
-    match outcome:
-        case KnownBundleRegistrationOutcome.OK:
-            return create_bundle_response(
-                status=OutcomeResponseStatusCode.CREATED.value,
-                severity=OutcomeResponseSeverity.INFORMATION.value,
-                code=OutcomeResponseCode.CREATED.value,
-                details=details,
-            )
-
-        case KnownBundleRegistrationOutcome.WARNING:
-            return create_bundle_response(
-                status=OutcomeResponseStatusCode.BAD_REQUEST.value,
-                severity=OutcomeResponseSeverity.WARNING.value,
-                code=OutcomeResponseCode.DUPLICATE.value,
-                details=details,
-            )
-
-        case KnownBundleRegistrationOutcome.ERROR:
-            return create_bundle_response(
-                status=OutcomeResponseStatusCode.BAD_REQUEST.value,
-                severity=OutcomeResponseSeverity.ERROR.value,
-                code=OutcomeResponseCode.INVALID.value,
-                details=details,
-            )
+    status, severity, code = KNOWN_OUTCOMES[outcome]
+    return create_bundle_response(status=status, severity=severity, code=code, details=details)
+
+
+def create_bundle_entry_json(status: int, severity: str, code: str, details: str) -> bytes:
+    """
+    Serializes a bundle entry with a response straight to JSON, without building the FHIR models.
+    """
+    return orjson.dumps(
+        {
+            "response": {
+                "status": str(status),
+                "outcome": {
+                    "resourceType": "OperationOutcome",
+                    "issue": [{"severity": severity, "code": code, "details": {"text": details}}],
+                },
+            }
+        }
+    )
+
+
+@lru_cache(maxsize=1024)
+def create_known_entry_json(outcome: KnownBundleRegistrationOutcome, details: str) -> bytes:
+    """
+    Serialized bundle entry for a known outcome, the few distinct outcomes of a registration are built once.
+    """
+    status, severity, code = KNOWN_OUTCOMES[outcome]
+    return create_bundle_entry_json(status=status, severity=severity, code=code, details=details)
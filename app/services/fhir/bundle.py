@@ -1,10 +1,63 @@
-from typing import List
+import logging
+from typing import Iterable, Iterator, List
 
 from fhir.resources.R4B.bundle import Bundle, BundleEntry, BundleEntryResponse
 
+from app.data import OutcomeResponseCode, OutcomeResponseSeverity, OutcomeResponseStatusCode
+from app.services.fhir.bunde_entry_response import create_bundle_entry_json
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_RESPONSE_HEADER = b'{"resourceType":"Bundle","type":"transaction-response","entry":['
+TRANSACTION_RESPONSE_FOOTER = b"]}"
+STREAM_FAILURE_DETAILS = "Failed to register the remaining entries of the bundle"
+
 
 class BundleService:
     @staticmethod
     def from_entry_response(data: List[BundleEntryResponse]) -> Bundle:
         entries = [BundleEntry(response=response) for response in data]
         return Bundle(type="transaction-response", entry=entries)
+
+    @staticmethod
+    def from_entry_json(data: Iterable[bytes]) -> bytes:
+        """
+        Builds the JSON of a transaction-response bundle from already serialized entries.
+        """
+        return TRANSACTION_RESPONSE_HEADER + b",".join(data) + TRANSACTION_RESPONSE_FOOTER
+
+    @staticmethod
+    def stream_entry_response(data: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Writes a transaction-response bundle as JSON chunks, one entry at a time as soon as it is available.
+        Entries are written in the order of the request bundle, as a transaction-response requires, so an
+        entry finished early waits for a slow registration of an entry before it.
+        """
+        yield TRANSACTION_RESPONSE_HEADER
+        for index, entry in enumerate(BundleService._entries_until_failure(data)):
+            yield (b"," if index > 0 else b"") + entry
+        yield TRANSACTION_RESPONSE_FOOTER
+
+    @staticmethod
+    def stream_entry_response_ndjson(data: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Writes every bundle entry as a separate line of newline delimited JSON.
+        """
+        for entry in BundleService._entries_until_failure(data):
+            yield entry + b"\n"
+
+    @staticmethod
+    def _entries_until_failure(data: Iterable[bytes]) -> Iterator[bytes]:
+        # once the first chunk is sent the status code can no longer change, so a failure
+        # is reported as a final entry and the response is closed properly
+        try:
+            yield from data
+        except Exception:
+            # the cause is only logged, upstream errors are not exposed to the client
+            logger.exception("Failed to register bundle while streaming the response")
+            yield create_bundle_entry_json(
+                status=OutcomeResponseStatusCode.INTERNAL_SERVER_ERROR.value,
+                severity=OutcomeResponseSeverity.ERROR.value,
+                code=OutcomeResponseCode.EXCEPTION.value,
+                details=STREAM_FAILURE_DETAILS,
+            )
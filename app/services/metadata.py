@@ -1,18 +1,73 @@
-from typing import List, Tuple
+import logging
+from datetime import datetime
+from http import HTTPStatus
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Set, Tuple
 
 from fhir.resources.R4B.patient import Patient
+from requests import HTTPError
 
-from app.data import BSN_SYSTEM
+from app.models.metadata.fhir import Bundle, Resource
 from app.models.metadata.params import MetadataResourceParams
 from app.services.api.fhir import FhirHttpService
-from app.services.parsers.bundle import BundleParser
-from app.services.parsers.patient import PatientParser
+from app.services.parsers.metadata import MetadataBundleParser
+from app.services.parsers.reference import PATIENT_REFERENCE_ATTRIBUTES
+from app.services.synchronization.patient_cache import PatientCache
+
+logger = logging.getLogger(__name__)
+
+UPDATES_SORT_ORDER = "_lastUpdated,_id"
+
+# Resource type searched for system level searches across types
+SYSTEM = ""
+
+# Elements a search for updates reads, next to the patient reference of the searched type. identifier is
+# only read from the included Patients, servers applying _elements to included resources keep it that way.
+UPDATES_ELEMENTS = ("meta", "identifier")
+PATIENT_ELEMENTS = "meta,identifier"
+# Amount of exported patients read from the NDJSON file and cached at once
+EXPORT_PATIENT_BATCH = 10_000
 
 
 class MetadataError(Exception):
     pass
 
 
+class Watermark:
+    """
+    The _lastUpdated of the newest processed resource, and the ids of every processed resource updated at
+    exactly that instant. A _lastUpdated=ge search returns those resources again, they are recognized by id.
+    """
+
+    def __init__(self, last_updated: str | None = None, ids: Iterable[str] = ()) -> None:
+        self.last_updated = datetime.fromisoformat(last_updated) if last_updated is not None else None
+        self.ids: Set[str] = set(ids) if last_updated is not None else set()
+
+    def is_processed(self, last_updated: datetime, id: str) -> bool:
+        return last_updated == self.last_updated and id in self.ids
+
+    def advance(self, last_updated: datetime, id: str) -> None:
+        if self.last_updated is None or last_updated > self.last_updated:
+            self.last_updated = last_updated
+            self.ids = {id}
+        elif last_updated == self.last_updated:
+            self.ids.add(id)
+
+
+class UpdatePage(NamedTuple):
+    """
+    A page of updated resources. resources holds the resources of the searched type not processed before
+    this page, last_updated and last_ids hold the watermark once this page is processed. Pages of a search
+    without _include have their patients looked up by reference.
+    """
+
+    bundle: Bundle
+    resource_type: str
+    resources: List[Resource]
+    last_updated: str | None
+    last_ids: List[str]
+    includes_patients: bool = True
+
+
 class MetadataService:
     def __init__(
         self,
@@ -21,6 +76,11 @@ class MetadataService:
         mtls_cert: str | None,
         mtls_key: str | None,
         verify_ca: str | bool,
+        page_size: int = 100,
+        elements: bool = True,
+        patient_cache: PatientCache | None = None,
+        export_poll_interval: float = 5,
+        export_timeout: float = 3600,
     ) -> None:
         self.http_service = FhirHttpService(
             endpoint=endpoint,
@@ -29,6 +89,12 @@ class MetadataService:
             mtls_key=mtls_key,
             verify_ca=verify_ca,
         )
+        self._page_size = page_size
+        self._elements = elements
+        self._elements_rejected: Set[str] = set()
+        self._patient_cache = patient_cache
+        self._export_poll_interval = export_poll_interval
+        self._export_timeout = export_timeout
 
     def server_healthy(self) -> bool:
         return self.http_service.server_healthy()
@@ -44,24 +110,396 @@ class MetadataService:
         except Exception as e:
             raise MetadataError from e
 
-    def get_update_scheme(self, resource_type: str, last_updated: str | None = None) -> Tuple[List[str], str | None]:
+    def get_patients(self, patient_ids: Iterable[str]) -> List[Resource]:
+        return self.get_resources("Patient", patient_ids)
+
+    def get_resources(self, resource_type: str, resource_ids: Iterable[str]) -> List[Resource]:
+        """
+        Looks up the resources by id in bulk, with _id searches of at most page_size ids each. Resources
+        that do not exist are left out.
+        """
+        elements = PATIENT_ELEMENTS if resource_type == "Patient" else self.get_update_elements(resource_type)
+        ids = list(dict.fromkeys(resource_ids))
+        resources: List[Resource] = []
+        for start in range(0, len(ids), self._page_size):
+            chunk = ids[start : start + self._page_size]
+            params = MetadataResourceParams(
+                _id=",".join(chunk),
+                _elements=elements if self._elements else None,
+                _count=len(chunk),
+            )
+            bundle = self.__search(resource_type, params)
+            resources.extend(MetadataBundleParser.get_resources_of_type(bundle, resource_type))
+        return resources
+
+    def refresh_patient_cache(self) -> None:
+        """
+        Refreshes the cached patients updated since the newest Patient the cache has seen, so a changed BSN
+        is picked up without searching the patients of every update again.
+        """
+        if self._patient_cache is None or self._patient_cache.last_updated is None:
+            return
+
+        params = MetadataResourceParams(
+            _lastUpdated=f"ge{self._patient_cache.last_updated}",
+            _elements=PATIENT_ELEMENTS if self._elements else None,
+            _sort="_lastUpdated",
+            _count=self._page_size,
+        )
+        bundle = self.__search("Patient", params)
+        while True:
+            self._patient_cache.update(MetadataBundleParser.get_patients(bundle).values(), known_only=True)
+
+            next_link = MetadataBundleParser.get_next_link(bundle)
+            if next_link is None:
+                return
+
+            bundle = self.http_service.get_metadata_page(next_link)
+
+    def clear_patient_cache(self) -> None:
+        if self._patient_cache is not None:
+            self._patient_cache.clear()
+
+    def save_patient_cache(self) -> None:
+        if self._patient_cache is not None:
+            self._patient_cache.save()
+
+    def count_updates(self, resource_type: str, last_updated: str | None = None) -> int | None:
+        """
+        Counts the resources updated after last_updated in a single _summary=count search, or returns None
+        when the server does not report a total. A resource updated at exactly last_updated after it was
+        processed is not counted, it is found by the next search that does run.
+        """
+        params = MetadataResourceParams(
+            _lastUpdated=f"gt{last_updated}" if last_updated is not None else None,
+            _summary="count",
+        )
+        return self.__search(resource_type, params).total
+
+    def count_system_updates(self, resource_types: List[str], last_updated: str | None = None) -> int | None:
+        """
+        Counts like count_updates, across resource_types in a single system level search.
+        """
         params = MetadataResourceParams(
-            _lastUpdated=f"ge{last_updated}" if last_updated else None,
-            _include=f"{resource_type}:subject",
+            _type=",".join(resource_types),
+            _lastUpdated=f"gt{last_updated}" if last_updated is not None else None,
+            _summary="count",
         )
-        bundle = self.http_service.search(
-            resource_type=str(resource_type),
+        return self.__search(SYSTEM, params).total
+
+    def count_range(self, resource_type: str, start: str, end: str) -> int | None:
+        """
+        Counts the resources last updated from start up to (not including) end, or returns None when the
+        server does not report a total.
+        """
+        params = MetadataResourceParams(_lastUpdated=[f"ge{start}", f"lt{end}"], _summary="count")
+        return self.__search(resource_type, params).total
+
+    def search_updates(
+        self,
+        resource_type: str,
+        last_updated: str | None = None,
+        last_ids: Iterable[str] = (),
+        until: str | None = None,
+    ) -> Iterator[UpdatePage]:
+        """
+        Yields the pages of resources updated since last_updated, in _lastUpdated, _id order, leaving out the
+        resources last_ids processed at the last_updated instant. With until, only resources last updated
+        before it are searched. Pages are requested by keyset: every request searches from the _lastUpdated
+        of the last resource seen, so resources updated during the run cannot shift a page boundary and be
+        skipped. Only when a whole page shares the timestamp it was searched from is the next link followed
+        instead.
+        """
+        watermark = Watermark(last_updated, last_ids)
+        searched_from = watermark.last_updated
+        bundle = self.__search_from(resource_type, searched_from, until)
+        while True:
+            resources: List[Resource] = []
+            for resource in MetadataBundleParser.get_resources_of_type(bundle, resource_type):
+                resource_updated = resource.meta.last_updated if resource.meta is not None else None
+                if resource_updated is None or resource.id is None:
+                    resources.append(resource)
+                    continue
+
+                if watermark.is_processed(resource_updated, resource.id):
+                    continue
+
+                resources.append(resource)
+                watermark.advance(resource_updated, resource.id)
+
+            yield UpdatePage(
+                bundle=bundle,
+                resource_type=resource_type,
+                resources=resources,
+                last_updated=watermark.last_updated.isoformat() if watermark.last_updated is not None else None,
+                last_ids=sorted(watermark.ids),
+            )
+
+            next_link = MetadataBundleParser.get_next_link(bundle)
+            if next_link is None:
+                return
+
+            if watermark.last_updated is not None and (searched_from is None or watermark.last_updated > searched_from):
+                searched_from = watermark.last_updated
+                bundle = self.__search_from(resource_type, searched_from, until)
+            else:
+                bundle = self.http_service.get_metadata_page(next_link)
+
+    def search_system_updates(self, watermarks: Mapping[str, Tuple[str | None, Iterable[str]]]) -> Iterator[UpdatePage]:
+        """
+        Searches the updates of several resource types like search_updates, but in one system level search
+        from the oldest of their watermarks. Every result page is split into a page per resource type that
+        carries the watermark of that type. Resources older than the watermark of their own type were
+        processed before and are left out.
+        """
+        resource_types = list(watermarks.keys())
+        domain_watermarks = {
+            resource_type: Watermark(last_updated, last_ids)
+            for resource_type, (last_updated, last_ids) in watermarks.items()
+        }
+        starts = [watermark.last_updated for watermark in domain_watermarks.values()]
+        searched_from = None if any(start is None for start in starts) else min(s for s in starts if s is not None)
+        newest = searched_from
+        bundle = self.__search_system_from(resource_types, searched_from)
+        while True:
+            for resource_type, watermark in domain_watermarks.items():
+                resources: List[Resource] = []
+                for resource in MetadataBundleParser.get_resources_of_type(bundle, resource_type):
+                    resource_updated = resource.meta.last_updated if resource.meta is not None else None
+                    if resource_updated is None or resource.id is None:
+                        resources.append(resource)
+                        continue
+
+                    if newest is None or resource_updated > newest:
+                        newest = resource_updated
+                    if watermark.last_updated is not None and resource_updated < watermark.last_updated:
+                        continue
+                    if watermark.is_processed(resource_updated, resource.id):
+                        continue
+
+                    resources.append(resource)
+                    watermark.advance(resource_updated, resource.id)
+
+                yield UpdatePage(
+                    bundle=bundle,
+                    resource_type=resource_type,
+                    resources=resources,
+                    last_updated=watermark.last_updated.isoformat() if watermark.last_updated is not None else None,
+                    last_ids=sorted(watermark.ids),
+                )
+
+            next_link = MetadataBundleParser.get_next_link(bundle)
+            if next_link is None:
+                return
+
+            if newest is not None and (searched_from is None or newest > searched_from):
+                searched_from = newest
+                bundle = self.__search_system_from(resource_types, searched_from)
+            else:
+                bundle = self.http_service.get_metadata_page(next_link)
+
+    def search_history(
+        self, resource_type: str, last_updated: str | None = None, last_ids: Iterable[str] = ()
+    ) -> Iterator[UpdatePage]:
+        """
+        Yields the pages of the _history of resource_type since last_updated, leaving out the versions
+        last_ids processed at the last_updated instant. Every version is read, so updates sharing a
+        timestamp are not missed; deletes carry no resource and are passed over. A history lists the newest
+        versions first, so only the last page carries the new watermark.
+        """
+        if resource_type not in PATIENT_REFERENCE_ATTRIBUTES:
+            raise MetadataError(f"{resource_type} has no patient reference to read from its history")
+
+        cursor = Watermark(last_updated, last_ids)
+        newest = Watermark(last_updated, last_ids)
+        params = MetadataResourceParams(_since=last_updated, _count=self._page_size)
+        bundle = self.http_service.history_metadata(
+            resource_type=resource_type,
             params=params.model_dump(by_alias=True, exclude_none=True),
         )
+        while True:
+            resources: List[Resource] = []
+            for resource in MetadataBundleParser.get_resources_of_type(bundle, resource_type):
+                meta = resource.meta
+                if meta is None or meta.last_updated is None or resource.id is None:
+                    resources.append(resource)
+                    continue
+
+                version = f"{resource.id}/_history/{meta.version_id}"
+                if cursor.is_processed(meta.last_updated, version):
+                    continue
+
+                resources.append(resource)
+                newest.advance(meta.last_updated, version)
+
+            next_link = MetadataBundleParser.get_next_link(bundle)
+            watermark = newest if next_link is None else cursor
+            yield UpdatePage(
+                bundle=bundle,
+                resource_type=resource_type,
+                resources=resources,
+                last_updated=watermark.last_updated.isoformat() if watermark.last_updated is not None else None,
+                last_ids=sorted(watermark.ids),
+                includes_patients=False,
+            )
+
+            if next_link is None:
+                return
+
+            bundle = self.http_service.get_metadata_page(next_link)
+
+    def export_updates(self, resource_type: str) -> Iterator[UpdatePage]:
+        """
+        Yields the resources of resource_type from a Bulk Data $export, page_size at a time as the NDJSON
+        files are read. With a patient cache the Patients are exported along and cached first. The last
+        page carries the transaction time of the export, the watermark to synchronize on from.
+        """
+        if resource_type not in PATIENT_REFERENCE_ATTRIBUTES:
+            raise MetadataError(f"{resource_type} has no patient reference to read from an export")
+
+        resource_types = [resource_type] if self._patient_cache is None else [resource_type, "Patient"]
+        status_url = self.http_service.kick_off_export(resource_types)
+        manifest = self.http_service.wait_for_export(status_url, self._export_poll_interval, self._export_timeout)
+        for error in manifest.error:
+            logger.warning(f"Export of {resource_type} reported errors in {error.url}")
+
+        if self._patient_cache is not None:
+            for output in manifest.output:
+                if output.type == "Patient":
+                    for patients in self.__read_ndjson(output.url, EXPORT_PATIENT_BATCH):
+                        self._patient_cache.update(patients)
+
+        for output in manifest.output:
+            if output.type == resource_type:
+                for resources in self.__read_ndjson(output.url, self._page_size):
+                    yield UpdatePage(
+                        bundle=Bundle(),
+                        resource_type=resource_type,
+                        resources=resources,
+                        last_updated=None,
+                        last_ids=[],
+                        includes_patients=False,
+                    )
+
+        yield UpdatePage(
+            bundle=Bundle(),
+            resource_type=resource_type,
+            resources=[],
+            last_updated=manifest.transaction_time,
+            last_ids=[],
+            includes_patients=False,
+        )
+
+    @staticmethod
+    def get_update_elements(resource_type: str) -> str | None:
+        """
+        Returns the _elements projection of a search for updates of resource_type, or None when the patient
+        reference of the type is not known and full resources are needed.
+        """
+        attribute = PATIENT_REFERENCE_ATTRIBUTES.get(resource_type)
+        if attribute is None:
+            return None
+
+        return ",".join((*UPDATES_ELEMENTS, attribute))
 
-        latest_resource_update = BundleParser.get_latest_timestamp(bundle)
-        if bundle.entry is None:
-            return [], latest_resource_update
+    def parse_update_page(self, page: UpdatePage) -> List[str]:
+        """
+        Returns the BSNs of the patients the resources of the page refer to. With a patient cache, or for
+        pages without included patients, they are looked up by reference, otherwise taken from the included
+        patients. For resource types without a single patient reference all included patients are used.
+        """
+        if self.__uses_patient_cache(page.resource_type) or not page.includes_patients:
+            return self.__get_referenced_bsns(page.resources)
 
-        patients = BundleParser.get_patients(bundle)
-        identifiers = PatientParser.get_identifiers(patients)
+        patients = MetadataBundleParser.get_patients(page.bundle)
+        if page.resource_type in PATIENT_REFERENCE_ATTRIBUTES:
+            referenced: Dict[str, Resource] = {}
+            for resource in page.resources:
+                patient_id = MetadataBundleParser.get_patient_id(resource)
+                if patient_id is not None and patient_id in patients:
+                    referenced[patient_id] = patients[patient_id]
+            return MetadataBundleParser.get_bsns(list(referenced.values()))
 
-        matched_identifiers = [
-            identifier.value for identifier in identifiers if identifier.value if identifier.system == BSN_SYSTEM
+        if len(page.resources) == 0:
+            return []
+
+        return MetadataBundleParser.get_bsns(list(patients.values()))
+
+    def __read_ndjson(self, url: str, size: int) -> Iterator[List[Resource]]:
+        resources: List[Resource] = []
+        for line in self.http_service.stream_ndjson(url):
+            resources.append(Resource.model_validate_json(line))
+            if len(resources) == size:
+                yield resources
+                resources = []
+
+        if len(resources) > 0:
+            yield resources
+
+    def __uses_patient_cache(self, resource_type: str) -> bool:
+        return self._patient_cache is not None and resource_type in PATIENT_REFERENCE_ATTRIBUTES
+
+    def __get_referenced_bsns(self, resources: List[Resource]) -> List[str]:
+        patient_ids = [
+            patient_id
+            for patient_id in dict.fromkeys(MetadataBundleParser.get_patient_id(resource) for resource in resources)
+            if patient_id is not None
         ]
-        return matched_identifiers, latest_resource_update
+        if self._patient_cache is None:
+            return MetadataBundleParser.get_bsns(self.get_patients(patient_ids))
+
+        unknown = [patient_id for patient_id in patient_ids if self._patient_cache.get(patient_id) is None]
+        if len(unknown) > 0:
+            self._patient_cache.update(self.get_patients(unknown), advance=False)
+
+        bsns: List[str] = []
+        for patient_id in patient_ids:
+            cached = self._patient_cache.get(patient_id)
+            if cached is not None and cached.bsn is not None:
+                bsns.append(cached.bsn)
+        return bsns
+
+    def __search_from(self, resource_type: str, last_updated: datetime | None, until: str | None = None) -> Bundle:
+        since = f"ge{last_updated.isoformat()}" if last_updated else None
+        params = MetadataResourceParams(
+            _lastUpdated=[bound for bound in (since, f"lt{until}") if bound is not None] if until else since,
+            _include=None if self.__uses_patient_cache(resource_type) else f"{resource_type}:subject",
+            _elements=self.get_update_elements(resource_type) if self._elements else None,
+            _sort=UPDATES_SORT_ORDER,
+            _count=self._page_size,
+        )
+        return self.__search(resource_type, params)
+
+    def __search_system_from(self, resource_types: List[str], last_updated: datetime | None) -> Bundle:
+        included = [resource_type for resource_type in resource_types if not self.__uses_patient_cache(resource_type)]
+        attributes = dict.fromkeys(PATIENT_REFERENCE_ATTRIBUTES[resource_type] for resource_type in resource_types)
+        params = MetadataResourceParams(
+            _type=",".join(resource_types),
+            _lastUpdated=f"ge{last_updated.isoformat()}" if last_updated else None,
+            _include=[f"{resource_type}:subject" for resource_type in included] or None,
+            _elements=",".join((*UPDATES_ELEMENTS, *attributes)) if self._elements else None,
+            _sort=UPDATES_SORT_ORDER,
+            _count=self._page_size,
+        )
+        return self.__search(SYSTEM, params)
+
+    def __search(self, resource_type: str, params: MetadataResourceParams) -> Bundle:
+        """
+        Servers ignoring _elements return full resources, which the metadata models read all the same. A
+        server rejecting it is searched without _elements for the resource type from then on.
+        """
+        if resource_type in self._elements_rejected:
+            params = params.model_copy(update={"elements": None})
+
+        try:
+            return self.http_service.search_metadata(
+                resource_type=resource_type,
+                params=params.model_dump(by_alias=True, exclude_none=True),
+            )
+        except HTTPError as e:
+            if params.elements is None or e.response is None or e.response.status_code != HTTPStatus.BAD_REQUEST:
+                raise
+
+            logger.warning(f"Metadata server rejected _elements for {resource_type}, searching full resources")
+            self._elements_rejected.add(resource_type)
+            return self.__search(resource_type, params)
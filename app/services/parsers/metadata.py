@@ -0,0 +1,64 @@
+from typing import Dict, List
+
+from app.data import BSN_SYSTEM
+from app.models.metadata.fhir import Bundle, Reference, Resource
+from app.services.parsers.reference import PATIENT_REFERENCE_ATTRIBUTES
+
+
+class MetadataBundleParser:
+    """
+    Reads the slim metadata bundles of the synchronization, the counterpart of BundleParser for the
+    fhir.resources models.
+    """
+
+    @staticmethod
+    def get_next_link(bundle: Bundle) -> str | None:
+        for link in bundle.link:
+            if link.relation == "next" and link.url:
+                return link.url
+
+        return None
+
+    @staticmethod
+    def get_resources_of_type(bundle: Bundle, resource_type: str) -> List[Resource]:
+        return [
+            entry.resource
+            for entry in bundle.entry or []
+            if entry.resource is not None and entry.resource.resource_type == resource_type
+        ]
+
+    @staticmethod
+    def get_patients(bundle: Bundle) -> Dict[str, Resource]:
+        return {
+            patient.id: patient
+            for patient in MetadataBundleParser.get_resources_of_type(bundle, "Patient")
+            if patient.id is not None
+        }
+
+    @staticmethod
+    def get_patient_id(resource: Resource) -> str | None:
+        """
+        Returns the id of the Patient the resource refers to by a relative reference, if any.
+        """
+        attribute = PATIENT_REFERENCE_ATTRIBUTES.get(resource.resource_type)
+        if attribute is None:
+            return None
+
+        reference = getattr(resource, attribute)
+        if not isinstance(reference, Reference) or reference.reference is None:
+            return None
+
+        parts = reference.reference.split("/")
+        if len(parts) < 2 or parts[0] != "Patient" or not parts[1]:
+            return None
+
+        return parts[1]
+
+    @staticmethod
+    def get_bsns(patients: List[Resource]) -> List[str]:
+        return [
+            identifier.value
+            for patient in patients
+            for identifier in patient.identifier or []
+            if identifier.value and identifier.system == BSN_SYSTEM
+        ]
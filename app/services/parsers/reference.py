@@ -1,110 +1,82 @@
 import logging
-from typing import Tuple
+from typing import Dict, Tuple
 
-from fhir.resources.R4B.allergyintolerance import AllergyIntolerance
-from fhir.resources.R4B.bodystructure import BodyStructure
-from fhir.resources.R4B.careplan import CarePlan
-from fhir.resources.R4B.careteam import CareTeam
-from fhir.resources.R4B.clinicalimpression import ClinicalImpression
-from fhir.resources.R4B.detectedissue import DetectedIssue
-from fhir.resources.R4B.diagnosticreport import DiagnosticReport
 from fhir.resources.R4B.domainresource import DomainResource
-from fhir.resources.R4B.encounter import Encounter
-from fhir.resources.R4B.familymemberhistory import FamilyMemberHistory
-from fhir.resources.R4B.imagingstudy import ImagingStudy
-from fhir.resources.R4B.immunization import Immunization
-from fhir.resources.R4B.immunizationevaluation import ImmunizationEvaluation
-from fhir.resources.R4B.immunizationrecommendation import ImmunizationRecommendation
-from fhir.resources.R4B.measurereport import MeasureReport
-from fhir.resources.R4B.medicationadministration import MedicationAdministration
-from fhir.resources.R4B.medicationdispense import MedicationDispense
-from fhir.resources.R4B.medicationrequest import MedicationRequest
-from fhir.resources.R4B.medicationstatement import MedicationStatement
-from fhir.resources.R4B.molecularsequence import MolecularSequence
-from fhir.resources.R4B.nutritionorder import NutritionOrder
-from fhir.resources.R4B.observation import Observation
-from fhir.resources.R4B.procedure import Procedure
 from fhir.resources.R4B.reference import Reference
-from fhir.resources.R4B.riskassessment import RiskAssessment
 
 logger = logging.getLogger(__name__)
 
 
+# Attribute holding the single patient reference, per R4B resource type that has a "patient" or "subject"
+# reference which may point to a Patient. Resources with a list of subjects are not included.
+PATIENT_REFERENCE_ATTRIBUTES: Dict[str, str] = {
+    "AdverseEvent": "subject",
+    "AllergyIntolerance": "patient",
+    "Basic": "subject",
+    "BodyStructure": "patient",
+    "CarePlan": "subject",
+    "CareTeam": "subject",
+    "ChargeItem": "subject",
+    "Claim": "patient",
+    "ClaimResponse": "patient",
+    "ClinicalImpression": "subject",
+    "Communication": "subject",
+    "CommunicationRequest": "subject",
+    "Composition": "subject",
+    "Condition": "subject",
+    "Consent": "patient",
+    "CoverageEligibilityRequest": "patient",
+    "CoverageEligibilityResponse": "patient",
+    "DetectedIssue": "patient",
+    "Device": "patient",
+    "DeviceRequest": "subject",
+    "DeviceUseStatement": "subject",
+    "DiagnosticReport": "subject",
+    "DocumentManifest": "subject",
+    "DocumentReference": "subject",
+    "Encounter": "subject",
+    "EpisodeOfCare": "patient",
+    "ExplanationOfBenefit": "patient",
+    "FamilyMemberHistory": "patient",
+    "Flag": "subject",
+    "Goal": "subject",
+    "GuidanceResponse": "subject",
+    "ImagingStudy": "subject",
+    "Immunization": "patient",
+    "ImmunizationEvaluation": "patient",
+    "ImmunizationRecommendation": "patient",
+    "Invoice": "subject",
+    "List": "subject",
+    "MeasureReport": "subject",
+    "Media": "subject",
+    "MedicationAdministration": "subject",
+    "MedicationDispense": "subject",
+    "MedicationRequest": "subject",
+    "MedicationStatement": "subject",
+    "MolecularSequence": "patient",
+    "NutritionOrder": "patient",
+    "Observation": "subject",
+    "Procedure": "subject",
+    "QuestionnaireResponse": "subject",
+    "RelatedPerson": "patient",
+    "RequestGroup": "subject",
+    "RiskAssessment": "subject",
+    "ServiceRequest": "subject",
+    "Specimen": "subject",
+    "SupplyDelivery": "patient",
+    "VisionPrescription": "patient",
+}
+
+
 class ReferenceParser:
     @staticmethod
     def get_patient_reference(resource: DomainResource) -> Reference | None:
-        match resource:
-            case AllergyIntolerance():
-                return resource.patient
-
-            case BodyStructure():
-                return resource.patient
-
-            case ImagingStudy():
-                return resource.subject
-
-            case CarePlan():
-                return resource.subject
-
-            case CareTeam():
-                return resource.subject
-
-            case ClinicalImpression():
-                return resource.subject
-
-            case Encounter():
-                return resource.subject
-
-            case DetectedIssue():
-                return resource.patient
-
-            case DiagnosticReport():
-                return resource.subject
-
-            case FamilyMemberHistory():
-                return resource.patient
-
-            case MedicationStatement():
-                return resource.subject
-
-            case MedicationAdministration():
-                return resource.subject
-
-            case MedicationDispense():
-                return resource.subject
-
-            case MedicationRequest():
-                return resource.subject
-
-            case Immunization():
-                return resource.patient
-
-            case ImmunizationEvaluation():
-                return resource.patient
-
-            case ImmunizationRecommendation():
-                return resource.patient
-
-            case MeasureReport():
-                return resource.subject
-
-            case MolecularSequence():
-                return resource.patient
-
-            case NutritionOrder():
-                return resource.patient
-
-            case Observation():
-                return resource.subject
-
-            case Procedure():
-                return resource.subject
-
-            case RiskAssessment():
-                return resource.subject
+        attribute = PATIENT_REFERENCE_ATTRIBUTES.get(resource.get_resource_type())
+        if attribute is None:
+            return None
 
-            case _:
-                return None
+        reference: Reference | None = getattr(resource, attribute)
+        return reference
 
     @staticmethod
     def get_reference_type_and_id(
@@ -0,0 +1,125 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Dict, List, Tuple
+
+from app.models.referrals import Referral
+from app.services.nvi import NviService
+from app.services.pseudonym import PseudonymService
+from app.services.registration.referrals import ReferralRegistrationService
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingReferralRegistrationService(ReferralRegistrationService):
+    """
+    Coalescing layer in front of the referral registration. Registrations arriving within
+    a short window (or until max_items are collected) are collected in one batch, registrations
+    for the same BSN within that batch share a single PRS and NVI round trip and the result is
+    fanned back out to every waiting caller.
+
+    The PRS and NVI have no batch endpoint, so every unique BSN is still registered on its own:
+    this only deduplicates concurrent registrations of the same BSN, while every registration
+    first waits up to window_ms. It is therefore off by default (batching_enabled).
+
+    Only register goes through the batch. The synchronization pipeline calls calculate_subject and
+    register_subject in separate stages, with their own workers, and already handles every BSN of
+    a page once, so it is left out.
+    """
+
+    def __init__(
+        self,
+        nvi_service: NviService,
+        pseudonym_service: PseudonymService,
+        nvi_oin: str,
+        window_ms: float = 5,
+        max_items: int = 50,
+        workers: int = 8,
+    ) -> None:
+        super().__init__(nvi_service=nvi_service, pseudonym_service=pseudonym_service, nvi_oin=nvi_oin)
+        self._window = window_ms / 1000
+        self._max_items = max_items
+        # None stops the dispatcher, after the registrations queued before it are dispatched
+        self._pending: Queue[Tuple[str, Future[Referral | None]] | None] = Queue()
+        self._pending_lock = Lock()
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="registration-batch")
+        self._dispatcher = Thread(target=self.__dispatch, name="registration-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def register(self, bsn: str) -> Referral | None:
+        return self.submit(bsn).result()
+
+    def submit(self, bsn: str) -> "Future[Referral | None]":
+        future: Future[Referral | None] = Future()
+        with self._pending_lock:
+            if self._stopped:
+                raise RuntimeError("Registration batcher is shut down")
+            self._pending.put((bsn, future))
+        return future
+
+    def shutdown(self) -> None:
+        """
+        Stops accepting registrations and waits for the ones already submitted to complete.
+        """
+        with self._pending_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._pending.put(None)
+
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def __dispatch(self) -> None:
+        while True:
+            first = self._pending.get()
+            if first is None:
+                return
+
+            batch = [first]
+            stopping = False
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._pending.get(timeout=remaining)
+                except Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+
+            self.__register_batch(batch)
+            if stopping:
+                return
+
+    def __register_batch(self, batch: List[Tuple[str, "Future[Referral | None]"]]) -> None:
+        waiting: Dict[str, List[Future[Referral | None]]] = {}
+        for bsn, future in batch:
+            if future.set_running_or_notify_cancel():
+                waiting.setdefault(bsn, []).append(future)
+
+        logger.debug(f"Dispatching batch of {len(batch)} registrations for {len(waiting)} unique BSNs")
+        for bsn, futures in waiting.items():
+            registration = self._executor.submit(super().register, bsn)
+            registration.add_done_callback(partial(self.__fan_out, futures))
+
+    @staticmethod
+    def __fan_out(futures: List["Future[Referral | None]"], registration: "Future[Referral | None]") -> None:
+        exception = registration.exception()
+        if exception is not None:
+            for future in futures:
+                future.set_exception(exception)
+            return
+
+        # only the first caller created the referral, the others registered an existing one
+        futures[0].set_result(registration.result())
+        for future in futures[1:]:
+            future.set_result(None)
@@ -0,0 +1,76 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Set
+
+from app.data import OutcomeResponseCode, OutcomeResponseSeverity, OutcomeResponseStatusCode
+from app.exceptions.fhir_exception import FHIRException
+from app.models.bsn import validate_bsns
+from app.models.referrals import Referral
+from app.models.registration import BsnRegistrationStatus
+from app.services.registration.referrals import ReferralRegistrationService
+
+logger = logging.getLogger(__name__)
+
+REGISTRATION_FAILURE_DETAILS = "Failed to register BSN"
+
+
+class BsnListRegistrationService:
+    """
+    Registers a plain list of BSNs, for integrations that already know the BSNs of their patients
+    and have no need to build a FHIR bundle first.
+    """
+
+    def __init__(
+        self,
+        referrals_service: ReferralRegistrationService,
+        max_workers: int = 8,
+        max_items: int = 1000,
+    ) -> None:
+        self._referrals_service = referrals_service
+        self._max_workers = max_workers
+        self._max_items = max_items
+
+    def register(self, bsns: List[str]) -> List[BsnRegistrationStatus]:
+        """
+        Registers every valid unique BSN once, concurrently, and returns a status per BSN in the order given.
+        An invalid BSN gets the reason it is invalid, a failing registration only fails the status of that BSN.
+        """
+        if len(bsns) > self._max_items:
+            raise FHIRException(
+                status_code=OutcomeResponseStatusCode.BAD_REQUEST.value,
+                severity=OutcomeResponseSeverity.ERROR.value,
+                code=OutcomeResponseCode.INVALID.value,
+                msg=f"At most {self._max_items} BSNs can be registered at once",
+            )
+
+        candidates = list(dict.fromkeys(bsns))
+        errors = dict(zip(candidates, validate_bsns(candidates).reasons))
+        unique_bsns = [bsn for bsn, error in errors.items() if error is None]
+        futures: Dict[str, Future[Referral | None]] = {}
+        if len(unique_bsns) > 0:
+            with ThreadPoolExecutor(
+                max_workers=min(self._max_workers, len(unique_bsns)),
+                thread_name_prefix="bsn-registration",
+            ) as executor:
+                futures = {bsn: executor.submit(self._referrals_service.register, bsn=bsn) for bsn in unique_bsns}
+
+        registered: Set[str] = set()
+        statuses: List[BsnRegistrationStatus] = []
+        for bsn in bsns:
+            future = futures.get(bsn)
+            if future is None:
+                statuses.append(BsnRegistrationStatus(bsn=bsn, status="invalid", details=errors[bsn]))
+                continue
+
+            exception = future.exception()
+            if exception is not None:
+                logger.error(f"Failed to register BSN: {exception}")
+                # the cause is only logged, upstream errors are not exposed to the client
+                statuses.append(BsnRegistrationStatus(bsn=bsn, status="error", details=REGISTRATION_FAILURE_DETAILS))
+            elif future.result() is None or bsn in registered:
+                statuses.append(BsnRegistrationStatus(bsn=bsn, status="exists"))
+            else:
+                statuses.append(BsnRegistrationStatus(bsn=bsn, status="created"))
+            registered.add(bsn)
+
+        return statuses
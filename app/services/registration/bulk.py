@@ -0,0 +1,335 @@
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from queue import Queue
+from threading import Thread
+from typing import Any, BinaryIO, Iterator, List, Tuple
+
+import orjson
+from pydantic import ValidationError
+
+from app.data import BSN_SYSTEM, OutcomeResponseCode, OutcomeResponseSeverity, OutcomeResponseStatusCode
+from app.exceptions.fhir_exception import FHIRException
+from app.models.bulk import BulkJob, BulkResultsPage
+from app.models.registration import ResolvedEntry
+from app.services.fhir.bunde_entry_response import (
+    KnownBundleRegistrationOutcome,
+    create_bundle_entry_json,
+    create_known_entry_json,
+)
+from app.services.registration.bundle import BundleRegistrationService, reject_invalid_bsns
+from app.services.storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+INPUT_FILE = "input.ndjson"
+RESULTS_FILE = "results.ndjson"
+# byte offset of every result line in the results file, as fixed size entries, to seek to a page of results
+RESULTS_INDEX_FILE = "results.index"
+RESULTS_INDEX_ENTRY = struct.Struct("<Q")
+STATE_FILE = "state.json"
+LINE_FAILURE_DETAILS = "Failed to register the line"
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BulkRegistrationService:
+    """
+    Registers NDJSON uploads in the background. Every line holds either a Bundle or a patient identifier
+    (an Identifier with the BSN system or a plain BSN string). Jobs are handled one after another, the lines
+    of a job with bounded concurrency. Progress and per-line results are kept in the job directory, so an
+    unfinished job continues where it left off after a restart. Without a storage_dir the jobs are kept in a
+    temporary directory, which is not found again after a restart.
+    """
+
+    def __init__(
+        self,
+        bundle_registration_service: BundleRegistrationService,
+        storage_dir: str | None = None,
+        workers: int = 4,
+        max_page_size: int = 1000,
+    ) -> None:
+        if not storage_dir:
+            storage_dir = tempfile.mkdtemp(prefix="bulk-registration-")
+            logger.warning(f"No bulk registration storage_dir configured, jobs are kept in {storage_dir}")
+
+        self._bundle_registration_service = bundle_registration_service
+        self._storage_dir = storage_dir
+        self._max_page_size = max_page_size
+        self._chunk_size = workers * 4
+        self._jobs: Queue[str] = Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-registration")
+        self._dispatcher = Thread(target=self.__dispatch, name="bulk-registration-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def create_job(self) -> BulkJob:
+        """
+        Creates a job awaiting its upload, the upload is written to the input path of the job.
+        """
+        now = datetime.now(timezone.utc)
+        job = BulkJob(id=uuid.uuid4().hex, status="uploading", created=now, updated=now)
+        os.makedirs(self.__job_dir(job.id))
+        self.__save(job)
+        return job
+
+    def input_path(self, job_id: str) -> str:
+        return os.path.join(self.__job_dir(job_id), INPUT_FILE)
+
+    def submit(self, job_id: str) -> BulkJob:
+        """
+        Accepts a completely uploaded job and queues it for processing.
+        """
+        job = self.get_job(job_id)
+        with open(self.input_path(job_id), "rb") as file:
+            total_lines = sum(1 for _ in self.__numbered_lines(file))
+
+        if total_lines == 0:
+            self.delete_job(job_id)
+            raise FHIRException(
+                status_code=OutcomeResponseStatusCode.BAD_REQUEST.value,
+                severity=OutcomeResponseSeverity.ERROR.value,
+                code=OutcomeResponseCode.INVALID.value,
+                msg="Bulk upload without lines",
+            )
+
+        job = self.__update(job, status="accepted", total_lines=total_lines)
+        self._jobs.put(job.id)
+        return job
+
+    def resume(self) -> List[str]:
+        """
+        Queues the unfinished jobs found in storage again, jobs of an interrupted upload are removed.
+        """
+        if not os.path.isdir(self._storage_dir):
+            return []
+
+        jobs: List[BulkJob] = []
+        for job_id in os.listdir(self._storage_dir):
+            if not JOB_ID_PATTERN.match(job_id) or not os.path.exists(self.__state_path(job_id)):
+                continue
+
+            job = self.__load(job_id)
+            if job.status == "uploading":
+                self.delete_job(job_id)
+            elif job.status in ("accepted", "in-progress"):
+                jobs.append(job)
+
+        for job in sorted(jobs, key=lambda job: job.created):
+            logger.info(f"Resuming bulk registration job {job.id} at line {job.processed_lines}")
+            self._jobs.put(job.id)
+
+        return [job.id for job in jobs]
+
+    def get_job(self, job_id: str) -> BulkJob:
+        if not JOB_ID_PATTERN.match(job_id) or not os.path.exists(self.__state_path(job_id)):
+            raise FHIRException(
+                status_code=OutcomeResponseStatusCode.NOT_FOUND.value,
+                severity=OutcomeResponseSeverity.ERROR.value,
+                code=OutcomeResponseCode.NOT_FOUND.value,
+                msg=f"Bulk registration job {job_id} not found",
+            )
+
+        return self.__load(job_id)
+
+    def delete_job(self, job_id: str) -> None:
+        shutil.rmtree(self.__job_dir(job_id), ignore_errors=True)
+
+    def get_results(self, job_id: str, offset: int, count: int) -> BulkResultsPage:
+        job = self.get_job(job_id)
+        count = min(count, self._max_page_size, max(job.processed_lines - offset, 0))
+
+        results: List[Any] = []
+        if count > 0:
+            with open(os.path.join(self.__job_dir(job_id), RESULTS_FILE), "rb") as file:
+                file.seek(self.__result_position(job_id, offset))
+                for line in islice(file, count):
+                    results.append(orjson.loads(line))
+
+        end = offset + len(results)
+        return BulkResultsPage(
+            job_id=job_id,
+            offset=offset,
+            count=len(results),
+            total=job.processed_lines,
+            next_offset=end if end < job.processed_lines else None,
+            results=results,
+        )
+
+    def __dispatch(self) -> None:
+        while True:
+            job_id = self._jobs.get()
+            try:
+                self.__process(job_id)
+            except Exception as e:
+                logger.exception(f"Bulk registration job {job_id} failed")
+                try:
+                    self.__update(self.__load(job_id), status="failed", error=f"{e}")
+                except (OSError, ValueError) as update_error:
+                    logger.error(f"Failed to mark bulk registration job {job_id} as failed: {update_error}")
+
+    def __process(self, job_id: str) -> None:
+        processed_lines, error_lines = self.__recover_results(job_id)
+        job = self.__update(
+            self.__load(job_id), status="in-progress", processed_lines=processed_lines, error_lines=error_lines
+        )
+
+        with (
+            open(self.input_path(job_id), "rb") as source,
+            open(os.path.join(self.__job_dir(job_id), RESULTS_FILE), "ab") as target,
+            open(os.path.join(self.__job_dir(job_id), RESULTS_INDEX_FILE), "ab") as index,
+        ):
+            lines = islice(self.__numbered_lines(source), job.processed_lines, None)
+            while chunk := list(islice(lines, self._chunk_size)):
+                results = list(self._executor.map(self.__process_line, self.__resolve_identifiers(chunk)))
+                position = target.tell()
+                target.write(b"".join(result + b"\n" for result in results))
+                target.flush()
+                for result in results:
+                    index.write(RESULTS_INDEX_ENTRY.pack(position))
+                    position += len(result) + 1
+                index.flush()
+
+                job = self.__update(
+                    job,
+                    processed_lines=job.processed_lines + len(results),
+                    error_lines=job.error_lines + sum(1 for result in results if self.__has_error(result)),
+                )
+
+        self.__update(job, status="completed")
+        logger.info(f"Bulk registration job {job_id} completed with {job.error_lines} failed lines")
+
+    def __process_line(self, prepared_line: Tuple[int, bytes, ResolvedEntry | None]) -> bytes:
+        number, line, identifier = prepared_line
+        try:
+            if identifier is None:
+                entries = list(self._bundle_registration_service.register_json_iter(line))
+            else:
+                entries = list(self._bundle_registration_service.register_resolved_json([identifier]))
+        except FHIRException as e:
+            entries = [orjson.dumps({"response": {"status": str(e.status_code), "outcome": e.detail}})]
+        except ValidationError as e:
+            entries = [
+                create_known_entry_json(KnownBundleRegistrationOutcome.ERROR, f"Invalid bundle: {e.errors()[0]['msg']}")
+            ]
+        except Exception:
+            # the cause is only logged, upstream errors are not exposed in the results
+            logger.exception(f"Failed to register line {number} of a bulk upload")
+            entries = [
+                create_bundle_entry_json(
+                    status=OutcomeResponseStatusCode.INTERNAL_SERVER_ERROR.value,
+                    severity=OutcomeResponseSeverity.ERROR.value,
+                    code=OutcomeResponseCode.EXCEPTION.value,
+                    details=LINE_FAILURE_DETAILS,
+                )
+            ]
+
+        return b'{"line":%d,"entry":[%b]}' % (number, b",".join(entries))
+
+    @staticmethod
+    def __resolve_identifiers(chunk: List[Tuple[int, bytes]]) -> List[Tuple[int, bytes, ResolvedEntry | None]]:
+        """
+        Resolves the identifier lines of a chunk and validates their BSNs in one batch. Bundle lines
+        are left unresolved, they are registered as a whole.
+        """
+        identifiers: List[ResolvedEntry] = []
+        positions: List[int] = []
+        for position, (_, line) in enumerate(chunk):
+            identifier = BulkRegistrationService.__resolve_identifier(line)
+            if identifier is not None:
+                identifiers.append(identifier)
+                positions.append(position)
+
+        resolved: List[ResolvedEntry | None] = [None] * len(chunk)
+        for position, identifier in zip(positions, reject_invalid_bsns(identifiers)):
+            resolved[position] = identifier
+
+        return [(number, line, identifier) for (number, line), identifier in zip(chunk, resolved)]
+
+    @staticmethod
+    def __resolve_identifier(line: bytes) -> ResolvedEntry | None:
+        try:
+            data = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            return ResolvedEntry(None, None, bsn=None, error="Line is not valid JSON")
+
+        if isinstance(data, dict) and data.get("resourceType") == "Bundle":
+            return None
+
+        if isinstance(data, dict) and data.get("system") == BSN_SYSTEM:
+            data = data.get("value")
+
+        if not isinstance(data, str):
+            return ResolvedEntry(None, None, bsn=None, error="Line is neither a Bundle nor a BSN identifier")
+
+        return ResolvedEntry(None, None, bsn=data)
+
+    def __recover_results(self, job_id: str) -> Tuple[int, int]:
+        """
+        Counts the results written before an interruption, a partially written last line is dropped. The
+        index of the results is written again to match them.
+        """
+        results_path = os.path.join(self.__job_dir(job_id), RESULTS_FILE)
+        if not os.path.exists(results_path):
+            return 0, 0
+
+        processed_lines, error_lines, size = 0, 0, 0
+        positions: List[bytes] = []
+        with open(results_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                positions.append(RESULTS_INDEX_ENTRY.pack(size))
+                processed_lines += 1
+                error_lines += self.__has_error(line)
+                size += len(line)
+
+        if size != os.path.getsize(results_path):
+            os.truncate(results_path, size)
+        write_atomic(os.path.join(self.__job_dir(job_id), RESULTS_INDEX_FILE), b"".join(positions))
+
+        return processed_lines, error_lines
+
+    def __result_position(self, job_id: str, offset: int) -> int:
+        with open(os.path.join(self.__job_dir(job_id), RESULTS_INDEX_FILE), "rb") as file:
+            file.seek(offset * RESULTS_INDEX_ENTRY.size)
+            return int(RESULTS_INDEX_ENTRY.unpack(file.read(RESULTS_INDEX_ENTRY.size))[0])
+
+    @staticmethod
+    def __has_error(result: bytes) -> bool:
+        return any(
+            issue["severity"] == OutcomeResponseSeverity.ERROR.value
+            for entry in orjson.loads(result)["entry"]
+            for issue in entry["response"]["outcome"]["issue"]
+        )
+
+    @staticmethod
+    def __numbered_lines(file: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+        for number, line in enumerate(file, start=1):
+            line = line.strip()
+            if line:
+                yield number, line
+
+    def __update(self, job: BulkJob, **changes: Any) -> BulkJob:
+        job = job.model_copy(update={**changes, "updated": datetime.now(timezone.utc)})
+        self.__save(job)
+        return job
+
+    def __save(self, job: BulkJob) -> None:
+        write_atomic(self.__state_path(job.id), job.model_dump_json().encode())
+
+    def __load(self, job_id: str) -> BulkJob:
+        with open(self.__state_path(job_id), "rb") as file:
+            return BulkJob.model_validate_json(file.read())
+
+    def __state_path(self, job_id: str) -> str:
+        return os.path.join(self.__job_dir(job_id), STATE_FILE)
+
+    def __job_dir(self, job_id: str) -> str:
+        return os.path.join(self._storage_dir, job_id)
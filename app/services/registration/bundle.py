@@ -1,4 +1,9 @@
-from typing import Dict, List
+import logging
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Dict, Iterator, List, Set, Tuple
 
 from fhir.resources.R4B.bundle import Bundle, BundleEntry, BundleEntryResponse
 from fhir.resources.R4B.domainresource import DomainResource
@@ -9,10 +14,13 @@ from app.data import (
     OutcomeResponseSeverity,
     OutcomeResponseStatusCode,
 )
-from app.exceptions.fhir_exception import FHIRException
-from app.models.bsn import BSN
+from app.exceptions.fhir_exception import FHIRException, OperationOutcome
+from app.models.bsn import validate_bsns
+from app.models.referrals import Referral
+from app.models.registration import ResolvedEntry, ResolveFailure
 from app.services.fhir.bunde_entry_response import (
     KnownBundleRegistrationOutcome,
+    create_known_entry_json,
     create_known_response,
 )
 from app.services.fhir.bundle import BundleService
@@ -21,38 +29,146 @@ from app.services.parsers.patient import PatientParser
 from app.services.parsers.reference import ReferenceParser
 from app.services.registration.referrals import ReferralRegistrationService
 
+logger = logging.getLogger(__name__)
+
 
 class BundleRegistrationService:
     """
     Service that handles manual registration from FHIR Bundle.
     """
 
-    def __init__(self, referrals_service: ReferralRegistrationService) -> None:
+    def __init__(
+        self,
+        referrals_service: ReferralRegistrationService,
+        max_workers: int = 8,
+        process_pool_factory: Callable[[], Executor] | None = None,
+        process_pool_threshold_bytes: int = 1_048_576,
+    ) -> None:
         self._referrals_service = referrals_service
+        self._max_workers = max_workers
+        self._process_pool_factory = process_pool_factory
+        self._process_pool = process_pool_factory() if process_pool_factory is not None else None
+        self._process_pool_lock = Lock()
+        self._process_pool_threshold_bytes = process_pool_threshold_bytes
 
     def register(self, bundle: Bundle) -> Bundle:
         data = self.make_map_data(bundle)
+        entries = self.resolve(data)
 
-        responses: List[BundleEntryResponse] = []
-        for res in data.values():
-            # we skip patients in the map as we will handle them inside the register one
-            if isinstance(res, Patient):
-                continue
-
-            response = self._register_one(res, data)
-            responses.append(response)
-
+        responses = list(self.register_resolved(entries))
         results = BundleService.from_entry_response(responses)
         return results
 
-    def make_map_data(self, bundle: Bundle) -> Dict[str, DomainResource]:
-        if not bundle.entry:
+    def register_json(self, body: bytes) -> bytes:
+        """
+        Registers a bundle straight from the raw request body and returns the transaction-response bundle as JSON.
+        """
+        entries = self.resolve_json(body)
+
+        return BundleService.from_entry_json(self.register_resolved_json(entries))
+
+    def register_json_iter(self, body: bytes) -> Iterator[bytes]:
+        """
+        Validates the bundle up front and then yields the serialized entries one by one as their registration finishes.
+        """
+        entries = self.resolve_json(body)
+        return self.register_resolved_json(entries)
+
+    def resolve_json(self, body: bytes) -> List[ResolvedEntry]:
+        """
+        Validates a raw bundle and resolves its resources to BSNs. Bodies larger than the process pool
+        threshold are handed to a worker process without parsing them here, so the CPU bound validation
+        does not hold the GIL of the request worker. Only the compact resolved entries are sent back.
+        """
+        process_pool = self._process_pool
+        if process_pool is None or len(body) <= self._process_pool_threshold_bytes:
+            return self.resolve(self.make_map_data_from_json(body))
+
+        try:
+            resolved = process_pool.submit(resolve_bundle_json, body).result()
+        except BrokenProcessPool:
+            self.__replace_process_pool(process_pool)
+            raise
+
+        if isinstance(resolved, ResolveFailure):
             raise FHIRException(
-                status_code=OutcomeResponseStatusCode.BAD_REQUEST.value,
-                severity=OutcomeResponseSeverity.ERROR.value,
-                code=OutcomeResponseCode.EXCEPTION.value,
-                msg="Invalid bundle without entries",
+                status_code=resolved.status_code, severity=resolved.severity, code=resolved.code, msg=resolved.msg
             )
+        return resolved
+
+    def __replace_process_pool(self, broken: Executor) -> None:
+        """
+        Starts a new process pool in place of one whose worker died, which fails every later submit.
+        """
+        with self._process_pool_lock:
+            if self._process_pool is not broken or self._process_pool_factory is None:
+                return
+
+            logger.error("Bundle validation process pool is broken, starting a new one")
+            self._process_pool = self._process_pool_factory()
+        broken.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """
+        Stops the worker processes of the process pool, registrations still running are finished first.
+        """
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+
+    @staticmethod
+    def resolve(data: Dict[str, DomainResource]) -> List[ResolvedEntry]:
+        # we skip patients in the map as they are resolved through the resources referencing them
+        entries = [
+            BundleRegistrationService._resolve_one(res, data) for res in data.values() if not isinstance(res, Patient)
+        ]
+        return reject_invalid_bsns(entries)
+
+    def register_resolved(self, entries: List[ResolvedEntry]) -> Iterator[BundleEntryResponse]:
+        return (create_known_response(outcome, details) for outcome, details in self._register_outcomes(entries))
+
+    def register_resolved_json(self, entries: List[ResolvedEntry]) -> Iterator[bytes]:
+        return (create_known_entry_json(outcome, details) for outcome, details in self._register_outcomes(entries))
+
+    def _register_outcomes(self, entries: List[ResolvedEntry]) -> Iterator[Tuple[KnownBundleRegistrationOutcome, str]]:
+        """
+        Registers every unique BSN once, concurrently, and yields the outcomes in the order of the entries.
+        Entries sharing a BSN with an earlier entry get the same outcome as registering it a second time.
+        """
+        unique_bsns = list(dict.fromkeys(entry.bsn for entry in entries if entry.bsn is not None))
+        if len(unique_bsns) == 0:
+            for entry in entries:
+                yield KnownBundleRegistrationOutcome.ERROR, str(entry.error)
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=min(self._max_workers, len(unique_bsns)),
+            thread_name_prefix="bundle-registration",
+        ) as executor:
+            futures: Dict[str, Future[Referral | None]] = {
+                bsn: executor.submit(self._referrals_service.register, bsn=bsn) for bsn in unique_bsns
+            }
+            try:
+                registered: Set[str] = set()
+                for entry in entries:
+                    if entry.bsn is None:
+                        yield KnownBundleRegistrationOutcome.ERROR, str(entry.error)
+                        continue
+
+                    referral = futures[entry.bsn].result()
+                    if referral is None or entry.bsn in registered:
+                        yield KnownBundleRegistrationOutcome.WARNING, "Record already exists"
+                    else:
+                        yield KnownBundleRegistrationOutcome.OK, "Record created successfully"
+                    registered.add(entry.bsn)
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+    @staticmethod
+    def make_map_data(bundle: Bundle) -> Dict[str, DomainResource]:
+        if not bundle.entry:
+            raise BundleRegistrationService._no_entries_exception()
 
         resources: List[DomainResource] = []
         for entry in bundle.entry:
@@ -69,68 +185,90 @@ class BundleRegistrationService:
 
         return data_map
 
-    def _register_one(self, res: DomainResource, data: Dict[str, DomainResource]) -> BundleEntryResponse:
+    @staticmethod
+    def make_map_data_from_json(body: bytes) -> Dict[str, DomainResource]:
+        return BundleRegistrationService.make_map_data(Bundle.model_validate_json(body))
+
+    @staticmethod
+    def _no_entries_exception() -> FHIRException:
+        return FHIRException(
+            status_code=OutcomeResponseStatusCode.BAD_REQUEST.value,
+            severity=OutcomeResponseSeverity.ERROR.value,
+            code=OutcomeResponseCode.EXCEPTION.value,
+            msg="Invalid bundle without entries",
+        )
+
+    @staticmethod
+    def _resolve_one(res: DomainResource, data: Dict[str, DomainResource]) -> ResolvedEntry:
         # no reference for a patient
         reference = ReferenceParser.get_patient_reference(res)
         if reference is None:
-            return create_known_response(
-                KnownBundleRegistrationOutcome.ERROR,
-                f"no reference for patient found for {res.id}",
-            )
+            return ResolvedEntry(res.id, None, bsn=None, error=f"no reference for patient found for {res.id}")
 
         # not a valid relative reference
         ref_type, ref_id = ReferenceParser.get_reference_type_and_id(reference)
         if ref_type is None or ref_id is None:
-            return create_known_response(
-                KnownBundleRegistrationOutcome.ERROR,
-                f"reference for {res.get_resource_type()}: {res.id} is not relative, only relative references are allowed",
+            return ResolvedEntry(
+                res.id,
+                reference.reference,
+                bsn=None,
+                error=f"reference for {res.get_resource_type()}: {res.id} is not relative, only relative references are allowed",
             )
 
         # not a valid reference for a patient (resources that have multiple types for a subject)
         if ref_type != "Patient":
-            return create_known_response(
-                KnownBundleRegistrationOutcome.ERROR,
-                "Reference is not a valid Patient reference",
+            return ResolvedEntry(
+                res.id, reference.reference, bsn=None, error="Reference is not a valid Patient reference"
             )
 
         # patient does not exist in bundle
         patient = data.get(ref_id)
         if patient is None:
-            return create_known_response(
-                KnownBundleRegistrationOutcome.ERROR,
-                "patient associated with resource does not exist in bundle",
+            return ResolvedEntry(
+                res.id, reference.reference, bsn=None, error="patient associated with resource does not exist in bundle"
             )
 
         # not a valid patient model
         if not isinstance(patient, Patient):
-            return create_known_response(
-                KnownBundleRegistrationOutcome.ERROR,
-                "Patient is not a valid Resource",
-            )
+            return ResolvedEntry(res.id, reference.reference, bsn=None, error="Patient is not a valid Resource")
 
         # cannot have a patient without an identifier
         if patient.identifier is None:
-            return create_known_response(
-                KnownBundleRegistrationOutcome.ERROR,
-                "Patient without identifiers",
-            )
+            return ResolvedEntry(res.id, reference.reference, bsn=None, error="Patient without identifiers")
 
         bsn_list = PatientParser.map_identifiers_to_bsn(patient.identifier)
         # only one bsn is allowed in patient
         if len(bsn_list) != 1:
-            return create_known_response(
-                KnownBundleRegistrationOutcome.ERROR,
-                "Only one identifier with BSN system is allowed",
+            return ResolvedEntry(
+                res.id, reference.reference, bsn=None, error="Only one identifier with BSN system is allowed"
             )
 
-        bsn = bsn_list[0]
-        try:
-            BSN(bsn)
-        except ValueError:
-            return create_known_response(KnownBundleRegistrationOutcome.ERROR, "Invalid BSN number")
+        # the BSN itself is validated for all entries at once
+        return ResolvedEntry(res.id, reference.reference, bsn_list[0])
+
+
+def reject_invalid_bsns(entries: List[ResolvedEntry]) -> List[ResolvedEntry]:
+    """
+    Validates the BSNs of all resolved entries in one batch, entries with an invalid BSN get an error
+    before any of them is sent to the PRS.
+    """
+    indexes = [index for index, entry in enumerate(entries) if entry.bsn is not None]
+    validation = validate_bsns([entries[index].bsn or "" for index in indexes])
+
+    rejected = list(entries)
+    for index, valid in zip(indexes, validation.valid.tolist()):
+        if not valid:
+            rejected[index] = entries[index]._replace(bsn=None, error="Invalid BSN number")
+    return rejected
 
-        referral = self._referrals_service.register(bsn=bsn)
-        if referral is None:
-            return create_known_response(KnownBundleRegistrationOutcome.WARNING, "Record already exists")
 
-        return create_known_response(KnownBundleRegistrationOutcome.OK, "Record created successfully")
+def resolve_bundle_json(body: bytes) -> List[ResolvedEntry] | ResolveFailure:
+    """
+    Module level entrypoint for resolving a raw bundle inside a worker process. A FHIRException cannot
+    be unpickled in the request worker, so it is returned as a ResolveFailure instead.
+    """
+    try:
+        return BundleRegistrationService.resolve(BundleRegistrationService.make_map_data_from_json(body))
+    except FHIRException as e:
+        issue = OperationOutcome.model_validate(e.detail).issue[0]
+        return ResolveFailure(e.status_code, issue.severity, issue.code, issue.details.text)
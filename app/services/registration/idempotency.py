@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from threading import Condition, Lock
+from typing import Dict, Iterator, List, NamedTuple
+
+import orjson
+
+from app.data import OutcomeResponseCode, OutcomeResponseSeverity, OutcomeResponseStatusCode
+from app.exceptions.fhir_exception import FHIRException
+from app.services.storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class StoredRegistration(NamedTuple):
+    fingerprint: str
+    expires: float
+    entries: List[bytes]
+
+
+class InFlightRegistration(NamedTuple):
+    fingerprint: str
+    started: float
+
+
+class IdempotencyStore:
+    """
+    Remembers the transaction-response entries of registrations made with an Idempotency-Key, so a retry
+    with the same key gets the earlier result instead of registering the bundle again. A retry arriving
+    while the original request is still running waits for it. Completed registrations are kept for
+    ttl_seconds, at most max_entries of them (least recently used are dropped first), and persisted to disk.
+
+    Every completed registration is appended to a journal at storage_path, outside the lock of the store.
+    The journal is rewritten with only the kept registrations on startup and once it holds twice
+    max_entries of them.
+    """
+
+    def __init__(
+        self,
+        storage_path: str | None,
+        max_entries: int = 10000,
+        ttl_seconds: float = 86400,
+        wait_timeout_seconds: float = 30,
+        in_progress_timeout_seconds: float = 300,
+    ) -> None:
+        self._storage_path = storage_path
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._wait_timeout = wait_timeout_seconds
+        self._in_progress_timeout = in_progress_timeout_seconds
+        self._completed: OrderedDict[str, StoredRegistration] = OrderedDict()
+        self._in_flight: Dict[str, InFlightRegistration] = {}
+        self._condition = Condition()
+        self._journal_lock = Lock()
+        self._journal_entries = 0
+        self.__load()
+
+    @staticmethod
+    def fingerprint(body: bytes) -> str:
+        return hashlib.sha256(body).hexdigest()
+
+    def begin(self, key: str, body: bytes) -> List[bytes] | None:
+        """
+        Returns the stored entries of an earlier registration with this key. Otherwise the key is marked
+        as in progress and None is returned, the caller then registers and records the entries.
+        """
+        fingerprint = self.fingerprint(body)
+        deadline = time.monotonic() + self._wait_timeout
+        with self._condition:
+            while True:
+                stored = self._completed.get(key)
+                if stored is not None and stored.expires > time.time():
+                    self.__check_fingerprint(stored.fingerprint, fingerprint)
+                    self._completed.move_to_end(key)
+                    return stored.entries
+
+                in_flight = self._in_flight.get(key)
+                if in_flight is None or in_flight.started + self._in_progress_timeout < time.monotonic():
+                    self._in_flight[key] = InFlightRegistration(fingerprint, time.monotonic())
+                    return None
+
+                self.__check_fingerprint(in_flight.fingerprint, fingerprint)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise FHIRException(
+                        status_code=OutcomeResponseStatusCode.CONFLICT.value,
+                        severity=OutcomeResponseSeverity.ERROR.value,
+                        code=OutcomeResponseCode.CONFLICT.value,
+                        msg="A request with this Idempotency-Key is still in progress",
+                    )
+                self._condition.wait(remaining)
+
+    def record(self, key: str, entries: Iterator[bytes]) -> Iterator[bytes]:
+        """
+        Passes the entries through and stores them once the registration completed. When the registration
+        fails the key is released, so a retry registers again.
+        """
+        recorded: List[bytes] = []
+        try:
+            for entry in entries:
+                recorded.append(entry)
+                yield entry
+        except BaseException:
+            self.abandon(key)
+            raise
+
+        self.complete(key, recorded)
+
+    def complete(self, key: str, entries: List[bytes]) -> None:
+        with self._condition:
+            in_flight = self._in_flight.pop(key, None)
+            fingerprint = in_flight.fingerprint if in_flight is not None else ""
+            stored = StoredRegistration(fingerprint, time.time() + self._ttl, entries)
+            self._completed[key] = stored
+            self._completed.move_to_end(key)
+            self.__evict()
+            self._condition.notify_all()
+
+        self.__append(key, stored)
+
+    def abandon(self, key: str) -> None:
+        with self._condition:
+            self._in_flight.pop(key, None)
+            self._condition.notify_all()
+
+    def __evict(self) -> None:
+        now = time.time()
+        for key in [key for key, stored in self._completed.items() if stored.expires <= now]:
+            del self._completed[key]
+        while len(self._completed) > self._max_entries:
+            self._completed.popitem(last=False)
+
+    @staticmethod
+    def __check_fingerprint(expected: str, actual: str) -> None:
+        if expected != actual:
+            raise FHIRException(
+                status_code=OutcomeResponseStatusCode.UNPROCESSABLE_ENTITY.value,
+                severity=OutcomeResponseSeverity.ERROR.value,
+                code=OutcomeResponseCode.CONFLICT.value,
+                msg="Idempotency-Key was already used for a different request body",
+            )
+
+    @staticmethod
+    def __serialize(key: str, stored: StoredRegistration) -> bytes:
+        return (
+            orjson.dumps(
+                {
+                    "key": key,
+                    "fingerprint": stored.fingerprint,
+                    "expires": stored.expires,
+                    "entries": [entry.decode() for entry in stored.entries],
+                }
+            )
+            + b"\n"
+        )
+
+    def __append(self, key: str, stored: StoredRegistration) -> None:
+        if not self._storage_path:
+            return
+
+        with self._journal_lock:
+            if self._journal_entries >= 2 * self._max_entries:
+                self.__compact()
+                return
+
+            try:
+                with open(self._storage_path, "ab") as file:
+                    file.write(self.__serialize(key, stored))
+                    file.flush()
+                    os.fsync(file.fileno())
+                self._journal_entries += 1
+            except OSError as e:
+                logger.warning(f"Failed to persist idempotency key: {e}")
+
+    def __compact(self) -> None:
+        """
+        Rewrites the journal with the registrations kept in the store, the caller holds the journal lock.
+        """
+        if not self._storage_path:
+            return
+
+        with self._condition:
+            kept = list(self._completed.items())
+        try:
+            write_atomic(self._storage_path, b"".join(self.__serialize(key, stored) for key, stored in kept))
+            self._journal_entries = len(kept)
+        except OSError as e:
+            logger.warning(f"Failed to persist idempotency keys: {e}")
+
+    def __load(self) -> None:
+        if not self._storage_path or not os.path.exists(self._storage_path):
+            return
+
+        try:
+            with open(self._storage_path, "rb") as file:
+                lines = file.readlines()
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable idempotency key store: {e}")
+            return
+
+        for line in lines:
+            try:
+                stored = orjson.loads(line)
+                key = stored["key"]
+                registration = StoredRegistration(
+                    stored["fingerprint"], stored["expires"], [entry.encode() for entry in stored["entries"]]
+                )
+            except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+                # a registration partially appended when the service stopped
+                logger.warning(f"Ignoring unreadable idempotency key: {e}")
+                continue
+            self._completed.pop(key, None)
+            self._completed[key] = registration
+        self.__evict()
+
+        with self._journal_lock:
+            self.__compact()
@@ -24,9 +24,16 @@ class ReferralRegistrationService:
         self.pseudonym_service = pseudonym_service
         self._nvi_oin = nvi_oin
 
+    def shutdown(self) -> None:
+        """
+        Stops the background threads of the service, registering directly there are none.
+        """
+
     def register(self, bsn: str) -> Referral | None:
         subject = self.calculate_subject(bsn)
+        return self.register_subject(subject)
 
+    def register_subject(self, subject: str) -> Referral | None:
         if (
             len(
                 self.nvi_service.get_registered_referrals(
@@ -0,0 +1,23 @@
+import contextlib
+import os
+import tempfile
+
+
+def write_atomic(path: str, content: bytes) -> None:
+    """
+    Writes a file through a temporary file in the same directory, so readers (and a restarted service)
+    never see a partially written file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
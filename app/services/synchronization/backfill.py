@@ -0,0 +1,221 @@
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from math import ceil
+from threading import Lock
+from typing import Dict, List
+
+import orjson
+
+from app.models.backfill import BackfillState, BackfillWindow, WindowStrategy
+from app.services.metadata import MetadataService
+from app.services.registration.referrals import ReferralRegistrationService
+from app.services.storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Windows are not split below this duration, however many resources they count
+MIN_WINDOW = timedelta(seconds=1)
+
+
+class BackfillService:
+    """
+    Registers the patients of every resource of a data domain last updated in a date range, as a set of
+    _lastUpdated windows searched and registered by workers in parallel. The windows are planned per
+    WindowStrategy and their completion is saved in state_dir after every window, so a backfill of the same
+    range interrupted or failing on some windows resumes with only the unfinished ones. A backfill does not
+    touch the synchronization progress of the domain.
+    """
+
+    def __init__(
+        self,
+        metadata_api: MetadataService,
+        registration_service: ReferralRegistrationService,
+        workers: int = 4,
+        max_window_resources: int = 10_000,
+        state_dir: str | None = None,
+    ) -> None:
+        self._metadata_api = metadata_api
+        self._registration_service = registration_service
+        self._workers = workers
+        self._max_window_resources = max_window_resources
+        self._state_dir = state_dir
+        self.__lock = Lock()
+
+    def backfill(
+        self,
+        data_domain: str,
+        start: datetime,
+        end: datetime,
+        strategy: WindowStrategy = WindowStrategy.fixed,
+        window: timedelta = timedelta(days=30),
+    ) -> BackfillState:
+        """
+        Backfills data_domain from start up to (not including) end and returns the windows, failed windows
+        are logged and left unfinished.
+        """
+        if end <= start:
+            raise ValueError(f"Backfill range {start.isoformat()} - {end.isoformat()} is empty")
+
+        state = self.__load(data_domain, start.isoformat(), end.isoformat())
+        if state is None:
+            state = BackfillState(
+                data_domain=data_domain,
+                start=start.isoformat(),
+                end=end.isoformat(),
+                windows=self.plan(data_domain, start, end, strategy, window),
+            )
+            self.__save(state)
+        else:
+            logger.info(f"Resuming backfill of {data_domain} with {self.__count_unfinished(state)} unfinished windows")
+
+        bisect = strategy == WindowStrategy.bisect
+        try:
+            self.__run(state, bisect)
+        finally:
+            self._metadata_api.save_patient_cache()
+
+        logger.info(
+            f"Backfilled {data_domain} with {len(state.windows) - self.__count_unfinished(state)} of "
+            f"{len(state.windows)} windows"
+        )
+        return state
+
+    def plan(
+        self,
+        data_domain: str,
+        start: datetime,
+        end: datetime,
+        strategy: WindowStrategy = WindowStrategy.fixed,
+        window: timedelta = timedelta(days=30),
+    ) -> List[BackfillWindow]:
+        """
+        Splits the range in windows of the window duration. The adaptive strategy counts the resources of
+        every window and splits it again into equal windows of at most max_window_resources resources.
+        """
+        bounds = [start]
+        while bounds[-1] + window < end:
+            bounds.append(bounds[-1] + window)
+        bounds.append(end)
+        windows = list(zip(bounds, bounds[1:]))
+        if strategy != WindowStrategy.adaptive:
+            return [BackfillWindow(start=lower.isoformat(), end=upper.isoformat()) for lower, upper in windows]
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="backfill") as executor:
+            counts = list(
+                executor.map(
+                    lambda window_range: self._metadata_api.count_range(
+                        data_domain, window_range[0].isoformat(), window_range[1].isoformat()
+                    ),
+                    windows,
+                )
+            )
+
+        planned: List[BackfillWindow] = []
+        for (lower, upper), count in zip(windows, counts):
+            parts = max(1, min(ceil((count or 0) / self._max_window_resources), int((upper - lower) / MIN_WINDOW)))
+            step = (upper - lower) / parts
+            planned.extend(
+                BackfillWindow(
+                    start=(lower + step * part).isoformat(),
+                    end=(lower + step * (part + 1) if part < parts - 1 else upper).isoformat(),
+                )
+                for part in range(parts)
+            )
+        return planned
+
+    def __run(self, state: BackfillState, bisect: bool) -> None:
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="backfill") as executor:
+            pending: Dict[Future[List[BackfillWindow]], BackfillWindow] = {
+                executor.submit(self.__process, state, unfinished, bisect): unfinished
+                for unfinished in list(state.windows)
+                if not unfinished.done
+            }
+            while pending:
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    processed = pending.pop(future)
+                    try:
+                        halves = future.result()
+                    except Exception as e:
+                        logger.error(
+                            f"Failed to backfill {state.data_domain} from {processed.start} to {processed.end}: {e}"
+                        )
+                        continue
+
+                    for half in halves:
+                        pending[executor.submit(self.__process, state, half, bisect)] = half
+
+    def __process(self, state: BackfillState, window: BackfillWindow, bisect: bool) -> List[BackfillWindow]:
+        """
+        Searches and registers a window, or with bisect splits a window counting too many resources in the
+        halves to process instead.
+        """
+        start, end = datetime.fromisoformat(window.start), datetime.fromisoformat(window.end)
+        if bisect and end - start >= 2 * MIN_WINDOW:
+            count = self._metadata_api.count_range(state.data_domain, window.start, window.end)
+            if count is not None and count > self._max_window_resources:
+                middle = (start + (end - start) / 2).isoformat()
+                halves = [
+                    BackfillWindow(start=window.start, end=middle),
+                    BackfillWindow(start=middle, end=window.end),
+                ]
+                with self.__lock:
+                    index = state.windows.index(window)
+                    state.windows[index : index + 1] = halves
+                self.__save(state)
+                return halves
+
+        resources = 0
+        bsns: Dict[str, None] = {}
+        for page in self._metadata_api.search_updates(state.data_domain, window.start, until=window.end):
+            resources += len(page.resources)
+            bsns.update(dict.fromkeys(self._metadata_api.parse_update_page(page)))
+
+        for bsn in bsns:
+            self._registration_service.register(bsn)
+
+        with self.__lock:
+            window.resources = resources
+            window.patients = len(bsns)
+            window.done = True
+        self.__save(state)
+        logger.debug(f"Backfilled {resources} {state.data_domain} resources from {window.start} to {window.end}")
+        return []
+
+    @staticmethod
+    def __count_unfinished(state: BackfillState) -> int:
+        return sum(1 for window in state.windows if not window.done)
+
+    def __state_path(self, data_domain: str) -> str | None:
+        return os.path.join(self._state_dir, f"{data_domain}.json") if self._state_dir else None
+
+    def __save(self, state: BackfillState) -> None:
+        path = self.__state_path(state.data_domain)
+        if path is None:
+            return
+
+        with self.__lock:
+            try:
+                write_atomic(path, orjson.dumps(state.model_dump()))
+            except OSError as e:
+                logger.warning(f"Failed to persist backfill state: {e}")
+
+    def __load(self, data_domain: str, start: str, end: str) -> BackfillState | None:
+        """
+        Returns the saved backfill of data_domain when it covers the same range, a backfill of another
+        range is started over.
+        """
+        path = self.__state_path(data_domain)
+        if path is None or not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as file:
+                state = BackfillState.model_validate(orjson.loads(file.read()))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable backfill state: {e}")
+            return None
+
+        return state if (state.start, state.end) == (start, end) else None
@@ -0,0 +1,40 @@
+from collections.abc import Callable
+from threading import Lock
+from typing import Dict, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class PageCheckpoints(Generic[T]):
+    """
+    Follows the pages of a synchronization run through the pipeline. Pages are numbered in the order they
+    were fetched and complete once every item taken from them is done. on_checkpoint receives the watermark
+    of the last page for which it and all pages before it completed, so the watermark never passes a page
+    that is still being processed.
+    """
+
+    def __init__(self, on_checkpoint: Callable[[T], None]) -> None:
+        self._on_checkpoint = on_checkpoint
+        self._lock = Lock()
+        self._pages: Dict[int, Tuple[T, int]] = {}
+        self._next_page = 0
+
+    def add(self, page: int, watermark: T, items: int) -> None:
+        with self._lock:
+            self._pages[page] = (watermark, items)
+            self.__advance()
+
+    def done(self, page: int) -> None:
+        with self._lock:
+            watermark, remaining = self._pages[page]
+            self._pages[page] = (watermark, remaining - 1)
+            self.__advance()
+
+    def __advance(self) -> None:
+        completed: T | None = None
+        while self._next_page in self._pages and self._pages[self._next_page][1] == 0:
+            completed = self._pages.pop(self._next_page)[0]
+            self._next_page += 1
+
+        if completed is not None:
+            self._on_checkpoint(completed)
@@ -1,11 +1,27 @@
+import logging
+import os
+from threading import Lock
 from typing import List
 
+import orjson
+
 from app.models.domains_map import DomainMapEntry, DomainsMap
+from app.services.storage import write_atomic
+
+logger = logging.getLogger(__name__)
 
 
 class DomainsMapService:
-    def __init__(self, data_domains: List[str]) -> None:
+    """
+    Holds the synchronization progress per data domain. When a storage_path is given the progress is
+    persisted on every change and loaded again on start, so synchronization resumes after a restart.
+    """
+
+    def __init__(self, data_domains: List[str], storage_path: str | None = None) -> None:
+        self.__storage_path = storage_path
+        self.__lock = Lock()
         self.__domain_map: DomainsMap = {k: DomainMapEntry() for k in data_domains}
+        self.__load()
 
     def get_domains(self) -> List[str]:
         return list(self.__domain_map.keys())
@@ -16,13 +32,48 @@ class DomainsMapService:
 
         return self.__domain_map[data_domain]
 
+    def update_entry(self, data_domain: str, entry: DomainMapEntry) -> None:
+        if data_domain not in self.get_domains():
+            raise KeyError(f"{data_domain} is not known to defined list of domains.")
+
+        self.__domain_map[data_domain] = entry
+        self.__save()
+
     def clear_entry_timestamp(self, data_domain: str) -> DomainsMap:
         if data_domain not in self.get_domains():
             raise KeyError(f"{data_domain} is not known to defined list of domains.")
 
         self.__domain_map[data_domain] = DomainMapEntry()
+        self.__save()
         return self.__domain_map
 
     def clear_all_entries_timestamp(self) -> DomainsMap:
         self.__domain_map = {k: DomainMapEntry() for k in self.get_domains()}
+        self.__save()
         return self.__domain_map
+
+    def __save(self) -> None:
+        if not self.__storage_path:
+            return
+
+        with self.__lock:
+            data = {k: v.model_dump() for k, v in self.__domain_map.items()}
+            try:
+                write_atomic(self.__storage_path, orjson.dumps(data))
+            except OSError as e:
+                logger.warning(f"Failed to persist synchronization state: {e}")
+
+    def __load(self) -> None:
+        if not self.__storage_path or not os.path.exists(self.__storage_path):
+            return
+
+        try:
+            with open(self.__storage_path, "rb") as file:
+                data = orjson.loads(file.read())
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable synchronization state: {e}")
+            return
+
+        for data_domain, entry in data.items():
+            if data_domain in self.__domain_map:
+                self.__domain_map[data_domain] = DomainMapEntry.model_validate(entry)
@@ -0,0 +1,161 @@
+import logging
+import time
+from threading import Condition, Thread
+from typing import Dict, List, Set, Tuple
+
+import orjson
+from pydantic import ValidationError
+
+from app.models.metadata.fhir import Bundle, Resource
+from app.models.notifications import NotificationReceipt
+from app.services.metadata import MetadataService, UpdatePage
+from app.services.parsers.reference import PATIENT_REFERENCE_ATTRIBUTES
+from app.services.registration.referrals import ReferralRegistrationService
+from app.services.synchronization.synchronizer import Synchronizer
+
+logger = logging.getLogger(__name__)
+
+# Resources in a notification bundle describing the subscription, not a change
+NOTIFICATION_RESOURCE_TYPES = ("SubscriptionStatus", "Parameters")
+
+
+class NotificationService:
+    """
+    Receives the changes the metadata server notifies through a FHIR Subscription rest-hook. Notifications
+    are collected until none arrived for the debounce window, or max_pending changes are collected, and are
+    then handled in one go: every changed resource is read once and every patient registered once. Empty
+    notifications say a domain changed without saying what, the domain is synchronized instead, as is a
+    domain whose resources have no single patient reference to follow. Queued notifications are only handled
+    once the service is started.
+    """
+
+    def __init__(
+        self,
+        synchronizer: Synchronizer,
+        metadata_api: MetadataService,
+        registration_service: ReferralRegistrationService,
+        debounce_ms: float = 500,
+        max_pending: int = 1000,
+    ) -> None:
+        self._synchronizer = synchronizer
+        self._metadata_api = metadata_api
+        self._registration_service = registration_service
+        self._debounce = debounce_ms / 1000
+        self._max_pending = max_pending
+        self._condition = Condition()
+        self._pending_resources: Dict[str, Set[str]] = {}
+        self._pending_domains: Set[str] = set()
+        self._last_notified = 0.0
+        self._dispatcher = Thread(target=self.__dispatch, name="notification-dispatcher", daemon=True)
+
+    def start(self) -> None:
+        self._dispatcher.start()
+
+    def notify(self, body: bytes, data_domain: str | None = None) -> NotificationReceipt:
+        """
+        Queues the changes of a notification body: a notification Bundle with full resources or only their
+        fullUrls, a single resource, or nothing for an empty notification of data_domain (or all domains).
+        """
+        allowed_domains = self._synchronizer.get_allowed_domains()
+        if data_domain is not None and data_domain not in allowed_domains:
+            raise ValueError(f"{data_domain} is not known to defined list of domains.")
+
+        references = self.parse_notification(body)
+        changed = [(resource_type, id) for resource_type, id in references if resource_type in allowed_domains]
+        if len(body.strip()) == 0:
+            domains = [data_domain] if data_domain is not None else allowed_domains
+        else:
+            domains = list(
+                dict.fromkeys(
+                    resource_type for resource_type, _ in changed if resource_type not in PATIENT_REFERENCE_ATTRIBUTES
+                )
+            )
+
+        with self._condition:
+            for resource_type, id in changed:
+                self._pending_resources.setdefault(resource_type, set()).add(id)
+            self._pending_domains.update(domains)
+            self._last_notified = time.monotonic()
+            self._condition.notify()
+
+        return NotificationReceipt(resources=len(changed), domains=domains)
+
+    @staticmethod
+    def parse_notification(body: bytes) -> List[Tuple[str, str]]:
+        """
+        Returns the resource type and id of every changed resource in a notification body.
+        """
+        if len(body.strip()) == 0:
+            return []
+
+        try:
+            data = orjson.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError("Notification is not a FHIR resource")
+            if data.get("resourceType") != "Bundle":
+                resource = Resource.model_validate(data)
+                return [(resource.resource_type, resource.id)] if resource.id is not None else []
+            bundle = Bundle.model_validate(data)
+        except (orjson.JSONDecodeError, ValidationError) as e:
+            raise ValueError(f"Notification is not a FHIR resource: {e}") from e
+
+        references: List[Tuple[str, str]] = []
+        for entry in bundle.entry or []:
+            if entry.resource is not None:
+                if entry.resource.resource_type not in NOTIFICATION_RESOURCE_TYPES and entry.resource.id is not None:
+                    references.append((entry.resource.resource_type, entry.resource.id))
+            elif entry.full_url is not None:
+                parts = entry.full_url.split("/_history/")[0].rstrip("/").split("/")
+                if len(parts) >= 2 and parts[-2] not in NOTIFICATION_RESOURCE_TYPES:
+                    references.append((parts[-2], parts[-1]))
+        return references
+
+    def __dispatch(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending_resources and not self._pending_domains:
+                    self._condition.wait()
+
+                while sum(len(ids) for ids in self._pending_resources.values()) < self._max_pending:
+                    remaining = self._last_notified + self._debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                resources, self._pending_resources = self._pending_resources, {}
+                domains, self._pending_domains = self._pending_domains, set()
+
+            self.__handle(resources, domains)
+
+    def __handle(self, resources: Dict[str, Set[str]], domains: Set[str]) -> None:
+        for data_domain in domains:
+            try:
+                self._synchronizer.synchronize_domain(data_domain)
+            except Exception as e:
+                logger.error(f"Failed to synchronize notified domain {data_domain}: {e}")
+
+        bsns: Dict[str, None] = {}
+        for resource_type, ids in resources.items():
+            if resource_type in domains:
+                continue
+
+            try:
+                page = UpdatePage(
+                    bundle=Bundle(),
+                    resource_type=resource_type,
+                    resources=self._metadata_api.get_resources(resource_type, ids),
+                    last_updated=None,
+                    last_ids=[],
+                    includes_patients=False,
+                )
+                bsns.update(dict.fromkeys(self._metadata_api.parse_update_page(page)))
+            except Exception as e:
+                logger.error(f"Failed to read {len(ids)} notified {resource_type} resources: {e}")
+        self._metadata_api.save_patient_cache()
+
+        logger.debug(f"Registering {len(bsns)} patients of notified changes")
+        for bsn in bsns:
+            try:
+                self._registration_service.register(bsn)
+            except Exception as e:
+                logger.error(f"Failed to register patient of notified change: {e}")
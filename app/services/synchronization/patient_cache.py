@@ -0,0 +1,114 @@
+import logging
+import os
+from datetime import datetime
+from threading import Lock
+from typing import Iterable
+
+import orjson
+
+from app.models.metadata.fhir import Resource
+from app.models.patient_cache import CachedPatient, PatientCacheState
+from app.services.parsers.metadata import MetadataBundleParser
+from app.services.storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class PatientCache:
+    """
+    Holds the BSN of the metadata Patients by id, with the _lastUpdated it was read at. A patient is only
+    replaced by a version updated later than the cached one. last_updated is the refresh watermark: every
+    change to a cached patient made after it is still to be refreshed. When a storage_path is given the
+    cache is persisted on save, once per synchronization run instead of on every change, and loaded again
+    on start. A cache lost since its last save is only looked up again.
+    """
+
+    def __init__(self, storage_path: str | None = None) -> None:
+        self.__storage_path = storage_path
+        self.__lock = Lock()
+        self.__state = PatientCacheState()
+        self.__changed = False
+        self.__load()
+
+    @property
+    def last_updated(self) -> str | None:
+        return self.__state.last_updated
+
+    def get(self, patient_id: str) -> CachedPatient | None:
+        return self.__state.patients.get(patient_id)
+
+    def update(self, patients: Iterable[Resource], known_only: bool = False, advance: bool = True) -> None:
+        """
+        Caches the BSN of the patients. With known_only, patients not cached yet are left out. Unless
+        advance is False, last_updated moves on to the newest patient: only a refresh or an export sees
+        every changed patient. A lookup of some patients passes advance=False, as the other cached patients
+        may have changed before it unseen. It only sets last_updated on an empty watermark, every later
+        change to the looked up patients is made after the newest of them.
+        """
+        with self.__lock:
+            newest = datetime.fromisoformat(self.__state.last_updated) if self.__state.last_updated else None
+            for patient in patients:
+                if patient.id is None:
+                    continue
+
+                last_updated = patient.meta.last_updated if patient.meta is not None else None
+                if (
+                    last_updated is not None
+                    and (advance or self.__state.last_updated is None)
+                    and (newest is None or last_updated > newest)
+                ):
+                    newest = last_updated
+
+                cached = self.__state.patients.get(patient.id)
+                if cached is None and known_only:
+                    continue
+                if (
+                    cached is not None
+                    and cached.last_updated is not None
+                    and (last_updated is None or last_updated <= datetime.fromisoformat(cached.last_updated))
+                ):
+                    continue
+
+                bsns = MetadataBundleParser.get_bsns([patient])
+                self.__state.patients[patient.id] = CachedPatient(
+                    bsn=bsns[0] if bsns else None,
+                    last_updated=last_updated.isoformat() if last_updated is not None else None,
+                )
+                self.__changed = True
+
+            if newest is not None and newest.isoformat() != self.__state.last_updated:
+                self.__state.last_updated = newest.isoformat()
+                self.__changed = True
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__state = PatientCacheState()
+            self.__changed = True
+        self.save()
+
+    def save(self) -> None:
+        """
+        Persists the cache when it changed since the last save.
+        """
+        if not self.__storage_path:
+            return
+
+        with self.__lock:
+            if not self.__changed:
+                return
+
+            try:
+                write_atomic(self.__storage_path, orjson.dumps(self.__state.model_dump()))
+                self.__changed = False
+            except OSError as e:
+                logger.warning(f"Failed to persist patient cache: {e}")
+
+    def __load(self) -> None:
+        if not self.__storage_path or not os.path.exists(self.__storage_path):
+            return
+
+        try:
+            with open(self.__storage_path, "rb") as file:
+                self.__state = PatientCacheState.model_validate(orjson.loads(file.read()))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable patient cache: {e}")
@@ -0,0 +1,256 @@
+import logging
+import time
+from collections.abc import Callable, Iterable
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Any, List
+
+from app.models.pipeline import StageSettings, StageStats
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 0.05
+
+
+class _Done:
+    """
+    Sentinel that marks the end of a stage input, one is sent per consuming worker.
+    """
+
+
+_DONE = _Done()
+
+
+class PipelineStage:
+    """
+    A single step in a pipeline. The function receives a batch of items taken from the
+    stage input queue and returns the items that are passed on to the next stage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[List[Any]], Iterable[Any]],
+        settings: StageSettings | None = None,
+    ) -> None:
+        self.name = name
+        self.function = function
+        self.settings = settings or StageSettings()
+        self._lock = Lock()
+        self._active_workers = 0
+        self._processed = 0
+        self._batches = 0
+        self._busy_seconds = 0.0
+        self._started_at: float | None = None
+        self._finished_at: float | None = None
+        self._max_queue_depth = 0
+        self._queue: Queue[Any] | None = None
+
+    def attach(self, queue: Queue[Any]) -> None:
+        """
+        Connects the stage to the queue it takes its items from, the depth of the queue is part of the stats.
+        """
+        self._queue = queue
+
+    def start(self, workers: int) -> None:
+        with self._lock:
+            self._active_workers = workers
+            self._started_at = time.monotonic()
+
+    def finish_worker(self) -> bool:
+        """
+        Marks one worker of the stage as finished and returns whether it was the last one.
+        """
+        with self._lock:
+            self._active_workers -= 1
+            if self._active_workers > 0:
+                return False
+            self._finished_at = time.monotonic()
+            return True
+
+    def record(self, processed: int, batches: int, busy_seconds: float) -> None:
+        with self._lock:
+            self._processed += processed
+            self._batches += batches
+            self._busy_seconds += busy_seconds
+
+    def record_depth(self) -> None:
+        if self._queue is None:
+            return
+        depth = self._queue.qsize()
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+
+    def stats(self) -> StageStats:
+        with self._lock:
+            if self._started_at is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self._finished_at or time.monotonic()) - self._started_at
+
+            return StageStats(
+                name=self.name,
+                workers=self.settings.workers,
+                batch_size=self.settings.batch_size,
+                queue_depth=self._queue.qsize() if self._queue is not None else 0,
+                max_queue_depth=self._max_queue_depth,
+                processed=self._processed,
+                batches=self._batches,
+                busy_seconds=round(self._busy_seconds, 6),
+                elapsed_seconds=round(elapsed, 6),
+                throughput=round(self._processed / elapsed, 3) if elapsed > 0 else 0.0,
+                utilization=(round(self._busy_seconds / (elapsed * self.settings.workers), 3) if elapsed > 0 else 0.0),
+            )
+
+
+class Pipeline:
+    """
+    Streaming pipeline of stages connected by bounded queues. Every stage runs its own
+    pool of worker threads, so a slow stage applies back pressure to the stages in front
+    of it while the stages behind it keep working on what is already queued.
+    """
+
+    def __init__(
+        self,
+        source_name: str,
+        source: Callable[[], Iterable[Any]],
+        stages: List[PipelineStage],
+        queue_size: int = 100,
+    ) -> None:
+        self._source = source
+        self._source_stage = PipelineStage(name=source_name, function=lambda items: items)
+        self._stages = stages
+        self._queues: List[Queue[Any]] = [Queue(maxsize=queue_size) for _ in stages]
+        for stage, queue in zip(stages, self._queues):
+            stage.attach(queue)
+        self._abort = Event()
+        self._error: BaseException | None = None
+        self._error_lock = Lock()
+        self._results: List[Any] = []
+        self._results_lock = Lock()
+
+    def stats(self) -> List[StageStats]:
+        return [stage.stats() for stage in [self._source_stage, *self._stages]]
+
+    def run(self) -> List[Any]:
+        threads = [Thread(target=self._run_source, name=f"pipeline-{self._source_stage.name}")]
+        for index, stage in enumerate(self._stages):
+            stage.start(workers=stage.settings.workers)
+            for worker in range(stage.settings.workers):
+                threads.append(
+                    Thread(
+                        target=self._run_worker,
+                        args=(index,),
+                        name=f"pipeline-{stage.name}-{worker}",
+                    )
+                )
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return self._results
+
+    def _fail(self, error: BaseException) -> None:
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._abort.set()
+
+    def _put(self, index: int, item: Any) -> bool:
+        """
+        Hand an item to the stage at index, or to the result list when index is past the last stage.
+        Returns False when the pipeline was aborted before the item could be queued.
+        """
+        if index >= len(self._stages):
+            with self._results_lock:
+                self._results.append(item)
+            return True
+
+        queue = self._queues[index]
+        while not self._abort.is_set():
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                self._stages[index].record_depth()
+                return True
+            except Full:
+                continue
+        return False
+
+    def _get(self, index: int, block: bool) -> Any:
+        queue = self._queues[index]
+        if not block:
+            return queue.get_nowait()
+
+        while not self._abort.is_set():
+            try:
+                return queue.get(timeout=_POLL_INTERVAL)
+            except Empty:
+                continue
+        return _DONE
+
+    def _signal_done(self, index: int) -> None:
+        if index >= len(self._stages):
+            return
+        for _ in range(self._stages[index].settings.workers):
+            if not self._put(index, _DONE):
+                return
+
+    def _run_source(self) -> None:
+        stage = self._source_stage
+        stage.start(workers=1)
+        try:
+            iterator = iter(self._source())
+            while not self._abort.is_set():
+                started = time.monotonic()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stage.record(processed=1, batches=1, busy_seconds=time.monotonic() - started)
+                if not self._put(0, item):
+                    break
+        except Exception as e:
+            logger.exception(f"Pipeline stage {stage.name} failed")
+            self._fail(e)
+        finally:
+            stage.finish_worker()
+            self._signal_done(0)
+
+    def _run_worker(self, index: int) -> None:
+        stage = self._stages[index]
+        done = False
+        try:
+            while not done and not self._abort.is_set():
+                item = self._get(index, block=True)
+                if isinstance(item, _Done):
+                    break
+
+                batch = [item]
+                while len(batch) < stage.settings.batch_size:
+                    try:
+                        item = self._get(index, block=False)
+                    except Empty:
+                        break
+                    if isinstance(item, _Done):
+                        done = True
+                        break
+                    batch.append(item)
+
+                started = time.monotonic()
+                outputs = list(stage.function(batch))
+                stage.record(processed=len(batch), batches=1, busy_seconds=time.monotonic() - started)
+
+                for output in outputs:
+                    if not self._put(index + 1, output):
+                        return
+        except Exception as e:
+            logger.exception(f"Pipeline stage {stage.name} failed")
+            self._fail(e)
+        finally:
+            if stage.finish_worker():
+                self._signal_done(index + 1)
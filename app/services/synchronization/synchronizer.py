@@ -1,20 +1,32 @@
 import logging
+from collections.abc import Callable
+from contextlib import ExitStack
 from datetime import datetime
-from typing import Dict, List
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
 
 from app.data import (
     OutcomeResponseSeverity,
     OutcomeResponseStatusCode,
 )
 from app.exceptions.fhir_exception import FHIRException
-from app.models.domains_map import DomainMapEntry, DomainsMap
+from app.models.domains_map import DomainMapEntry, DomainsMap, SyncMode
+from app.models.pipeline import DomainRunStats, StageSettings, StageStats
 from app.models.update_scheme import BsnUpdateScheme, UpdateScheme
-from app.services.metadata import MetadataService
+from app.services.metadata import MetadataService, UpdatePage
+from app.services.parsers.reference import PATIENT_REFERENCE_ATTRIBUTES
 from app.services.registration.referrals import ReferralRegistrationService
+from app.services.synchronization.checkpoint import PageCheckpoints
 from app.services.synchronization.domain_map import DomainsMapService
+from app.services.synchronization.pipeline import Pipeline, PipelineStage
 
 logger = logging.getLogger(__name__)
 
+FETCH_STAGE = "metadata"
+EXTRACT_STAGE = "extract"
+PSEUDONYM_STAGE = "pseudonym"
+REFERRAL_STAGE = "referral"
+
 
 class Synchronizer:
     def __init__(
@@ -22,15 +34,42 @@ class Synchronizer:
         registration_service: ReferralRegistrationService,
         metadata_api: MetadataService,
         domains_map_service: DomainsMapService,
+        stage_settings: Dict[str, StageSettings] | None = None,
+        queue_size: int = 100,
+        domain_modes: Dict[str, SyncMode] | None = None,
+        seed_with_export: bool = False,
+        precheck: bool = False,
+        system_search: bool = False,
     ) -> None:
         self._registration_service = registration_service
         self._metadata_api = metadata_api
         self._domain_map_service = domains_map_service
+        self._stage_settings = stage_settings or {}
+        self._queue_size = queue_size
+        self._domain_modes = domain_modes or {}
+        self._seed_with_export = seed_with_export
+        self._precheck = precheck
+        self._system_search = system_search
+        self._domain_locks = {data_domain: Lock() for data_domain in domains_map_service.get_domains()}
+        self._domain_stats = {data_domain: DomainRunStats() for data_domain in domains_map_service.get_domains()}
+        self._pipelines: Dict[str, Pipeline] = {}
         self._last_run: str | None = None
 
     def get_allowed_domains(self) -> List[str]:
         return self._domain_map_service.get_domains()
 
+    def get_pipeline_stats(self) -> Dict[str, List[StageStats]]:
+        """
+        Returns the stage statistics of the running, or last finished, pipeline per data domain.
+        """
+        return {data_domain: pipeline.stats() for data_domain, pipeline in self._pipelines.items()}
+
+    def get_domain_stats(self) -> Dict[str, DomainRunStats]:
+        """
+        Returns per data domain how many synchronizations ran and how many the pre-check skipped.
+        """
+        return {data_domain: stats.model_copy() for data_domain, stats in self._domain_stats.items()}
+
     def _healthcheck_apis(self) -> Dict[str, bool]:
         logger.info("Checking health of APIs")
         return {
@@ -40,23 +79,101 @@ class Synchronizer:
         }
 
     def synchronize_all_domains(self) -> Dict[str, List[UpdateScheme]]:
+        data_domains = self._domain_map_service.get_domains()
+        data: Dict[str, List[UpdateScheme]] = {}
+        system_domains = self.__get_system_search_domains(data_domains) if self._system_search else []
+        if len(system_domains) > 1:
+            data.update(self.synchronize_system(system_domains))
+
+        for domain in data_domains:
+            if domain not in data:
+                data.update(self.synchronize_domain(domain))
+
+        return {domain: data[domain] for domain in data_domains}
+
+    def synchronize_system(self, data_domains: List[str]) -> Dict[str, List[UpdateScheme]]:
+        """
+        Synchronizes the data domains together, from a single system level search across their resource
+        types. Every domain still advances its own watermark.
+        """
+        logger.info(f"Synchronizing: {', '.join(data_domains)}")
+        with ExitStack() as stack:
+            for data_domain in sorted(data_domains):
+                stack.enter_context(self._domain_locks[data_domain])
+            entries = {data_domain: self._domain_map_service.get_entry(data_domain) for data_domain in data_domains}
+
+            if self._precheck and not self.__has_system_updates(entries):
+                logger.debug(f"No updates for {', '.join(data_domains)}, skipping synchronization")
+                for data_domain in data_domains:
+                    self._domain_stats.setdefault(data_domain, DomainRunStats()).skipped += 1
+                return {
+                    data_domain: [UpdateScheme(updated_data=[], domain_entry=entries[data_domain])]
+                    for data_domain in data_domains
+                }
+
+            for data_domain in data_domains:
+                self._domain_stats.setdefault(data_domain, DomainRunStats()).runs += 1
+            self.__check_health()
+
+            def pages() -> Iterable[UpdatePage]:
+                self._metadata_api.refresh_patient_cache()
+                yield from self._metadata_api.search_system_updates(
+                    {
+                        data_domain: (entry.last_resource_update, entry.last_resource_ids)
+                        for data_domain, entry in entries.items()
+                    }
+                )
+
+            updates = self.__run_pipeline(pages, entries)
+
+        self._last_run = datetime.now().isoformat()
         return {
-            k: v
-            for domain in self._domain_map_service.get_domains()
-            for k, v in self.synchronize_domain(domain).items()
+            data_domain: [UpdateScheme(updated_data=updates[data_domain], domain_entry=entries[data_domain])]
+            for data_domain in data_domains
         }
 
     def synchronize_domain(self, data_domain: str) -> Dict[str, List[UpdateScheme]]:
         data: Dict[str, List[UpdateScheme]] = {f"{data_domain}": []}
         logger.info(f"Synchronizing: {data_domain}")
 
-        entry = self._domain_map_service.get_entry(data_domain)
-        update_scheme = self.synchronize(data_domain, entry)
+        # the scheduler and notifications may both synchronize a domain, one run at a time
+        with self._domain_locks[data_domain]:
+            entry = self._domain_map_service.get_entry(data_domain)
+            update_scheme = self.synchronize(data_domain, entry)
         data[data_domain].append(update_scheme)
 
         return data
 
     def synchronize(self, data_domain: str, domain_entry: DomainMapEntry) -> UpdateScheme:
+        if self._precheck and not self.__has_updates(data_domain, domain_entry):
+            logger.debug(f"No updates for {data_domain}, skipping synchronization")
+            self._domain_stats.setdefault(data_domain, DomainRunStats()).skipped += 1
+            return UpdateScheme(updated_data=[], domain_entry=domain_entry)
+
+        self._domain_stats.setdefault(data_domain, DomainRunStats()).runs += 1
+        self.__check_health()
+
+        def pages() -> Iterable[UpdatePage]:
+            self._metadata_api.refresh_patient_cache()
+            if self._seed_with_export and domain_entry.last_resource_update is None:
+                logger.info(f"Seeding {data_domain} from a bulk export")
+                yield from self._metadata_api.export_updates(data_domain)
+                return
+
+            search = (
+                self._metadata_api.search_history
+                if self._domain_modes.get(data_domain) == SyncMode.history
+                else self._metadata_api.search_updates
+            )
+            yield from search(data_domain, domain_entry.last_resource_update, domain_entry.last_resource_ids)
+
+        updates = self.__run_pipeline(pages, {data_domain: domain_entry})
+
+        self._last_run = datetime.now().isoformat()
+        logging.info(f"last run {self._last_run}")
+        return UpdateScheme(updated_data=updates[data_domain], domain_entry=domain_entry)
+
+    def __check_health(self) -> None:
         for health_status in self._healthcheck_apis().items():
             if not health_status[1]:
                 msg = f"api {health_status[0]} health check failed"
@@ -68,30 +185,131 @@ class Synchronizer:
                     msg=msg,
                 )
 
-        bsn_update_scheme: List[BsnUpdateScheme] = []
-        updated_bsns, latest_timestamp = self._metadata_api.get_update_scheme(
-            data_domain, domain_entry.last_resource_update
+    def __run_pipeline(
+        self, pages: Callable[[], Iterable[UpdatePage]], entries: Dict[str, DomainMapEntry]
+    ) -> Dict[str, List[BsnUpdateScheme]]:
+        """
+        Registers the patients of the pages through the synchronization pipeline. Pages are numbered per
+        data domain (their resource type) and checkpointed on the entry of that domain.
+        """
+        checkpoints: Dict[str, PageCheckpoints[UpdatePage]] = {
+            data_domain: PageCheckpoints(self.__on_checkpoint(data_domain, entry))
+            for data_domain, entry in entries.items()
+        }
+
+        def fetch() -> Iterable[Tuple[str, int, UpdatePage]]:
+            numbers: Dict[str, int] = {}
+            for page in pages():
+                number = numbers.get(page.resource_type, 0)
+                numbers[page.resource_type] = number + 1
+                yield page.resource_type, number, page
+
+        def extract(pages: List[Tuple[str, int, UpdatePage]]) -> List[Tuple[str, int, str]]:
+            bsns: List[Tuple[str, int, str]] = []
+            for data_domain, number, page in pages:
+                updated_bsns = self._metadata_api.parse_update_page(page)
+                checkpoints[data_domain].add(number, page, len(updated_bsns))
+                bsns.extend((data_domain, number, bsn) for bsn in updated_bsns)
+            return bsns
+
+        def pseudonymize(bsns: List[Tuple[str, int, str]]) -> List[Tuple[str, int, str, str]]:
+            return [
+                (data_domain, number, bsn, self._registration_service.calculate_subject(bsn))
+                for data_domain, number, bsn in bsns
+            ]
+
+        def register(subjects: List[Tuple[str, int, str, str]]) -> List[Tuple[str, BsnUpdateScheme]]:
+            updates: List[Tuple[str, BsnUpdateScheme]] = []
+            for data_domain, number, bsn, subject in subjects:
+                new_referral = self._registration_service.register_subject(subject)
+                if new_referral is not None:
+                    updates.append((data_domain, BsnUpdateScheme(bsn=bsn, referral=new_referral)))
+                checkpoints[data_domain].done(number)
+            return updates
+
+        pipeline = Pipeline(
+            source_name=FETCH_STAGE,
+            source=fetch,
+            stages=[
+                PipelineStage(EXTRACT_STAGE, extract, self._stage_settings.get(EXTRACT_STAGE)),
+                PipelineStage(PSEUDONYM_STAGE, pseudonymize, self._stage_settings.get(PSEUDONYM_STAGE)),
+                PipelineStage(REFERRAL_STAGE, register, self._stage_settings.get(REFERRAL_STAGE)),
+            ],
+            queue_size=self._queue_size,
         )
+        for data_domain in entries:
+            self._pipelines[data_domain] = pipeline
 
-        for bsn in updated_bsns:
-            new_referral = self._registration_service.register(bsn=bsn)
-            if new_referral is None:
-                continue
+        updates: Dict[str, List[BsnUpdateScheme]] = {data_domain: [] for data_domain in entries}
+        try:
+            for data_domain, update in pipeline.run():
+                updates[data_domain].append(update)
+        finally:
+            self._metadata_api.save_patient_cache()
+        return updates
 
-            if latest_timestamp is not None and domain_entry.last_resource_update != latest_timestamp:
-                logging.info(
-                    f"Updating timestamp for resource {data_domain} from {domain_entry.last_resource_update} to {latest_timestamp}"
-                )
-                domain_entry.last_resource_update = latest_timestamp
+    def __on_checkpoint(self, data_domain: str, domain_entry: DomainMapEntry) -> Callable[[UpdatePage], None]:
+        return lambda page: self.__checkpoint(data_domain, domain_entry, page)
 
-            bsn_update_scheme.append(BsnUpdateScheme(bsn=bsn, referral=new_referral))
+    def __get_system_search_domains(self, data_domains: List[str]) -> List[str]:
+        """
+        Returns the domains a system level search can synchronize: domains synchronized by search, with a
+        single patient reference to route patients by, and not waiting to be seeded from an export.
+        """
+        return [
+            data_domain
+            for data_domain in data_domains
+            if self._domain_modes.get(data_domain, SyncMode.search) == SyncMode.search
+            and data_domain in PATIENT_REFERENCE_ATTRIBUTES
+            and not (
+                self._seed_with_export and self._domain_map_service.get_entry(data_domain).last_resource_update is None
+            )
+        ]
 
-        self._last_run = datetime.now().isoformat()
-        logging.info(f"last run {self._last_run}")
-        return UpdateScheme(updated_data=bsn_update_scheme, domain_entry=domain_entry)
+    def __has_system_updates(self, entries: Dict[str, DomainMapEntry]) -> bool:
+        watermarks = [entry.last_resource_update for entry in entries.values()]
+        oldest = None if None in watermarks else min(watermarks, key=lambda w: datetime.fromisoformat(str(w)))
+        try:
+            count = self._metadata_api.count_system_updates(list(entries.keys()), oldest)
+        except Exception as e:
+            logger.warning(f"Pre-check of {', '.join(entries.keys())} failed, synchronizing: {e}")
+            return True
+
+        return count is None or count > 0
+
+    def __has_updates(self, data_domain: str, domain_entry: DomainMapEntry) -> bool:
+        try:
+            count = self._metadata_api.count_updates(data_domain, domain_entry.last_resource_update)
+        except Exception as e:
+            logger.warning(f"Pre-check of {data_domain} failed, synchronizing: {e}")
+            return True
+
+        return count is None or count > 0
+
+    def __checkpoint(self, data_domain: str, domain_entry: DomainMapEntry, page: UpdatePage) -> None:
+        if page.last_updated is None or (
+            page.last_updated == domain_entry.last_resource_update and page.last_ids == domain_entry.last_resource_ids
+        ):
+            return
+
+        logger.info(f"Checkpoint for resource {data_domain} at {page.last_updated}")
+        domain_entry.last_resource_update = page.last_updated
+        domain_entry.last_resource_ids = page.last_ids
+        self._domain_map_service.update_entry(data_domain, domain_entry)
 
     def clear_cache(self, data_domain: str | None = None) -> DomainsMap:
-        if data_domain is not None:
-            return self._domain_map_service.clear_entry_timestamp(data_domain)
+        """
+        Clears the synchronization progress of data_domain, or of all domains. A run of the domain in progress
+        finishes first, so it cannot save its progress over the cleared one. The patient cache is shared by all
+        domains and only cleared with all domains.
+        """
+        domains = [data_domain] if data_domain is not None else list(self._domain_locks)
+        with ExitStack() as stack:
+            for domain in sorted(domain for domain in domains if domain in self._domain_locks):
+                stack.enter_context(self._domain_locks[domain])
+
+            if data_domain is not None:
+                return self._domain_map_service.clear_entry_timestamp(data_domain)
 
-        return self._domain_map_service.clear_all_entries_timestamp()
+            self._metadata_api.clear_patient_cache()
+            return self._domain_map_service.clear_all_entries_timestamp()
@@ -0,0 +1,60 @@
+"""
+Compares validating candidate BSNs one by one with the BSN class against the vectorized validate_bsns.
+
+Usage: python -m benchmarks.bsn_validation [--count 1000000] [--invalid-ratio 0.1]
+"""
+
+import argparse
+import random
+import time
+from typing import List
+
+from app.models.bsn import BSN, validate_bsns
+
+
+def make_candidates(count: int, invalid_ratio: float) -> List[str]:
+    candidates = []
+    for _ in range(count):
+        digits = [random.randint(0, 9) for _ in range(8)]
+        check = sum(digit * (9 - idx) for idx, digit in enumerate(digits)) % 11
+        if check == 10 or random.random() < invalid_ratio:
+            check = (check + 1) % 10
+        candidates.append("".join(map(str, digits)) + str(check))
+    return candidates
+
+
+def validate_scalar(candidates: List[str]) -> int:
+    valid = 0
+    for candidate in candidates:
+        try:
+            BSN(candidate)
+            valid += 1
+        except ValueError:
+            pass
+    return valid
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--invalid-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    candidates = make_candidates(args.count, args.invalid_ratio)
+
+    started = time.perf_counter()
+    scalar_valid = validate_scalar(candidates)
+    scalar = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectorized_valid = int(validate_bsns(candidates).valid.sum())
+    vectorized = time.perf_counter() - started
+
+    assert scalar_valid == vectorized_valid
+    print(f"{args.count} candidate BSNs, {scalar_valid} valid")
+    print(f"{'BSN class':>15}: {scalar * 1000:9.1f} ms")
+    print(f"{'validate_bsns':>15}: {vectorized * 1000:9.1f} ms  ({scalar / vectorized:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Measures the latency of a light endpoint (GET /version.json) while large registration bundles are
+posted to the same worker, with and without validating those bundles in the process pool.
+
+Upstream registration is patched out, so only the request handling of the NVI-RS itself is measured.
+
+Usage: python -m benchmarks.large_bundle_latency [--entries 5000] [--bundles 8] [--probes 200]
+"""
+
+import argparse
+import json
+import multiprocessing
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List
+from unittest.mock import patch
+
+import requests
+import uvicorn
+
+from app.config import set_config
+from app.container import get_bundle_registration_service
+from app.services.registration.bundle import BundleRegistrationService
+from app.services.registration.referrals import ReferralRegistrationService
+from tests.test_config import get_test_config
+
+HOST = "127.0.0.1"
+PORT = 8599
+
+
+def make_bundle(entries: int) -> bytes:
+    resources: List[Dict[str, Any]] = [
+        {
+            "resourceType": "Patient",
+            "id": "patient-1",
+            "identifier": [{"system": "http://fhir.nl/fhir/NamingSystem/bsn", "value": "200060429"}],
+        }
+    ]
+    for index in range(entries - 1):
+        resources.append(
+            {
+                "resourceType": "Observation",
+                "id": f"observation-{index}",
+                "status": "final",
+                "code": {"coding": [{"system": "http://loinc.org", "code": "8867-4", "display": "Heart rate"}]},
+                "subject": {"reference": "Patient/patient-1"},
+                "valueQuantity": {"value": 60 + index % 40, "unit": "beats/minute"},
+            }
+        )
+    return json.dumps(
+        {"resourceType": "Bundle", "type": "collection", "entry": [{"resource": res} for res in resources]}
+    ).encode()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(service: BundleRegistrationService, body: bytes, bundles: int, probes: int) -> List[float]:
+    set_config(get_test_config())
+    from app.application import setup_fastapi
+
+    application = setup_fastapi()
+    application.dependency_overrides[get_bundle_registration_service] = lambda: service
+    server = uvicorn.Server(uvicorn.Config(application, host=HOST, port=PORT, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    latencies: List[float] = []
+    try:
+        with ThreadPoolExecutor(max_workers=bundles) as executor:
+            posts = [
+                executor.submit(
+                    requests.post,
+                    f"http://{HOST}:{PORT}/registration",
+                    data=body,
+                    headers={"Content-Type": "application/json"},
+                )
+                for _ in range(bundles)
+            ]
+            for _ in range(probes):
+                started = time.perf_counter()
+                requests.get(f"http://{HOST}:{PORT}/version.json")
+                latencies.append((time.perf_counter() - started) * 1000)
+            for post in posts:
+                post.result()
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--bundles", type=int, default=8)
+    parser.add_argument("--probes", type=int, default=200)
+    args = parser.parse_args()
+
+    body = make_bundle(args.entries)
+    referrals = ReferralRegistrationService(nvi_service=None, pseudonym_service=None, nvi_oin="")  # type: ignore
+
+    with patch.object(ReferralRegistrationService, "register", return_value=None):
+        in_thread = run(BundleRegistrationService(referrals), body, args.bundles, args.probes)
+        pooled_service = BundleRegistrationService(
+            referrals,
+            process_pool_factory=partial(
+                ProcessPoolExecutor, max_workers=2, mp_context=multiprocessing.get_context("spawn")
+            ),
+            process_pool_threshold_bytes=1_048_576,
+        )
+        try:
+            pooled = run(pooled_service, body, args.bundles, args.probes)
+        finally:
+            pooled_service.shutdown()
+
+    print(f"{args.bundles} concurrent bundles of {args.entries} entries, {args.probes} probes of GET /version.json")
+    for name, latencies in [("request thread", in_thread), ("process pool", pooled)]:
+        print(
+            f"{name:>15}: p50 {statistics.median(latencies):8.2f} ms"
+            f"  p99 {percentile(latencies, 99):8.2f} ms  max {max(latencies):8.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
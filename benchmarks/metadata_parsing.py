@@ -0,0 +1,125 @@
+"""
+Measures the CPU time and peak memory of reading a metadata search page and taking the BSNs from it, per
+10k entries, through the fhir.resources models and through the slim metadata models of the synchronization.
+
+Usage: python -m benchmarks.metadata_parsing [--entries 10000] [--repeat 5]
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import orjson
+from fhir.resources.R4B.bundle import Bundle
+
+from app.data import BSN_SYSTEM
+from app.models.metadata.fhir import Bundle as MetadataBundle
+from app.services.metadata import MetadataService, UpdatePage
+from app.services.parsers.bundle import BundleParser
+from app.services.parsers.metadata import MetadataBundleParser
+from app.services.parsers.patient import PatientParser
+
+METADATA_SERVICE = MetadataService(
+    endpoint="http://localhost", timeout=1, mtls_cert=None, mtls_key=None, verify_ca=True
+)
+
+
+def make_page(entries: int) -> bytes:
+    """
+    A search page of ImagingStudy resources, each followed by the Patient it refers to.
+    """
+    resources: List[Dict[str, Any]] = []
+    for index in range(entries // 2):
+        resources.append(
+            {
+                "resourceType": "ImagingStudy",
+                "id": f"study-{index}",
+                "meta": {"lastUpdated": "2025-01-01T10:00:00+00:00"},
+                "status": "available",
+                "subject": {"reference": f"Patient/patient-{index}"},
+                "started": "2025-01-01T09:00:00Z",
+                "numberOfSeries": 2,
+                "numberOfInstances": 2,
+                "series": [
+                    {
+                        "uid": f"1.2.3.{index}.{series}",
+                        "number": series,
+                        "modality": {"system": "http://dicom.nema.org/resources/ontology/DCM", "code": "CT"},
+                        "description": "Example CT series",
+                        "instance": [
+                            {
+                                "uid": f"1.2.3.{index}.{series}.1",
+                                "sopClass": {"system": "urn:ietf:rfc:3986", "code": "1.2.840.10008.5.1.4.1.1.2"},
+                                "number": 1,
+                            }
+                        ],
+                    }
+                    for series in (1, 2)
+                ],
+            }
+        )
+        resources.append(
+            {
+                "resourceType": "Patient",
+                "id": f"patient-{index}",
+                "meta": {"lastUpdated": "2025-01-01T10:00:00+00:00"},
+                "identifier": [{"system": BSN_SYSTEM, "value": "200060429"}],
+                "name": [{"family": "Doe", "given": ["Jane"]}],
+                "gender": "female",
+                "birthDate": "1990-02-17",
+            }
+        )
+    return orjson.dumps({"resourceType": "Bundle", "type": "searchset", "entry": [{"resource": r} for r in resources]})
+
+
+def parse_with_fhir_models(body: bytes) -> List[str]:
+    bundle = Bundle.model_validate(orjson.loads(body))
+    return PatientParser.map_identifiers_to_bsn(PatientParser.get_identifiers(BundleParser.get_patients(bundle)))
+
+
+def parse_with_metadata_models(body: bytes) -> List[str]:
+    bundle = MetadataBundle.model_validate_json(body)
+    page = UpdatePage(
+        bundle=bundle,
+        resource_type="ImagingStudy",
+        resources=MetadataBundleParser.get_resources_of_type(bundle, "ImagingStudy"),
+        last_updated=None,
+        last_ids=[],
+    )
+    return METADATA_SERVICE.parse_update_page(page)
+
+
+def measure(parse: Callable[[bytes], List[str]], body: bytes, entries: int, repeat: int) -> Tuple[float, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        parse(body)
+        timings.append(time.process_time() - started)
+
+    tracemalloc.start()
+    result = parse(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(result) == entries // 2
+
+    scale = 10_000 / entries
+    return statistics.median(timings) * 1000 * scale, peak / 1024 / 1024 * scale
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = make_page(args.entries)
+    print(f"search page of {args.entries} entries ({len(body) / 1024 / 1024:.1f} MiB), median of {args.repeat} runs")
+    for name, parse in [("fhir models", parse_with_fhir_models), ("metadata models", parse_with_metadata_models)]:
+        cpu, memory = measure(parse, body, args.entries, args.repeat)
+        print(f"{name:>16}: {cpu:8.1f} ms cpu, {memory:7.1f} MiB peak per 10k entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Measures the per-entry cost of finding the patient reference of the resources in a mixed bundle, through the
+former structural match over the resource classes and through the dispatch table keyed by resourceType.
+
+Usage: python -m benchmarks.reference_dispatch [--entries 10000] [--repeat 20]
+"""
+
+import argparse
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from fhir.resources.R4B import get_fhir_model_class
+from fhir.resources.R4B.allergyintolerance import AllergyIntolerance
+from fhir.resources.R4B.bodystructure import BodyStructure
+from fhir.resources.R4B.careplan import CarePlan
+from fhir.resources.R4B.careteam import CareTeam
+from fhir.resources.R4B.clinicalimpression import ClinicalImpression
+from fhir.resources.R4B.detectedissue import DetectedIssue
+from fhir.resources.R4B.diagnosticreport import DiagnosticReport
+from fhir.resources.R4B.domainresource import DomainResource
+from fhir.resources.R4B.encounter import Encounter
+from fhir.resources.R4B.familymemberhistory import FamilyMemberHistory
+from fhir.resources.R4B.imagingstudy import ImagingStudy
+from fhir.resources.R4B.immunization import Immunization
+from fhir.resources.R4B.immunizationevaluation import ImmunizationEvaluation
+from fhir.resources.R4B.immunizationrecommendation import ImmunizationRecommendation
+from fhir.resources.R4B.measurereport import MeasureReport
+from fhir.resources.R4B.medicationadministration import MedicationAdministration
+from fhir.resources.R4B.medicationdispense import MedicationDispense
+from fhir.resources.R4B.medicationrequest import MedicationRequest
+from fhir.resources.R4B.medicationstatement import MedicationStatement
+from fhir.resources.R4B.molecularsequence import MolecularSequence
+from fhir.resources.R4B.nutritionorder import NutritionOrder
+from fhir.resources.R4B.observation import Observation
+from fhir.resources.R4B.procedure import Procedure
+from fhir.resources.R4B.reference import Reference
+from fhir.resources.R4B.riskassessment import RiskAssessment
+
+from app.services.parsers.reference import ReferenceParser
+
+# The resource classes in the order of the former match, late entries paid for every earlier isinstance check
+MATCHED_RESOURCES = [
+    (AllergyIntolerance, "patient"),
+    (BodyStructure, "patient"),
+    (ImagingStudy, "subject"),
+    (CarePlan, "subject"),
+    (CareTeam, "subject"),
+    (ClinicalImpression, "subject"),
+    (Encounter, "subject"),
+    (DetectedIssue, "patient"),
+    (DiagnosticReport, "subject"),
+    (FamilyMemberHistory, "patient"),
+    (MedicationStatement, "subject"),
+    (MedicationAdministration, "subject"),
+    (MedicationDispense, "subject"),
+    (MedicationRequest, "subject"),
+    (Immunization, "patient"),
+    (ImmunizationEvaluation, "patient"),
+    (ImmunizationRecommendation, "patient"),
+    (MeasureReport, "subject"),
+    (MolecularSequence, "patient"),
+    (NutritionOrder, "patient"),
+    (Observation, "subject"),
+    (Procedure, "subject"),
+    (RiskAssessment, "subject"),
+]
+
+# Resources of a typical mixed bundle, weighted towards the ones most registrations carry
+MIXED_BUNDLE = [
+    ("Observation", "subject", 8),
+    ("Encounter", "subject", 2),
+    ("Procedure", "subject", 2),
+    ("MedicationRequest", "subject", 2),
+    ("DiagnosticReport", "subject", 1),
+    ("Immunization", "patient", 1),
+    ("AllergyIntolerance", "patient", 1),
+    ("Organization", None, 1),
+]
+
+
+def get_patient_reference_by_match(resource: DomainResource) -> Reference | None:
+    for model, attribute in MATCHED_RESOURCES:
+        if isinstance(resource, model):
+            reference: Reference | None = getattr(resource, attribute)
+            return reference
+    return None
+
+
+def make_resources(entries: int) -> List[DomainResource]:
+    weighted = [(name, attribute) for name, attribute, weight in MIXED_BUNDLE for _ in range(weight)]
+    resources: List[DomainResource] = []
+    for index in range(entries):
+        name, attribute = weighted[index % len(weighted)]
+        fields: Dict[str, Any] = {"id": str(index)}
+        if attribute is not None:
+            fields[attribute] = Reference.model_construct(reference="Patient/1")
+        resource = get_fhir_model_class(name).model_construct(**fields)
+        assert isinstance(resource, DomainResource)
+        resources.append(resource)
+    return resources
+
+
+def measure(
+    lookup: Callable[[DomainResource], Reference | None], resources: List[DomainResource], repeat: int
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for resource in resources:
+            lookup(resource)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1_000_000_000 / len(resources)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    resources = make_resources(args.entries)
+    assert [get_patient_reference_by_match(res) for res in resources] == [
+        ReferenceParser.get_patient_reference(res) for res in resources
+    ]
+
+    print(f"mixed bundle of {args.entries} entries, median of {args.repeat} runs")
+    for name, lookup in [
+        ("match", get_patient_reference_by_match),
+        ("dispatch table", ReferenceParser.get_patient_reference),
+    ]:
+        print(f"{name:>15}: {measure(lookup, resources, args.repeat):8.1f} ns per entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures the time to build the transaction-response of a registration bundle per 1000 entries, through
+the FHIR models (validated Bundle, model_dump and the stdlib JSONResponse) and through the prebuilt JSON
+entries rendered directly.
+
+Usage: python -m benchmarks.response_serialization [--entries 1000] [--repeat 20]
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+from starlette.responses import JSONResponse
+
+from app.services.fhir.bunde_entry_response import (
+    KnownBundleRegistrationOutcome,
+    create_known_entry_json,
+    create_known_response,
+)
+from app.services.fhir.bundle import BundleService
+
+
+def make_outcomes(entries: int) -> List[Tuple[KnownBundleRegistrationOutcome, str]]:
+    outcomes = [
+        (KnownBundleRegistrationOutcome.OK, "Record created successfully"),
+        (KnownBundleRegistrationOutcome.WARNING, "Record already exists"),
+        (KnownBundleRegistrationOutcome.ERROR, "Invalid BSN number"),
+    ]
+    return [outcomes[index % len(outcomes)] for index in range(entries)]
+
+
+def build_with_models(outcomes: List[Tuple[KnownBundleRegistrationOutcome, str]]) -> bytes:
+    responses = [create_known_response(outcome, details) for outcome, details in outcomes]
+    return JSONResponse(content=BundleService.from_entry_response(responses).model_dump()).body
+
+
+def build_with_json(outcomes: List[Tuple[KnownBundleRegistrationOutcome, str]]) -> bytes:
+    return BundleService.from_entry_json(create_known_entry_json(outcome, details) for outcome, details in outcomes)
+
+
+def measure(build: Callable[[List[Tuple[KnownBundleRegistrationOutcome, str]]], bytes], entries: int, repeat: int) -> float:
+    outcomes = make_outcomes(entries)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        build(outcomes)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000 * 1000 / entries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"transaction-response of {args.entries} entries, median of {args.repeat} runs")
+    for name, build in [("fhir models", build_with_models), ("prebuilt json", build_with_json)]:
+        print(f"{name:>15}: {measure(build, args.entries, args.repeat):8.2f} ms per 1k entries")
+
+
+if __name__ == "__main__":
+    main()
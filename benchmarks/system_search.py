@@ -0,0 +1,169 @@
+"""
+Compares searching the updates of every data domain with a search per domain against a single system level
+search across all domains, on a local stand-in metadata server that adds a fixed latency to every request.
+Reports the wall time and the amount of requests per synchronization tick, for a tick after which every
+domain changed and for a quiet tick without changes.
+
+Usage: python -m benchmarks.system_search [--domains 20] [--resources 50] [--latency-ms 20]
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import orjson
+
+from app.services.metadata import MetadataService
+from app.services.parsers.reference import PATIENT_REFERENCE_ATTRIBUTES
+from app.services.synchronization.patient_cache import PatientCache
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+Watermarks = Dict[str, Tuple[str | None, List[str]]]
+
+
+class MetadataServer(ThreadingHTTPServer):
+    def __init__(self, resources: List[Dict[str, Any]], latency: float) -> None:
+        super().__init__(("127.0.0.1", 0), MetadataHandler)
+        self.resources = resources
+        self.latency = latency
+        self.requests = 0
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/fhir"
+
+
+class MetadataHandler(BaseHTTPRequestHandler):
+    server: MetadataServer
+
+    def do_GET(self) -> None:
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        route = url.path.removeprefix("/fhir/")
+        types = params["_type"].split(",") if route == "_search" else [route.removesuffix("/_search")]
+
+        matches = [resource for resource in self.server.resources if resource["resourceType"] in types]
+        last_updated = params.get("_lastUpdated")
+        if last_updated is not None:
+            since = datetime.fromisoformat(last_updated[2:])
+            include_equal = last_updated.startswith("ge")
+            matches = [
+                resource
+                for resource in matches
+                if (updated := datetime.fromisoformat(resource["meta"]["lastUpdated"])) > since
+                or (include_equal and updated == since)
+            ]
+        matches.sort(key=lambda resource: (resource["meta"]["lastUpdated"], resource["id"]))
+
+        bundle: Dict[str, Any] = {"resourceType": "Bundle", "type": "searchset", "total": len(matches)}
+        if params.get("_summary") != "count":
+            offset = int(params.get("_offset", 0))
+            count = int(params.get("_count", 100))
+            bundle["entry"] = [{"resource": resource} for resource in matches[offset : offset + count]]
+            bundle["link"] = []
+            if offset + count < len(matches):
+                next_params = urlencode({**params, "_offset": offset + count})
+                bundle["link"].append({"relation": "next", "url": f"{self.server.endpoint}/{route}?{next_params}"})
+
+        body = orjson.dumps(bundle)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/fhir+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def make_resources(domains: List[str], resources: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "resourceType": domain,
+            "id": f"{domain.lower()}-{index}",
+            "meta": {"lastUpdated": (START + timedelta(seconds=index * len(domains) + offset)).isoformat()},
+            PATIENT_REFERENCE_ATTRIBUTES[domain]: {"reference": f"Patient/patient-{index}"},
+        }
+        for offset, domain in enumerate(domains)
+        for index in range(resources)
+    ]
+
+
+def per_domain(service: MetadataService, watermarks: Watermarks) -> int:
+    return sum(
+        len(page.resources)
+        for domain, (last_updated, last_ids) in watermarks.items()
+        for page in service.search_updates(domain, last_updated, last_ids)
+    )
+
+
+def system_level(service: MetadataService, watermarks: Watermarks) -> int:
+    return sum(len(page.resources) for page in service.search_system_updates(watermarks))
+
+
+def newest_watermarks(pages: Iterable[Any]) -> Watermarks:
+    watermarks: Watermarks = {}
+    for page in pages:
+        watermarks[page.resource_type] = (page.last_updated, page.last_ids)
+    return watermarks
+
+
+def measure(
+    server: MetadataServer, search: Callable[[MetadataService, Watermarks], int], watermarks: Watermarks
+) -> Tuple[float, int, int]:
+    service = MetadataService(
+        endpoint=server.endpoint,
+        timeout=10,
+        mtls_cert=None,
+        mtls_key=None,
+        verify_ca=True,
+        patient_cache=PatientCache(),
+    )
+    server.requests = 0
+    started = time.perf_counter()
+    found = search(service, watermarks)
+    return (time.perf_counter() - started) * 1000, server.requests, found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--domains", type=int, default=20)
+    parser.add_argument("--resources", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    domains = list(PATIENT_REFERENCE_ATTRIBUTES)[: args.domains]
+    server = MetadataServer(make_resources(domains, args.resources), args.latency_ms / 1000)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    changed: Watermarks = {domain: (None, []) for domain in domains}
+    service = MetadataService(
+        endpoint=server.endpoint,
+        timeout=10,
+        mtls_cert=None,
+        mtls_key=None,
+        verify_ca=True,
+        patient_cache=PatientCache(),
+    )
+    quiet = newest_watermarks(service.search_system_updates(changed))
+
+    print(
+        f"{len(domains)} domains of {args.resources} resources, page size 100, {args.latency_ms:.0f} ms latency per request"
+    )
+    for tick, watermarks in [("changed", changed), ("quiet", quiet)]:
+        for name, search in [("per domain", per_domain), ("system level", system_level)]:
+            elapsed, requests, found = measure(server, search, watermarks)
+            print(f"{tick:>8} tick, {name:>12}: {elapsed:7.1f} ms, {requests:3d} requests, {found:5d} resources")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from typing import Any
 
 import pytest
 
-from app.models.bsn import BSN
+from app.models.bsn import BSN, get_bsn_error, validate_bsns
 
 
 @pytest.mark.parametrize(
@@ -26,14 +26,15 @@ def test_valid_bsn_should_succeed(valid_bsn: Any) -> None:
     [
         ("12345678", "BSN must be 9 digits"),
         ("1234567890", "BSN must be 9 digits"),
-        ("abcdefghi", "invalid literal for int"),
+        ("abcdefghi", "BSN must only contain digits"),
+        ("12345678²", "BSN must only contain digits"),
         ("123456789", "Invalid BSN"),
     ],
 )
 def test_invalid_bsn_should_raise_exception(invalid_bsn: str, expected_error: str) -> None:
     with pytest.raises(ValueError) as excinfo:
         BSN(invalid_bsn)
-    assert expected_error.split()[0] in str(excinfo.value)
+    assert str(excinfo.value) == expected_error
 
 
 def test_bsn_hash_should_succeed() -> None:
@@ -44,3 +45,52 @@ def test_bsn_hash_should_succeed() -> None:
     actual = bsn.hash()
 
     assert expected == actual
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("111222333", None),
+        ("200060429", None),
+        ("123456789", "Invalid BSN"),
+        ("12345678", "BSN must be 9 digits"),
+        ("", "BSN must be 9 digits"),
+        ("abcdefghi", "BSN must only contain digits"),
+        ("12345678²", "BSN must only contain digits"),
+    ],
+)
+def test_get_bsn_error_should_check_length_digits_and_checksum(value: str, expected: str | None) -> None:
+    assert get_bsn_error(value) == expected
+
+
+def test_validate_bsns_should_return_mask_and_reasons() -> None:
+    actual = validate_bsns(["111222333", "123456789", "12345678", "200060429"])
+
+    assert actual.valid.tolist() == [True, False, False, True]
+    assert actual.reasons == [None, "Invalid BSN", "BSN must be 9 digits", None]
+
+
+def test_validate_bsns_should_succeed_without_values() -> None:
+    actual = validate_bsns([])
+
+    assert actual.valid.tolist() == []
+    assert actual.reasons == []
+
+
+def test_validate_bsns_should_match_get_bsn_error() -> None:
+    values = [
+        "111222333",
+        "123456782",
+        "123456789",
+        "",
+        "1234567890",
+        "abcdefghi",
+        "12345678²",
+        "١٢٣٤٥٦٧٨٢",
+        " 23456782",
+    ]
+
+    actual = validate_bsns(values)
+
+    assert actual.reasons == [get_bsn_error(value) for value in values]
+    assert actual.valid.tolist() == [get_bsn_error(value) is None for value in values]
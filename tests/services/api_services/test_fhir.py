@@ -1,3 +1,4 @@
+import json
 from typing import Any, Dict
 from unittest.mock import MagicMock, patch
 
@@ -10,23 +11,32 @@ from app.services.api.fhir import FhirHttpService
 PATCHED_MODULE = "app.services.api.fhir.HttpService.do_request"
 
 
+def search_response(bundle: Bundle, next_link: str | None = None) -> MagicMock:
+    data = bundle.model_dump(mode="json")
+    data["link"] = [{"relation": "self", "url": "http://example.org/fhir/ImagingStudy/_search"}]
+    if next_link is not None:
+        data["link"].append({"relation": "next", "url": next_link})
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = json.dumps(data).encode()
+    return mock_response
+
+
 @patch(PATCHED_MODULE)
-def test_search_should_with_params_succed(
+def test_search_metadata_should_succeed_with_params(
     mock_get: MagicMock,
     fhir_http_service: FhirHttpService,
     regular_bundle: Bundle,
     query_param: Dict[str, Any],
 ) -> None:
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = regular_bundle.model_dump()
-    mock_response.params.return_value = query_param
-    mock_get.return_value = mock_response
-
-    actual = fhir_http_service.search("ImagingStudy", query_param)
+    mock_get.return_value = search_response(regular_bundle)
 
-    assert regular_bundle == actual
+    actual = fhir_http_service.search_metadata("ImagingStudy", query_param)
 
+    assert [entry.resource.id for entry in actual.entry or [] if entry.resource] == [
+        "example-patient",
+        "example-imagingstudy",
+    ]
     mock_get.assert_called_once_with(
         method="GET",
         sub_route="ImagingStudy/_search",
@@ -35,49 +45,97 @@ def test_search_should_with_params_succed(
 
 
 @patch(PATCHED_MODULE)
-def test_search_should_succeed_without_params(
+def test_search_metadata_without_last_update_should_succeed(
     mock_get: MagicMock,
     fhir_http_service: FhirHttpService,
     regular_bundle: Bundle,
+    query_params_without_last_update: Dict[str, Any],
 ) -> None:
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = regular_bundle.model_dump()
-    mock_get.return_value = mock_response
+    mock_get.return_value = search_response(regular_bundle)
 
-    actual = fhir_http_service.search("ImagingStudy")
+    fhir_http_service.search_metadata(resource_type="ImagingStudy", params=query_params_without_last_update)
 
-    assert regular_bundle == actual
-
-    mock_get.assert_called_once_with(method="GET", sub_route="ImagingStudy/_search", params=None)
+    mock_get.assert_called_once_with(
+        method="GET",
+        sub_route="ImagingStudy/_search",
+        params={"_include": "ImagingStudy:subject"},
+    )
 
 
 @patch(PATCHED_MODULE)
-def test_get_resource_bundle_without_last_update_bundle_should_succeed(
+def test_search_metadata_should_search_system_level_without_resource_type(
     mock_get: MagicMock,
     fhir_http_service: FhirHttpService,
     regular_bundle: Bundle,
-    query_params_without_last_update: Dict[str, Any],
 ) -> None:
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = regular_bundle.model_dump()
-    mock_response.params.return_value = query_params_without_last_update
-    mock_get.return_value = mock_response
-
-    actual = fhir_http_service.search(resource_type="ImagingStudy", params=query_params_without_last_update)
+    mock_get.return_value = search_response(regular_bundle)
 
-    assert regular_bundle == actual
+    fhir_http_service.search_metadata("")
 
-    mock_get.assert_called_once_with(
-        method="GET",
-        sub_route="ImagingStudy/_search",
-        params={"_include": "ImagingStudy:subject"},
-    )
+    mock_get.assert_called_once_with(method="GET", sub_route="_search", params=None)
 
 
 @patch(PATCHED_MODULE)
-def test_search_should_fail_with_error_status_code(mock_get: MagicMock, fhir_http_service: FhirHttpService) -> None:
+def test_search_metadata_should_fail_with_error_status_code(
+    mock_get: MagicMock, fhir_http_service: FhirHttpService
+) -> None:
     mock_get.side_effect = HTTPError()
     with pytest.raises(HTTPError):
-        fhir_http_service.search("ImagingStudy")
+        fhir_http_service.search_metadata("ImagingStudy")
+
+
+@pytest.mark.parametrize(
+    "link, expected",
+    [
+        (
+            "http://example.org/fhir?_getpages=abc&_getpagesoffset=2",
+            "http://example.org/fhir?_getpages=abc&_getpagesoffset=2",
+        ),
+        ("?_getpages=abc&_getpagesoffset=4", "http://example.org/fhir/?_getpages=abc&_getpagesoffset=4"),
+    ],
+)
+@patch(PATCHED_MODULE)
+def test_get_metadata_page_should_resolve_link_against_endpoint(
+    mock_get: MagicMock,
+    link: str,
+    expected: str,
+    fhir_http_service: FhirHttpService,
+    regular_bundle: Bundle,
+) -> None:
+    mock_get.return_value = search_response(regular_bundle, "?_getpages=abc&_getpagesoffset=6")
+
+    actual = fhir_http_service.get_metadata_page(link)
+
+    assert actual.link[-1].url == "?_getpages=abc&_getpagesoffset=6"
+    mock_get.assert_called_once_with(method="GET", url=expected)
+
+
+@patch(PATCHED_MODULE)
+def test_get_metadata_page_should_not_follow_links_outside_endpoint(
+    mock_get: MagicMock,
+    fhir_http_service: FhirHttpService,
+) -> None:
+    with pytest.raises(ValueError):
+        fhir_http_service.get_metadata_page("http://attacker.example.com/fhir?page=2")
+
+    mock_get.assert_not_called()
+
+
+@patch(PATCHED_MODULE)
+def test_search_metadata_should_read_slim_bundle(
+    mock_get: MagicMock,
+    fhir_http_service: FhirHttpService,
+    regular_bundle: Bundle,
+) -> None:
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = regular_bundle.model_dump_json().encode()
+    mock_get.return_value = mock_response
+
+    actual = fhir_http_service.search_metadata("ImagingStudy")
+
+    assert [entry.resource.resource_type for entry in actual.entry or [] if entry.resource] == [
+        "Patient",
+        "ImagingStudy",
+    ]
+    mock_get.assert_called_once_with(method="GET", sub_route="ImagingStudy/_search", params=None)
@@ -1,6 +1,9 @@
+import json
+from typing import Iterator, List
+
 from fhir.resources.R4B.bundle import Bundle, BundleEntry, BundleEntryResponse
 
-from app.services.fhir.bundle import BundleService
+from app.services.fhir.bundle import STREAM_FAILURE_DETAILS, BundleService
 
 
 def test_from_entry_response_should_succeed() -> None:
@@ -9,3 +12,50 @@ def test_from_entry_response_should_succeed() -> None:
     actual = BundleService.from_entry_response([entry_response])
 
     assert expected == actual
+
+
+def test_from_entry_json_should_match_bundle() -> None:
+    responses = [BundleEntryResponse(status="201"), BundleEntryResponse(status="200")]
+    expected = BundleService.from_entry_response(responses).model_dump()
+
+    actual = json.loads(BundleService.from_entry_json(dump_entries(responses)))
+
+    assert expected == actual
+
+
+def test_stream_entry_response_should_match_bundle() -> None:
+    responses = [BundleEntryResponse(status="201"), BundleEntryResponse(status="200")]
+    expected = BundleService.from_entry_response(responses).model_dump()
+
+    actual = json.loads(b"".join(BundleService.stream_entry_response(dump_entries(responses))))
+
+    assert expected == actual
+
+
+def test_stream_entry_response_should_succeed_without_entries() -> None:
+    actual = json.loads(b"".join(BundleService.stream_entry_response([])))
+
+    assert actual == {"resourceType": "Bundle", "type": "transaction-response", "entry": []}
+
+
+def test_stream_entry_response_ndjson_should_write_one_entry_per_line() -> None:
+    responses = [BundleEntryResponse(status="201"), BundleEntryResponse(status="200")]
+
+    lines = b"".join(BundleService.stream_entry_response_ndjson(dump_entries(responses))).splitlines()
+
+    assert [json.loads(line)["response"]["status"] for line in lines] == ["201", "200"]
+
+
+def test_stream_entry_response_should_end_with_error_entry_on_failure() -> None:
+    def failing_entries() -> Iterator[bytes]:
+        yield from dump_entries([BundleEntryResponse(status="201")])
+        raise ConnectionError("Failed to exchange BSN for pseudonym")
+
+    actual = json.loads(b"".join(BundleService.stream_entry_response(failing_entries())))
+
+    assert [entry["response"]["status"] for entry in actual["entry"]] == ["201", "500"]
+    assert actual["entry"][1]["response"]["outcome"]["issue"][0]["details"]["text"] == STREAM_FAILURE_DETAILS
+
+
+def dump_entries(responses: List[BundleEntryResponse]) -> List[bytes]:
+    return [BundleEntry(response=response).model_dump_json().encode() for response in responses]
@@ -1,9 +1,16 @@
-from fhir.resources.R4B.bundle import BundleEntryResponse
+import json
+
+import pytest
+from fhir.resources.R4B.bundle import BundleEntry, BundleEntryResponse
 from fhir.resources.R4B.codeableconcept import CodeableConcept
 from fhir.resources.R4B.operationoutcome import OperationOutcome, OperationOutcomeIssue
 
 from app.services.fhir.bunde_entry_response import (
+    KnownBundleRegistrationOutcome,
+    create_bundle_entry_json,
     create_bundle_response,
+    create_known_entry_json,
+    create_known_response,
     create_opertaion_outcome,
 )
 
@@ -24,3 +31,24 @@ def test_create_bundle_response_should_succeed() -> None:
     actual = create_bundle_response(status=400, severity="error", code="some-code", details="some-details")
 
     assert expected == actual
+
+
+@pytest.mark.parametrize("outcome", list(KnownBundleRegistrationOutcome))
+def test_create_known_entry_json_should_match_known_response(outcome: KnownBundleRegistrationOutcome) -> None:
+    expected = BundleEntry(response=create_known_response(outcome, "some-details")).model_dump()
+
+    actual = json.loads(create_known_entry_json(outcome, "some-details"))
+
+    assert expected == actual
+
+
+def test_create_bundle_entry_json_should_succeed() -> None:
+    expected = BundleEntry(
+        response=create_bundle_response(status=500, severity="error", code="exception", details="some-details")
+    ).model_dump()
+
+    actual = json.loads(
+        create_bundle_entry_json(status=500, severity="error", code="exception", details="some-details")
+    )
+
+    assert expected == actual
@@ -0,0 +1,70 @@
+from datetime import datetime
+from typing import Any, Dict
+
+import pytest
+
+from app.data import BSN_SYSTEM
+from app.models.metadata.fhir import Bundle, Resource
+from app.services.parsers.metadata import MetadataBundleParser
+
+
+@pytest.fixture
+def metadata_bundle(mock_bundle: Dict[str, Any]) -> Bundle:
+    return Bundle.model_validate(
+        {**mock_bundle, "link": [*mock_bundle["link"], {"relation": "next", "url": "http://example.org?page=2"}]}
+    )
+
+
+def test_metadata_bundle_should_only_keep_used_fields(metadata_bundle: Bundle, datetime_past: str) -> None:
+    study = MetadataBundleParser.get_resources_of_type(metadata_bundle, "ImagingStudy")[0]
+
+    assert study.model_dump(exclude_none=True, by_alias=True) == {
+        "id": "example-imagingstudy",
+        "meta": {"lastUpdated": datetime.fromisoformat(datetime_past)},
+        "identifier": [{"system": "http://example.com", "value": "some-identifier"}],
+        "subject": {"reference": "Patient/example-patient"},
+        "resourceType": "ImagingStudy",
+    }
+
+
+def test_get_next_link_should_succeed(metadata_bundle: Bundle) -> None:
+    assert MetadataBundleParser.get_next_link(metadata_bundle) == "http://example.org?page=2"
+
+
+def test_get_next_link_should_return_none_on_last_page(mock_bundle: Dict[str, Any]) -> None:
+    assert MetadataBundleParser.get_next_link(Bundle.model_validate(mock_bundle)) is None
+
+
+def test_get_patients_should_return_patients_by_id(metadata_bundle: Bundle, mock_bsn_number: str) -> None:
+    patients = MetadataBundleParser.get_patients(metadata_bundle)
+
+    assert list(patients) == ["example-patient"]
+    assert MetadataBundleParser.get_bsns(list(patients.values())) == [mock_bsn_number]
+
+
+@pytest.mark.parametrize(
+    "resource, expected",
+    [
+        ({"resourceType": "Observation", "subject": {"reference": "Patient/1"}}, "1"),
+        ({"resourceType": "Immunization", "patient": {"reference": "Patient/1/_history/2"}}, "1"),
+        ({"resourceType": "Observation", "subject": {"reference": "Group/1"}}, None),
+        ({"resourceType": "Observation", "subject": {"display": "Jane"}}, None),
+        ({"resourceType": "Account", "subject": [{"reference": "Patient/1"}]}, None),
+    ],
+)
+def test_get_patient_id_should_follow_patient_reference(resource: Dict[str, Any], expected: str | None) -> None:
+    assert MetadataBundleParser.get_patient_id(Resource.model_validate(resource)) == expected
+
+
+def test_get_bsns_should_skip_other_identifiers(mock_bsn_number: str) -> None:
+    patient = Resource.model_validate(
+        {
+            "resourceType": "Patient",
+            "identifier": [
+                {"system": "http://example.com", "value": "1"},
+                {"system": BSN_SYSTEM, "value": mock_bsn_number},
+            ],
+        }
+    )
+
+    assert MetadataBundleParser.get_bsns([patient]) == [mock_bsn_number]
@@ -1,6 +1,18 @@
+import importlib
+import pkgutil
+from typing import Dict
+
+import fhir.resources.R4B as R4B
+import pytest
+from fhir.resources.R4B.account import Account
+from fhir.resources.R4B.condition import Condition
+from fhir.resources.R4B.consent import Consent
+from fhir.resources.R4B.domainresource import DomainResource
+from fhir.resources.R4B.fhirtypes import ReferenceType
+from fhir.resources.R4B.observation import Observation
 from fhir.resources.R4B.reference import Reference
 
-from app.services.parsers.reference import ReferenceParser
+from app.services.parsers.reference import PATIENT_REFERENCE_ATTRIBUTES, ReferenceParser
 
 
 def test_get_reference_type_and_id_should_succeed() -> None:
@@ -19,3 +31,51 @@ def test_get_reference_should_return_None_with_empty_reference() -> None:
     expected_type, expected_id = ReferenceParser.get_reference_type_and_id(reference)
 
     assert (expected_type, expected_id) == (None, None)
+
+
+def r4b_patient_reference_attributes() -> Dict[str, str]:
+    """
+    Collects every R4B resource type with a single "patient" or "subject" reference that may point to a Patient.
+    """
+    attributes: Dict[str, str] = {}
+    for module in pkgutil.iter_modules(R4B.__path__):
+        if module.name.startswith("fhirtypes"):
+            continue
+        for model in vars(importlib.import_module(f"{R4B.__name__}.{module.name}")).values():
+            if not isinstance(model, type) or not issubclass(model, DomainResource):
+                continue
+            for attribute in ("patient", "subject"):
+                field = model.model_fields.get(attribute)
+                if field is None or field.annotation not in (ReferenceType, ReferenceType | None):
+                    continue
+                extra = field.json_schema_extra if isinstance(field.json_schema_extra, dict) else {}
+                reference_types = extra.get("enum_reference_types") or []
+                if isinstance(reference_types, list) and (
+                    "Patient" in reference_types or "Resource" in reference_types
+                ):
+                    attributes[model.get_resource_type()] = attribute
+    return attributes
+
+
+def test_patient_reference_attributes_should_cover_all_r4b_resources() -> None:
+    assert PATIENT_REFERENCE_ATTRIBUTES == r4b_patient_reference_attributes()
+
+
+@pytest.mark.parametrize(
+    "resource",
+    [
+        Condition.model_construct(subject=Reference(reference="Patient/1")),
+        Consent.model_construct(patient=Reference(reference="Patient/1")),
+        Observation.model_construct(subject=Reference(reference="Patient/1")),
+    ],
+)
+def test_get_patient_reference_should_succeed(resource: DomainResource) -> None:
+    actual = ReferenceParser.get_patient_reference(resource)
+
+    assert actual == Reference(reference="Patient/1")
+
+
+def test_get_patient_reference_should_return_none_for_resource_without_patient_reference() -> None:
+    resource = Account.model_construct(subject=[Reference(reference="Patient/1")])
+
+    assert ReferenceParser.get_patient_reference(resource) is None
@@ -0,0 +1,109 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.models.referrals import Referral
+from app.services.nvi import NviService
+from app.services.pseudonym import PseudonymService
+from app.services.registration.batching import BatchingReferralRegistrationService
+
+PATCHED_REGISTER = "app.services.registration.referrals.ReferralRegistrationService.register"
+
+
+@pytest.fixture
+def batching_registration_service(
+    nvi_service: NviService,
+    pseudonym_service: PseudonymService,
+) -> Iterator[BatchingReferralRegistrationService]:
+    service = BatchingReferralRegistrationService(
+        nvi_service=nvi_service,
+        pseudonym_service=pseudonym_service,
+        nvi_oin="00000004003214345001",
+        window_ms=50,
+        max_items=10,
+        workers=4,
+    )
+    yield service
+    service.shutdown()
+
+
+@patch(PATCHED_REGISTER)
+def test_register_should_return_upstream_result(
+    mock_register: MagicMock,
+    batching_registration_service: BatchingReferralRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.return_value = mock_referral
+
+    actual = batching_registration_service.register("200060429")
+
+    assert actual == mock_referral
+    mock_register.assert_called_once_with("200060429")
+
+
+@patch(PATCHED_REGISTER)
+def test_register_should_coalesce_same_bsn_within_window(
+    mock_register: MagicMock,
+    batching_registration_service: BatchingReferralRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.return_value = mock_referral
+
+    futures = [batching_registration_service.submit("200060429") for _ in range(3)]
+    actual = [future.result(timeout=5) for future in futures]
+
+    assert actual == [mock_referral, None, None]
+    mock_register.assert_called_once_with("200060429")
+
+
+@patch(PATCHED_REGISTER)
+def test_register_should_fan_out_distinct_bsns_concurrently(
+    mock_register: MagicMock,
+    batching_registration_service: BatchingReferralRegistrationService,
+) -> None:
+    def slow_register(bsn: str) -> None:
+        time.sleep(0.2)
+
+    mock_register.side_effect = slow_register
+    bsns = ["200060429", "468467543", "111222333", "123456782"]
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(bsns)) as executor:
+        list(executor.map(batching_registration_service.register, bsns))
+    elapsed = time.monotonic() - started
+
+    assert mock_register.call_count == len(bsns)
+    assert elapsed < 0.2 * len(bsns)
+
+
+@patch(PATCHED_REGISTER)
+def test_register_should_raise_upstream_error_for_every_waiting_caller(
+    mock_register: MagicMock,
+    batching_registration_service: BatchingReferralRegistrationService,
+) -> None:
+    mock_register.side_effect = ConnectionError
+
+    futures = [batching_registration_service.submit("200060429") for _ in range(2)]
+
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result(timeout=5)
+
+
+@patch(PATCHED_REGISTER)
+def test_shutdown_should_complete_submitted_registrations(
+    mock_register: MagicMock,
+    batching_registration_service: BatchingReferralRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.return_value = mock_referral
+    future = batching_registration_service.submit("200060429")
+
+    batching_registration_service.shutdown()
+
+    assert future.result(timeout=0) == mock_referral
+    with pytest.raises(RuntimeError):
+        batching_registration_service.submit("468467543")
@@ -0,0 +1,79 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.exceptions.fhir_exception import FHIRException
+from app.models.referrals import Referral
+from app.models.registration import BsnRegistrationStatus
+from app.services.registration.bsn_list import REGISTRATION_FAILURE_DETAILS, BsnListRegistrationService
+from app.services.registration.referrals import ReferralRegistrationService
+
+PATCHED_MODULE = "app.services.registration.bsn_list.ReferralRegistrationService.register"
+
+
+@pytest.fixture
+def bsn_list_registration_service(registration_service: ReferralRegistrationService) -> BsnListRegistrationService:
+    return BsnListRegistrationService(referrals_service=registration_service, max_workers=4, max_items=5)
+
+
+@patch(PATCHED_MODULE)
+def test_register_should_return_status_per_bsn_in_order(
+    mock_register: MagicMock,
+    bsn_list_registration_service: BsnListRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.side_effect = lambda bsn: None if bsn == "468467543" else mock_referral
+    expected = [
+        BsnRegistrationStatus(bsn="200060429", status="created"),
+        BsnRegistrationStatus(bsn="123456789", status="invalid", details="Invalid BSN"),
+        BsnRegistrationStatus(bsn="12345678", status="invalid", details="BSN must be 9 digits"),
+        BsnRegistrationStatus(bsn="468467543", status="exists"),
+        BsnRegistrationStatus(bsn="200060429", status="exists"),
+    ]
+
+    actual = bsn_list_registration_service.register(["200060429", "123456789", "12345678", "468467543", "200060429"])
+
+    assert expected == actual
+    assert sorted(call.kwargs["bsn"] for call in mock_register.call_args_list) == ["200060429", "468467543"]
+
+
+@patch(PATCHED_MODULE)
+def test_register_should_only_fail_status_of_failing_bsn(
+    mock_register: MagicMock,
+    bsn_list_registration_service: BsnListRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    def register(bsn: str) -> Referral:
+        if bsn == "468467543":
+            raise ConnectionError("Failed to exchange BSN for pseudonym")
+        return mock_referral
+
+    mock_register.side_effect = register
+    expected = [
+        BsnRegistrationStatus(bsn="468467543", status="error", details=REGISTRATION_FAILURE_DETAILS),
+        BsnRegistrationStatus(bsn="200060429", status="created"),
+    ]
+
+    actual = bsn_list_registration_service.register(["468467543", "200060429"])
+
+    assert expected == actual
+
+
+@patch(PATCHED_MODULE)
+def test_register_should_not_call_upstream_without_valid_bsns(
+    mock_register: MagicMock,
+    bsn_list_registration_service: BsnListRegistrationService,
+) -> None:
+    actual = bsn_list_registration_service.register(["12345678", ""])
+
+    assert [status.status for status in actual] == ["invalid", "invalid"]
+    mock_register.assert_not_called()
+
+
+def test_register_should_raise_exception_when_list_is_too_large(
+    bsn_list_registration_service: BsnListRegistrationService,
+) -> None:
+    with pytest.raises(FHIRException) as e:
+        bsn_list_registration_service.register(["200060429"] * 6)
+
+    assert e.value.status_code == 400
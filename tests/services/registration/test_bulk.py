@@ -0,0 +1,233 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.data import BSN_SYSTEM
+from app.exceptions.fhir_exception import FHIRException
+from app.models.bulk import BulkJob
+from app.models.referrals import Referral
+from app.services.registration.bulk import LINE_FAILURE_DETAILS, BulkRegistrationService
+from app.services.registration.bundle import BundleRegistrationService
+
+PATCHED_MODULE = "app.services.registration.bundle.ReferralRegistrationService.register"
+
+
+@pytest.fixture
+def bulk_registration_service(
+    bundle_registration_service: BundleRegistrationService, tmp_path: Path
+) -> BulkRegistrationService:
+    return BulkRegistrationService(
+        bundle_registration_service=bundle_registration_service,
+        storage_dir=str(tmp_path),
+        workers=2,
+        max_page_size=2,
+    )
+
+
+def upload(service: BulkRegistrationService, lines: List[str]) -> BulkJob:
+    job = service.create_job()
+    with open(service.input_path(job.id), "w") as file:
+        file.write("\n".join(lines) + "\n")
+    return service.submit(job.id)
+
+
+def wait_for(service: BulkRegistrationService, job_id: str) -> BulkJob:
+    deadline = time.monotonic() + 5
+    job = service.get_job(job_id)
+    while job.status not in ("completed", "failed") and time.monotonic() < deadline:
+        time.sleep(0.01)
+        job = service.get_job(job_id)
+    return job
+
+
+def statuses(service: BulkRegistrationService, job_id: str) -> Dict[int, List[str]]:
+    results: Dict[int, List[str]] = {}
+    offset: int | None = 0
+    while offset is not None:
+        page = service.get_results(job_id, offset, 100)
+        for result in page.results:
+            results[result["line"]] = [entry["response"]["status"] for entry in result["entry"]]
+        offset = page.next_offset
+    return results
+
+
+@patch(PATCHED_MODULE)
+def test_bulk_job_should_register_identifiers(
+    mock_register: MagicMock,
+    bulk_registration_service: BulkRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.return_value = mock_referral
+    lines = [
+        '"200060429"',
+        json.dumps({"system": BSN_SYSTEM, "value": "468467543"}),
+        "",
+        '"123456789"',
+        "not json",
+        '{"system": "http://example.com", "value": "200060429"}',
+    ]
+
+    job = wait_for(bulk_registration_service, upload(bulk_registration_service, lines).id)
+
+    assert job.status == "completed"
+    assert job.total_lines == 5
+    assert job.processed_lines == 5
+    assert job.error_lines == 3
+    assert statuses(bulk_registration_service, job.id) == {
+        1: ["201"],
+        2: ["201"],
+        4: ["400"],
+        5: ["400"],
+        6: ["400"],
+    }
+    assert mock_register.call_count == 2
+
+
+@patch(PATCHED_MODULE)
+def test_bulk_job_should_register_bundles(
+    mock_register: MagicMock,
+    bulk_registration_service: BulkRegistrationService,
+    mock_referral: Referral,
+    mock_bundle: Dict[str, Any],
+) -> None:
+    mock_register.return_value = mock_referral
+    lines = [json.dumps(mock_bundle), json.dumps({"resourceType": "Bundle", "type": "collection"})]
+
+    job = wait_for(bulk_registration_service, upload(bulk_registration_service, lines).id)
+
+    assert job.status == "completed"
+    assert job.error_lines == 1
+    assert statuses(bulk_registration_service, job.id) == {1: ["201"], 2: ["400"]}
+
+
+@patch(PATCHED_MODULE)
+def test_bulk_job_should_report_upstream_errors_per_line(
+    mock_register: MagicMock,
+    bulk_registration_service: BulkRegistrationService,
+) -> None:
+    mock_register.side_effect = ConnectionError("Failed to exchange BSN for pseudonym")
+
+    job = wait_for(bulk_registration_service, upload(bulk_registration_service, ['"200060429"']).id)
+
+    assert job.status == "completed"
+    assert job.error_lines == 1
+    assert statuses(bulk_registration_service, job.id) == {1: ["500"]}
+    outcome = bulk_registration_service.get_results(job.id, 0, 1).results[0]["entry"][0]["response"]["outcome"]
+    assert outcome["issue"][0]["details"]["text"] == LINE_FAILURE_DETAILS
+
+
+def test_submit_should_raise_exception_and_remove_job_without_lines(
+    bulk_registration_service: BulkRegistrationService,
+) -> None:
+    job = bulk_registration_service.create_job()
+    with open(bulk_registration_service.input_path(job.id), "w") as file:
+        file.write("\n\n")
+
+    with pytest.raises(FHIRException) as e:
+        bulk_registration_service.submit(job.id)
+
+    assert e.value.status_code == 400
+    with pytest.raises(FHIRException):
+        bulk_registration_service.get_job(job.id)
+
+
+@pytest.mark.parametrize("job_id", ["0" * 32, "../../etc", "not-a-job"])
+def test_get_job_should_raise_not_found(bulk_registration_service: BulkRegistrationService, job_id: str) -> None:
+    with pytest.raises(FHIRException) as e:
+        bulk_registration_service.get_job(job_id)
+
+    assert e.value.status_code == 404
+
+
+@patch(PATCHED_MODULE)
+def test_get_results_should_paginate(
+    mock_register: MagicMock,
+    bulk_registration_service: BulkRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.return_value = mock_referral
+    job = wait_for(bulk_registration_service, upload(bulk_registration_service, ['"200060429"'] * 3).id)
+
+    first = bulk_registration_service.get_results(job.id, 0, 100)
+    second = bulk_registration_service.get_results(job.id, 2, 100)
+
+    assert [result["line"] for result in first.results] == [1, 2]
+    assert first.next_offset == 2
+    assert first.total == 3
+    assert [result["line"] for result in second.results] == [3]
+    assert second.next_offset is None
+
+
+@patch(PATCHED_MODULE)
+def test_dispatcher_should_survive_job_that_cannot_be_marked_failed(
+    mock_register: MagicMock,
+    bulk_registration_service: BulkRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.return_value = mock_referral
+    # a job removed from storage fails to process and to save its failure
+    bulk_registration_service._jobs.put("0" * 32)
+
+    job = wait_for(bulk_registration_service, upload(bulk_registration_service, ['"200060429"']).id)
+
+    assert job.status == "completed"
+
+
+@patch(PATCHED_MODULE)
+def test_resume_should_continue_after_last_complete_result(
+    mock_register: MagicMock,
+    bundle_registration_service: BundleRegistrationService,
+    mock_referral: Referral,
+    tmp_path: Path,
+) -> None:
+    mock_register.return_value = mock_referral
+    interrupted = BulkRegistrationService(bundle_registration_service, storage_dir=str(tmp_path))
+    job = interrupted.create_job()
+    with open(interrupted.input_path(job.id), "w") as file:
+        file.write('"200060429"\n"468467543"\n"200060429"\n')
+    job_dir = os.path.join(str(tmp_path), job.id)
+    with open(os.path.join(job_dir, "state.json"), "w") as file:
+        file.write(job.model_copy(update={"status": "in-progress", "total_lines": 3}).model_dump_json())
+    with open(os.path.join(job_dir, "results.ndjson"), "w") as file:
+        file.write('{"line":1,"entry":[{"response":{"status":"201","outcome":{"resourceType":"OperationOutcome",')
+        file.write('"issue":[{"severity":"information","code":"created","details":{"text":"done"}}]}}}]}\n{"line":2,')
+
+    resumed = BulkRegistrationService(bundle_registration_service, storage_dir=str(tmp_path))
+    assert resumed.resume() == [job.id]
+    job = wait_for(resumed, job.id)
+
+    assert job.status == "completed"
+    assert job.processed_lines == 3
+    assert list(statuses(resumed, job.id)) == [1, 2, 3]
+    assert [call.kwargs["bsn"] for call in mock_register.call_args_list] == ["468467543", "200060429"]
+
+
+def test_resume_should_remove_interrupted_uploads(
+    bulk_registration_service: BulkRegistrationService,
+) -> None:
+    job = bulk_registration_service.create_job()
+
+    assert bulk_registration_service.resume() == []
+    with pytest.raises(FHIRException):
+        bulk_registration_service.get_job(job.id)
+
+
+@patch(PATCHED_MODULE)
+def test_bulk_job_should_use_temporary_directory_without_storage_dir(
+    mock_register: MagicMock,
+    bundle_registration_service: BundleRegistrationService,
+    mock_referral: Referral,
+) -> None:
+    mock_register.return_value = mock_referral
+    service = BulkRegistrationService(bundle_registration_service, storage_dir=None)
+
+    job = wait_for(service, upload(service, ['"200060429"']).id)
+
+    assert job.status == "completed"
+    assert os.path.isfile(service.input_path(job.id))
+    service.delete_job(job.id)
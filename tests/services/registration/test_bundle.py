@@ -1,3 +1,9 @@
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Dict, Iterator
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -6,17 +12,20 @@ from fhir.resources.R4B.identifier import Identifier
 from fhir.resources.R4B.imagingstudy import ImagingStudy
 from fhir.resources.R4B.patient import Patient
 from fhir.resources.R4B.reference import Reference
+from pydantic import ValidationError
 
 from app.data import (
     BSN_SYSTEM,
 )
 from app.exceptions.fhir_exception import FHIRException
 from app.models.referrals import Referral
+from app.models.registration import ResolvedEntry
 from app.services.fhir.bunde_entry_response import (
     KnownBundleRegistrationOutcome,
     create_known_response,
 )
-from app.services.registration.bundle import BundleRegistrationService
+from app.services.registration.bundle import BundleRegistrationService, reject_invalid_bsns, resolve_bundle_json
+from app.services.registration.referrals import ReferralRegistrationService
 
 PATCHED_MODULE = "app.services.registration.bundle.ReferralRegistrationService.register"
 
@@ -247,3 +256,309 @@ def test_register_without_reference_to_patient_should_return_error_response(
     actual = bundle_registration_service.register(bundle)
 
     assert expected == actual
+
+
+@patch(PATCHED_MODULE)
+def test_register_should_register_each_unique_bsn_once(
+    referral_response: MagicMock,
+    bundle_registration_service: BundleRegistrationService,
+    mock_referral: Referral,
+    patient: Patient,
+    mock_bsn_number: str,
+) -> None:
+    referral_response.return_value = mock_referral
+    studies = [
+        ImagingStudy.model_construct(id=f"imaging-study-{i}", subject=Reference(reference=f"Patient/{patient.id}"))
+        for i in range(3)
+    ]
+    bundle = Bundle(
+        type="transaction",
+        entry=[BundleEntry(resource=patient), *[BundleEntry(resource=study) for study in studies]],
+    )
+    expected = Bundle(
+        type="transaction-response",
+        entry=[
+            BundleEntry(
+                response=create_known_response(KnownBundleRegistrationOutcome.OK, "Record created successfully")
+            ),
+            BundleEntry(
+                response=create_known_response(KnownBundleRegistrationOutcome.WARNING, "Record already exists")
+            ),
+            BundleEntry(
+                response=create_known_response(KnownBundleRegistrationOutcome.WARNING, "Record already exists")
+            ),
+        ],
+    )
+
+    actual = bundle_registration_service.register(bundle)
+
+    assert expected == actual
+    referral_response.assert_called_once_with(bsn=mock_bsn_number)
+
+
+@patch(PATCHED_MODULE)
+def test_register_should_keep_entry_order_with_mixed_outcomes(
+    referral_response: MagicMock,
+    bundle_registration_service: BundleRegistrationService,
+    mock_referral: Referral,
+    patient: Patient,
+) -> None:
+    referral_response.return_value = mock_referral
+    bundle = Bundle(
+        type="transaction",
+        entry=[
+            BundleEntry(resource=ImagingStudy.model_construct(id="no-subject", subject=None)),
+            BundleEntry(
+                resource=ImagingStudy.model_construct(
+                    id="imaging-study-1", subject=Reference(reference=f"Patient/{patient.id}")
+                )
+            ),
+            BundleEntry(resource=patient),
+            BundleEntry(
+                resource=ImagingStudy.model_construct(id="group", subject=Reference(reference="Group/group-1"))
+            ),
+        ],
+    )
+    expected = Bundle(
+        type="transaction-response",
+        entry=[
+            BundleEntry(
+                response=create_known_response(
+                    KnownBundleRegistrationOutcome.ERROR, "no reference for patient found for no-subject"
+                )
+            ),
+            BundleEntry(
+                response=create_known_response(KnownBundleRegistrationOutcome.OK, "Record created successfully")
+            ),
+            BundleEntry(
+                response=create_known_response(
+                    KnownBundleRegistrationOutcome.ERROR, "Reference is not a valid Patient reference"
+                )
+            ),
+        ],
+    )
+
+    actual = bundle_registration_service.register(bundle)
+
+    assert expected == actual
+    referral_response.assert_called_once()
+
+
+@patch(PATCHED_MODULE)
+def test_register_should_raise_when_registration_fails(
+    referral_response: MagicMock,
+    bundle_registration_service: BundleRegistrationService,
+    regular_bundle: Bundle,
+) -> None:
+    referral_response.side_effect = ConnectionError
+
+    with pytest.raises(ConnectionError):
+        bundle_registration_service.register(regular_bundle)
+
+
+def test_make_map_data_from_json_should_succeed(
+    bundle_registration_service: BundleRegistrationService,
+    mock_bundle: Dict[str, Any],
+    patient: Patient,
+) -> None:
+    actual = bundle_registration_service.make_map_data_from_json(json.dumps(mock_bundle).encode())
+
+    assert list(actual.keys()) == ["example-patient", "example-imagingstudy"]
+    assert actual["example-patient"] == patient
+    assert isinstance(actual["example-imagingstudy"], ImagingStudy)
+
+
+def test_make_map_data_from_json_should_raise_exception_when_bundle_has_no_entries(
+    bundle_registration_service: BundleRegistrationService,
+) -> None:
+    with pytest.raises(FHIRException):
+        bundle_registration_service.make_map_data_from_json(b'{"resourceType": "Bundle", "type": "transaction"}')
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"{",
+        b'{"resourceType": "Patient", "type": "transaction"}',
+        b'{"resourceType": "Bundle", "type": "transaction", "entry": [{"resource": {"resourceType": "CarePlan", '
+        b'"id": "c", "intent": "plan", "subject": {"reference": "Patient/p"}}}]}',
+        b'{"resourceType": "Bundle", "type": "transaction", "entry": [{"resource": {"resourceType": "CarePlan", '
+        b'"id": "c", "status": 123, "intent": "plan", "subject": {"reference": "Patient/p"}}}]}',
+        b'{"resourceType": "Bundle", "type": "transaction", "entry": [{"resource": {"resourceType": "Observation", '
+        b'"id": "o", "status": "final", "code": {"text": "x"}, "bogus": 1, "subject": {"reference": "Patient/p"}}}]}',
+        b'{"resourceType": "Bundle", "type": "transaction", "entry": [{"resource": {"resourceType": "Patient", '
+        b'"id": "bad id!!"}}]}',
+    ],
+)
+def test_make_map_data_from_json_should_raise_validation_error_when_bundle_is_malformed(
+    bundle_registration_service: BundleRegistrationService,
+    body: bytes,
+) -> None:
+    with pytest.raises(ValidationError):
+        bundle_registration_service.make_map_data_from_json(body)
+
+
+@patch(PATCHED_MODULE)
+def test_register_json_should_succeed(
+    referral_response: MagicMock,
+    bundle_registration_service: BundleRegistrationService,
+    mock_referral: Referral,
+    mock_bundle: Dict[str, Any],
+    regular_bundle: Bundle,
+) -> None:
+    referral_response.return_value = mock_referral
+    expected = bundle_registration_service.register(regular_bundle).model_dump()
+
+    actual = json.loads(bundle_registration_service.register_json(json.dumps(mock_bundle).encode()))
+
+    assert expected == actual
+
+
+@patch(PATCHED_MODULE)
+def test_register_json_iter_should_yield_same_responses_as_register_json(
+    referral_response: MagicMock,
+    bundle_registration_service: BundleRegistrationService,
+    mock_referral: Referral,
+    mock_bundle: Dict[str, Any],
+) -> None:
+    referral_response.return_value = mock_referral
+    body = json.dumps(mock_bundle).encode()
+    expected = json.loads(bundle_registration_service.register_json(body))
+
+    actual = [json.loads(entry) for entry in bundle_registration_service.register_json_iter(body)]
+
+    assert expected["entry"] == actual
+
+
+def test_register_json_iter_should_validate_before_streaming(
+    bundle_registration_service: BundleRegistrationService,
+) -> None:
+    with pytest.raises(FHIRException):
+        bundle_registration_service.register_json_iter(b'{"resourceType": "Bundle", "type": "collection"}')
+
+
+@pytest.fixture
+def pooled_registration_service(
+    registration_service: ReferralRegistrationService,
+) -> Iterator[BundleRegistrationService]:
+    service = BundleRegistrationService(
+        referrals_service=registration_service,
+        process_pool_factory=partial(
+            ProcessPoolExecutor, max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ),
+        process_pool_threshold_bytes=1,
+    )
+    yield service
+    service.shutdown()
+
+
+def test_resolve_json_should_resolve_large_bundle_in_process_pool(
+    pooled_registration_service: BundleRegistrationService,
+    mock_bundle: Dict[str, Any],
+    mock_bsn_number: str,
+) -> None:
+    actual = pooled_registration_service.resolve_json(json.dumps(mock_bundle).encode())
+
+    assert actual == [ResolvedEntry("example-imagingstudy", "Patient/example-patient", mock_bsn_number)]
+
+
+def test_resolve_json_should_resolve_small_bundle_in_request_thread(
+    registration_service: ReferralRegistrationService,
+    mock_bundle: Dict[str, Any],
+    mock_bsn_number: str,
+) -> None:
+    process_pool = MagicMock()
+    service = BundleRegistrationService(
+        referrals_service=registration_service,
+        process_pool_factory=lambda: process_pool,
+        process_pool_threshold_bytes=1_048_576,
+    )
+
+    actual = service.resolve_json(json.dumps(mock_bundle).encode())
+
+    assert actual == [ResolvedEntry("example-imagingstudy", "Patient/example-patient", mock_bsn_number)]
+    process_pool.submit.assert_not_called()
+
+
+def test_resolve_json_should_send_large_body_to_process_pool_without_parsing(
+    registration_service: ReferralRegistrationService,
+) -> None:
+    process_pool = MagicMock()
+    service = BundleRegistrationService(
+        referrals_service=registration_service,
+        process_pool_factory=lambda: process_pool,
+        process_pool_threshold_bytes=4,
+    )
+
+    service.resolve_json(b"not a bundle")
+
+    process_pool.submit.assert_called_once_with(resolve_bundle_json, b"not a bundle")
+
+
+def test_shutdown_should_stop_process_pool(registration_service: ReferralRegistrationService) -> None:
+    process_pool = MagicMock()
+    service = BundleRegistrationService(
+        referrals_service=registration_service, process_pool_factory=lambda: process_pool
+    )
+
+    service.shutdown()
+
+    process_pool.shutdown.assert_called_once_with()
+
+
+def test_resolve_json_should_raise_errors_from_process_pool(
+    pooled_registration_service: BundleRegistrationService,
+) -> None:
+    with pytest.raises(ValidationError):
+        pooled_registration_service.resolve_json(
+            b'{"resourceType": "Bundle", "type": "transaction", "entry": [{"resource": {"resourceType": "Patient", '
+            b'"id": "bad id!!"}}]}'
+        )
+
+
+def test_resolve_json_should_raise_fhir_exception_from_process_pool_and_keep_pool_working(
+    pooled_registration_service: BundleRegistrationService,
+    mock_bundle: Dict[str, Any],
+    mock_bsn_number: str,
+) -> None:
+    with pytest.raises(FHIRException) as e:
+        pooled_registration_service.resolve_json(b'{"resourceType": "Bundle", "type": "transaction", "entry": []}')
+
+    assert e.value.status_code == 400
+    assert pooled_registration_service.resolve_json(json.dumps(mock_bundle).encode()) == [
+        ResolvedEntry("example-imagingstudy", "Patient/example-patient", mock_bsn_number)
+    ]
+
+
+def test_resolve_json_should_replace_broken_process_pool(registration_service: ReferralRegistrationService) -> None:
+    broken, replacement = MagicMock(), MagicMock()
+    broken.submit.return_value.result.side_effect = BrokenProcessPool()
+    replacement.submit.return_value.result.return_value = []
+    pools = iter([broken, replacement])
+    service = BundleRegistrationService(
+        referrals_service=registration_service,
+        process_pool_factory=lambda: next(pools),
+        process_pool_threshold_bytes=1,
+    )
+
+    with pytest.raises(BrokenProcessPool):
+        service.resolve_json(b"{}")
+
+    assert service.resolve_json(b"{}") == []
+    broken.shutdown.assert_called_once_with(wait=False)
+
+
+def test_reject_invalid_bsns_should_only_reject_entries_with_invalid_bsn() -> None:
+    entries = [
+        ResolvedEntry("res-1", "Patient/p-1", "200060429"),
+        ResolvedEntry("res-2", "Patient/p-2", "123456789"),
+        ResolvedEntry("res-3", None, None, error="no reference for patient found for res-3"),
+    ]
+
+    actual = reject_invalid_bsns(entries)
+
+    assert actual == [
+        entries[0],
+        ResolvedEntry("res-2", "Patient/p-2", None, error="Invalid BSN number"),
+        entries[2],
+    ]
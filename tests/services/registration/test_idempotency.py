@@ -0,0 +1,128 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from app.exceptions.fhir_exception import FHIRException
+from app.services.registration.idempotency import IdempotencyStore
+
+
+@pytest.fixture
+def idempotency_store(tmp_path: Path) -> IdempotencyStore:
+    return IdempotencyStore(storage_path=str(tmp_path / "idempotency.ndjson"), max_entries=2, wait_timeout_seconds=1)
+
+
+def test_begin_should_return_none_for_new_key(idempotency_store: IdempotencyStore) -> None:
+    assert idempotency_store.begin("key-1", b"{}") is None
+
+
+def test_begin_should_return_recorded_entries(idempotency_store: IdempotencyStore) -> None:
+    idempotency_store.begin("key-1", b"{}")
+    recorded = list(idempotency_store.record("key-1", iter([b'{"a":1}', b'{"b":2}'])))
+
+    assert recorded == [b'{"a":1}', b'{"b":2}']
+    assert idempotency_store.begin("key-1", b"{}") == recorded
+
+
+def test_begin_should_raise_exception_when_key_is_reused_for_other_body(idempotency_store: IdempotencyStore) -> None:
+    idempotency_store.begin("key-1", b"{}")
+    idempotency_store.complete("key-1", [b"{}"])
+
+    with pytest.raises(FHIRException) as e:
+        idempotency_store.begin("key-1", b'{"other": true}')
+
+    assert e.value.status_code == 422
+
+
+def test_begin_should_wait_for_request_in_progress(idempotency_store: IdempotencyStore) -> None:
+    idempotency_store.begin("key-1", b"{}")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        retry = executor.submit(idempotency_store.begin, "key-1", b"{}")
+        time.sleep(0.05)
+        assert not retry.done()
+        idempotency_store.complete("key-1", [b"{}"])
+
+        assert retry.result(timeout=1) == [b"{}"]
+
+
+def test_begin_should_raise_exception_when_request_in_progress_takes_too_long() -> None:
+    store = IdempotencyStore(storage_path=None, wait_timeout_seconds=0.05)
+    store.begin("key-1", b"{}")
+
+    with pytest.raises(FHIRException) as e:
+        store.begin("key-1", b"{}")
+
+    assert e.value.status_code == 409
+
+
+def test_record_should_release_key_when_registration_fails(idempotency_store: IdempotencyStore) -> None:
+    def failing_entries() -> Iterator[bytes]:
+        yield b"{}"
+        raise ConnectionError("Failed to exchange BSN for pseudonym")
+
+    idempotency_store.begin("key-1", b"{}")
+    with pytest.raises(ConnectionError):
+        list(idempotency_store.record("key-1", failing_entries()))
+
+    assert idempotency_store.begin("key-1", b"{}") is None
+
+
+def test_complete_should_evict_least_recently_used(idempotency_store: IdempotencyStore) -> None:
+    for key in ["key-1", "key-2"]:
+        idempotency_store.begin(key, b"{}")
+        idempotency_store.complete(key, [key.encode()])
+    idempotency_store.begin("key-1", b"{}")
+
+    idempotency_store.begin("key-3", b"{}")
+    idempotency_store.complete("key-3", [b"key-3"])
+
+    assert idempotency_store.begin("key-1", b"{}") == [b"key-1"]
+    assert idempotency_store.begin("key-2", b"{}") is None
+
+
+def test_store_should_expire_entries() -> None:
+    store = IdempotencyStore(storage_path=None, ttl_seconds=0.01)
+    store.begin("key-1", b"{}")
+    store.complete("key-1", [b"{}"])
+    time.sleep(0.02)
+
+    assert store.begin("key-1", b"{}") is None
+
+
+def test_store_should_load_persisted_entries(idempotency_store: IdempotencyStore, tmp_path: Path) -> None:
+    idempotency_store.begin("key-1", b"{}")
+    idempotency_store.complete("key-1", [b'{"a":1}'])
+
+    reloaded = IdempotencyStore(storage_path=str(tmp_path / "idempotency.ndjson"))
+
+    assert reloaded.begin("key-1", b"{}") == [b'{"a":1}']
+
+
+def test_store_should_skip_partially_written_entries(idempotency_store: IdempotencyStore, tmp_path: Path) -> None:
+    idempotency_store.begin("key-1", b"{}")
+    idempotency_store.complete("key-1", [b'{"a":1}'])
+    with open(tmp_path / "idempotency.ndjson", "ab") as file:
+        file.write(b'{"key":"key-2","finger')
+
+    reloaded = IdempotencyStore(storage_path=str(tmp_path / "idempotency.ndjson"))
+
+    assert reloaded.begin("key-1", b"{}") == [b'{"a":1}']
+    assert reloaded.begin("key-2", b"{}") is None
+
+
+def test_complete_should_compact_journal(idempotency_store: IdempotencyStore, tmp_path: Path) -> None:
+    for index in range(6):
+        idempotency_store.begin(f"key-{index}", b"{}")
+        idempotency_store.complete(f"key-{index}", [b"{}"])
+
+    with open(tmp_path / "idempotency.ndjson", "rb") as file:
+        lines = file.readlines()
+
+    # compacted to the 2 kept entries on the fifth registration, the sixth is appended
+    assert len(lines) == 3
+    reloaded = IdempotencyStore(storage_path=str(tmp_path / "idempotency.ndjson"), max_entries=2)
+    assert reloaded.begin("key-5", b"{}") == [b"{}"]
+    assert reloaded.begin("key-3", b"{}") is None
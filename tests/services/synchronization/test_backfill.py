@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, List
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.models.backfill import WindowStrategy
+from app.services.metadata import UpdatePage
+from app.services.synchronization.backfill import BackfillService
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+END = START + timedelta(days=10)
+
+
+def page(resources: int) -> UpdatePage:
+    return UpdatePage(
+        bundle=MagicMock(),
+        resource_type="ImagingStudy",
+        resources=[MagicMock() for _ in range(resources)],
+        last_updated=None,
+        last_ids=[],
+    )
+
+
+def day(days: float) -> str:
+    return (START + timedelta(days=days)).isoformat()
+
+
+@pytest.fixture
+def metadata_api() -> MagicMock:
+    metadata_api = MagicMock()
+    # a window starting on day n holds n + 1 resources, of the patients bsn-0 to bsn-n
+    metadata_api.search_updates.side_effect = lambda data_domain, start, until: [
+        page((datetime.fromisoformat(start) - START).days + 1)
+    ]
+    metadata_api.parse_update_page.side_effect = lambda page: [f"bsn-{index}" for index in range(len(page.resources))]
+    metadata_api.count_range.side_effect = lambda data_domain, start, end: int(
+        (datetime.fromisoformat(end) - datetime.fromisoformat(start)) / timedelta(days=1) * 100
+    )
+    return metadata_api
+
+
+@pytest.fixture
+def registration_service() -> MagicMock:
+    return MagicMock()
+
+
+def windows(state: Any) -> List[Any]:
+    return [(window.start, window.end) for window in state.windows]
+
+
+def test_plan_should_split_range_in_fixed_windows(metadata_api: MagicMock, registration_service: MagicMock) -> None:
+    service = BackfillService(metadata_api, registration_service)
+
+    planned = service.plan("ImagingStudy", START, END, window=timedelta(days=4))
+
+    assert [(window.start, window.end) for window in planned] == [(day(0), day(4)), (day(4), day(8)), (day(8), day(10))]
+    metadata_api.count_range.assert_not_called()
+
+
+def test_plan_should_split_dense_windows_by_count_when_adaptive(
+    metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    service = BackfillService(metadata_api, registration_service, max_window_resources=250)
+
+    planned = service.plan("ImagingStudy", START, END, WindowStrategy.adaptive, timedelta(days=5))
+
+    # 500 resources per window of 5 days, split in two windows of at most 250
+    assert [(window.start, window.end) for window in planned] == [
+        (day(0), day(2.5)),
+        (day(2.5), day(5)),
+        (day(5), day(7.5)),
+        (day(7.5), day(10)),
+    ]
+
+
+def test_backfill_should_register_patients_of_every_window_once(
+    metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    service = BackfillService(metadata_api, registration_service, workers=2)
+
+    state = service.backfill("ImagingStudy", START, START + timedelta(days=2), window=timedelta(days=1))
+
+    assert all(window.done for window in state.windows)
+    assert [(window.resources, window.patients) for window in state.windows] == [(1, 1), (2, 2)]
+    assert sorted(call.args[0] for call in registration_service.register.call_args_list) == ["bsn-0", "bsn-0", "bsn-1"]
+    assert {call.kwargs["until"] for call in metadata_api.search_updates.call_args_list} == {day(1), day(2)}
+
+
+def test_backfill_should_bisect_windows_counting_too_many_resources(
+    metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    service = BackfillService(metadata_api, registration_service, max_window_resources=100)
+
+    state = service.backfill("ImagingStudy", START, START + timedelta(days=4), WindowStrategy.bisect, timedelta(days=4))
+
+    assert windows(state) == [(day(0), day(1)), (day(1), day(2)), (day(2), day(3)), (day(3), day(4))]
+    assert all(window.done for window in state.windows)
+    assert metadata_api.search_updates.call_count == 4
+
+
+def test_backfill_should_resume_unfinished_windows(
+    metadata_api: MagicMock, registration_service: MagicMock, tmp_path: Any
+) -> None:
+    def register(bsn: str) -> None:
+        if bsn != "bsn-0":
+            raise RuntimeError("NVI unavailable")
+
+    registration_service.register.side_effect = register
+    service = BackfillService(metadata_api, registration_service, state_dir=str(tmp_path))
+
+    state = service.backfill("ImagingStudy", START, START + timedelta(days=3), window=timedelta(days=1))
+
+    assert [window.done for window in state.windows] == [True, False, False]
+    assert (tmp_path / "ImagingStudy.json").exists()
+
+    registration_service.register.side_effect = None
+    metadata_api.search_updates.reset_mock()
+    resumed = BackfillService(metadata_api, registration_service, state_dir=str(tmp_path)).backfill(
+        "ImagingStudy", START, START + timedelta(days=3), window=timedelta(days=1)
+    )
+
+    assert [window.done for window in resumed.windows] == [True, True, True]
+    assert sorted(call.args[1] for call in metadata_api.search_updates.call_args_list) == [day(1), day(2)]
+
+
+def test_backfill_should_start_over_for_another_range(
+    metadata_api: MagicMock, registration_service: MagicMock, tmp_path: Any
+) -> None:
+    service = BackfillService(metadata_api, registration_service, state_dir=str(tmp_path))
+    service.backfill("ImagingStudy", START, START + timedelta(days=1))
+
+    state = service.backfill("ImagingStudy", START, START + timedelta(days=2), window=timedelta(days=1))
+
+    assert windows(state) == [(day(0), day(1)), (day(1), day(2))]
+    assert metadata_api.search_updates.call_count == 3
+
+
+def test_backfill_should_reject_empty_range(metadata_api: MagicMock, registration_service: MagicMock) -> None:
+    with pytest.raises(ValueError):
+        BackfillService(metadata_api, registration_service).backfill("ImagingStudy", END, START)
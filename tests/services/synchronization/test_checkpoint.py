@@ -0,0 +1,30 @@
+from typing import List
+
+from app.services.synchronization.checkpoint import PageCheckpoints
+
+
+def test_checkpoint_should_follow_pages_in_order() -> None:
+    checkpoints: List[str] = []
+    pages: PageCheckpoints[str] = PageCheckpoints(checkpoints.append)
+
+    pages.add(0, "first", 2)
+    pages.add(1, "second", 1)
+    pages.done(1)
+    pages.done(0)
+
+    assert checkpoints == []
+
+    pages.done(0)
+
+    assert checkpoints == ["second"]
+
+
+def test_checkpoint_should_complete_pages_without_items() -> None:
+    checkpoints: List[str] = []
+    pages: PageCheckpoints[str] = PageCheckpoints(checkpoints.append)
+
+    pages.add(1, "second", 0)
+    pages.add(0, "first", 0)
+    pages.add(2, "third", 1)
+
+    assert checkpoints == ["second"]
@@ -1,5 +1,6 @@
 import copy
 from datetime import datetime
+from pathlib import Path
 from typing import List
 
 import pytest
@@ -64,3 +65,25 @@ def test_clear_all_entries_timestamps_should_succeed(
     for data_domain in data_domains:
         entry = domains_map_service.get_entry(data_domain)
         assert entry.last_resource_update is None
+
+
+def test_update_entry_should_persist_entries(data_domains: List[str], tmp_path: Path) -> None:
+    storage_path = str(tmp_path / "domains.json")
+    service = DomainsMapService(data_domains, storage_path=storage_path)
+    entry = DomainMapEntry(last_resource_update=datetime.now().isoformat(), last_resource_ids=["some-id"])
+
+    service.update_entry(data_domains[0], entry)
+    reloaded = DomainsMapService(data_domains, storage_path=storage_path)
+
+    assert reloaded.get_entry(data_domains[0]) == entry
+    assert reloaded.get_entry(data_domains[1]) == DomainMapEntry()
+
+
+def test_clear_entry_timestamp_should_persist_cleared_entry(data_domains: List[str], tmp_path: Path) -> None:
+    storage_path = str(tmp_path / "domains.json")
+    service = DomainsMapService(data_domains, storage_path=storage_path)
+    service.update_entry(data_domains[0], DomainMapEntry(last_resource_update=datetime.now().isoformat()))
+
+    service.clear_entry_timestamp(data_domains[0])
+
+    assert DomainsMapService(data_domains, storage_path=storage_path).get_entry(data_domains[0]) == DomainMapEntry()
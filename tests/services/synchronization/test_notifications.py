@@ -0,0 +1,133 @@
+import json
+import time
+from threading import Event
+from typing import Any
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.models.metadata.fhir import Resource
+from app.services.synchronization.notifications import NotificationService
+
+STATUS = {"resourceType": "SubscriptionStatus", "type": "event-notification", "status": "active"}
+
+
+def study(id: str, patient: str) -> Any:
+    return {"resourceType": "ImagingStudy", "id": id, "subject": {"reference": f"Patient/{patient}"}}
+
+
+def notification(*entries: Any) -> bytes:
+    return json.dumps({"resourceType": "Bundle", "type": "history", "entry": list(entries)}).encode()
+
+
+@pytest.fixture
+def synchronizer() -> MagicMock:
+    synchronizer = MagicMock()
+    synchronizer.get_allowed_domains.return_value = ["ImagingStudy", "Account"]
+    return synchronizer
+
+
+@pytest.fixture
+def metadata_api() -> MagicMock:
+    metadata_api = MagicMock()
+    metadata_api.get_resources.side_effect = lambda resource_type, ids: [
+        Resource.model_validate(study(id, f"patient-{id}")) for id in sorted(ids)
+    ]
+    metadata_api.parse_update_page.side_effect = lambda page: [
+        resource.subject.reference.removeprefix("Patient/patient-") for resource in page.resources
+    ]
+    return metadata_api
+
+
+@pytest.fixture
+def registration_service() -> MagicMock:
+    return MagicMock()
+
+
+def wait_for(condition: Any, timeout: float = 2) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_parse_notification_should_read_full_resource_and_id_only_entries() -> None:
+    body = notification(
+        {"fullUrl": "urn:uuid:1", "resource": STATUS},
+        {"fullUrl": "http://example.org/fhir/ImagingStudy/a", "resource": study("a", "p1")},
+        {"fullUrl": "http://example.org/fhir/ImagingStudy/b/_history/2"},
+    )
+
+    assert NotificationService.parse_notification(body) == [("ImagingStudy", "a"), ("ImagingStudy", "b")]
+    assert NotificationService.parse_notification(json.dumps(study("c", "p1")).encode()) == [("ImagingStudy", "c")]
+    assert NotificationService.parse_notification(b"") == []
+
+
+def test_parse_notification_should_reject_other_content() -> None:
+    with pytest.raises(ValueError):
+        NotificationService.parse_notification(b"not json")
+
+
+def test_notify_should_coalesce_burst_into_one_registration_per_patient(
+    synchronizer: MagicMock, metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    service = NotificationService(synchronizer, metadata_api, registration_service, debounce_ms=100)
+    service.start()
+
+    service.notify(notification({"fullUrl": "ImagingStudy/a"}, {"fullUrl": "ImagingStudy/b"}))
+    receipt = service.notify(notification({"fullUrl": "ImagingStudy/a"}, {"fullUrl": "Observation/c"}))
+    wait_for(lambda: registration_service.register.call_count == 2)
+
+    assert receipt.resources == 1
+    metadata_api.get_resources.assert_called_once_with("ImagingStudy", {"a", "b"})
+    assert [call.args for call in registration_service.register.call_args_list] == [("a",), ("b",)]
+    synchronizer.synchronize_domain.assert_not_called()
+
+
+def test_notify_should_synchronize_domain_of_empty_notification(
+    synchronizer: MagicMock, metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    synchronized = Event()
+    synchronizer.synchronize_domain.side_effect = lambda data_domain: synchronized.set()
+    service = NotificationService(synchronizer, metadata_api, registration_service, debounce_ms=0)
+    service.start()
+
+    receipt = service.notify(b"", "ImagingStudy")
+    synchronized.wait(2)
+
+    assert receipt.domains == ["ImagingStudy"]
+    synchronizer.synchronize_domain.assert_called_once_with("ImagingStudy")
+    metadata_api.get_resources.assert_not_called()
+
+
+def test_notify_should_synchronize_domain_without_patient_reference(
+    synchronizer: MagicMock, metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    service = NotificationService(synchronizer, metadata_api, registration_service, debounce_ms=0)
+    service.start()
+
+    receipt = service.notify(notification({"fullUrl": "Account/a"}))
+    wait_for(lambda: synchronizer.synchronize_domain.called)
+
+    assert receipt.domains == ["Account"]
+    synchronizer.synchronize_domain.assert_called_once_with("Account")
+    metadata_api.get_resources.assert_not_called()
+
+
+def test_notify_should_reject_unknown_data_domain(
+    synchronizer: MagicMock, metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    service = NotificationService(synchronizer, metadata_api, registration_service)
+
+    with pytest.raises(ValueError):
+        service.notify(b"", "Observation")
+
+
+def test_notify_should_only_queue_changes_until_started(
+    synchronizer: MagicMock, metadata_api: MagicMock, registration_service: MagicMock
+) -> None:
+    service = NotificationService(synchronizer, metadata_api, registration_service, debounce_ms=0)
+
+    service.notify(b"", "ImagingStudy")
+    time.sleep(0.05)
+
+    synchronizer.synchronize_domain.assert_not_called()
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+from app.data import BSN_SYSTEM
+from app.models.metadata.fhir import Resource
+from app.models.patient_cache import CachedPatient
+from app.services.synchronization.patient_cache import PatientCache
+
+T1 = "2025-01-01T10:00:00+00:00"
+T2 = "2025-01-01T11:00:00+00:00"
+T3 = "2025-01-01T12:00:00+00:00"
+
+
+def patient(id: str, bsn: str | None, last_updated: str) -> Resource:
+    return Resource.model_validate(
+        {
+            "resourceType": "Patient",
+            "id": id,
+            "meta": {"lastUpdated": last_updated},
+            "identifier": [{"system": BSN_SYSTEM, "value": bsn}] if bsn is not None else [],
+        }
+    )
+
+
+def test_update_should_cache_bsn_and_newest_last_updated() -> None:
+    cache = PatientCache()
+
+    cache.update([patient("a", "200060429", T2), patient("b", None, T1)])
+
+    assert cache.get("a") == CachedPatient(bsn="200060429", last_updated=T2)
+    assert cache.get("b") == CachedPatient(bsn=None, last_updated=T1)
+    assert cache.get("c") is None
+    assert cache.last_updated == T2
+
+
+def test_update_should_keep_newer_cached_version() -> None:
+    cache = PatientCache()
+    cache.update([patient("a", "200060429", T2)])
+
+    cache.update([patient("a", "468467543", T1)])
+
+    assert cache.get("a") == CachedPatient(bsn="200060429", last_updated=T2)
+
+
+def test_update_known_only_should_leave_out_unknown_patients() -> None:
+    cache = PatientCache()
+    cache.update([patient("a", "200060429", T1)])
+
+    cache.update([patient("a", "468467543", T2), patient("b", "200060429", T2)], known_only=True)
+
+    assert cache.get("a") == CachedPatient(bsn="468467543", last_updated=T2)
+    assert cache.get("b") is None
+
+
+def test_update_without_advance_should_not_move_watermark_past_unrefreshed_changes() -> None:
+    cache = PatientCache()
+    cache.update([patient("a", "200060429", T1)], advance=False)
+
+    # a changes its BSN at T2, before b (stamped T3) is looked up
+    cache.update([patient("b", "468467543", T3)], advance=False)
+
+    assert cache.last_updated == T1
+    cache.update([patient("a", "111222333", T2), patient("b", "468467543", T3)], known_only=True)
+    assert cache.get("a") == CachedPatient(bsn="111222333", last_updated=T2)
+    assert cache.last_updated == T3
+
+
+def test_update_should_only_persist_cache_on_save(tmp_path: Path) -> None:
+    storage_path = str(tmp_path / "patients.json")
+    cache = PatientCache(storage_path)
+    cache.update([patient("a", "200060429", T1)])
+
+    assert PatientCache(storage_path).get("a") is None
+
+    cache.save()
+    reloaded = PatientCache(storage_path)
+
+    assert reloaded.get("a") == CachedPatient(bsn="200060429", last_updated=T1)
+    assert reloaded.last_updated == T1
+
+
+def test_clear_should_persist_empty_cache(tmp_path: Path) -> None:
+    storage_path = str(tmp_path / "patients.json")
+    cache = PatientCache(storage_path)
+    cache.update([patient("a", "200060429", T1)])
+
+    cache.clear()
+
+    assert PatientCache(storage_path).get("a") is None
+    assert PatientCache(storage_path).last_updated is None
+
+
+def test_load_should_ignore_unreadable_cache(tmp_path: Path) -> None:
+    storage_path = tmp_path / "patients.json"
+    storage_path.write_bytes(b"{not json")
+
+    assert PatientCache(str(storage_path)).get("a") is None
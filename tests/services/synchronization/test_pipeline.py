@@ -0,0 +1,125 @@
+import time
+from threading import Lock
+from typing import Iterable, List
+
+import pytest
+
+from app.models.pipeline import StageSettings
+from app.services.synchronization.pipeline import Pipeline, PipelineStage
+
+
+def double(items: List[int]) -> List[int]:
+    return [item * 2 for item in items]
+
+
+def test_run_should_pass_every_item_through_all_stages() -> None:
+    pipeline = Pipeline(
+        source_name="source",
+        source=lambda: range(10),
+        stages=[
+            PipelineStage("double", double, StageSettings(workers=3, batch_size=2)),
+            PipelineStage("increment", lambda items: [item + 1 for item in items]),
+        ],
+        queue_size=2,
+    )
+
+    actual = pipeline.run()
+
+    assert sorted(actual) == [item * 2 + 1 for item in range(10)]
+
+
+def test_run_should_allow_stages_to_expand_and_filter_items() -> None:
+    pipeline = Pipeline(
+        source_name="source",
+        source=lambda: [[1, 2], [3]],
+        stages=[
+            PipelineStage("flatten", lambda pages: [item for page in pages for item in page]),
+            PipelineStage("odd", lambda items: [item for item in items if item % 2]),
+        ],
+    )
+
+    actual = pipeline.run()
+
+    assert sorted(actual) == [1, 3]
+
+
+def test_run_should_respect_batch_size() -> None:
+    batch_sizes: List[int] = []
+    lock = Lock()
+
+    def record(items: List[int]) -> List[int]:
+        with lock:
+            batch_sizes.append(len(items))
+        return items
+
+    def source() -> Iterable[int]:
+        yield from range(7)
+        time.sleep(0.1)
+
+    pipeline = Pipeline(
+        source_name="source",
+        source=source,
+        stages=[PipelineStage("record", record, StageSettings(workers=1, batch_size=3))],
+    )
+
+    pipeline.run()
+
+    assert sum(batch_sizes) == 7
+    assert max(batch_sizes) <= 3
+
+
+def test_run_should_overlap_stages() -> None:
+    timeline: List[str] = []
+    lock = Lock()
+
+    def source() -> Iterable[int]:
+        for page in range(2):
+            with lock:
+                timeline.append(f"fetch-{page}")
+            yield page
+            time.sleep(0.1)
+
+    def slow(items: List[int]) -> List[int]:
+        with lock:
+            timeline.append(f"process-{items[0]}")
+        return items
+
+    pipeline = Pipeline(source_name="source", source=source, stages=[PipelineStage("slow", slow)])
+
+    pipeline.run()
+
+    assert timeline.index("process-0") < timeline.index("fetch-1")
+
+
+def test_run_should_raise_first_error_and_stop() -> None:
+    def fail(items: List[int]) -> List[int]:
+        raise ConnectionError("upstream down")
+
+    pipeline = Pipeline(
+        source_name="source",
+        source=lambda: range(1000),
+        stages=[PipelineStage("fail", fail, StageSettings(workers=2))],
+        queue_size=1,
+    )
+
+    with pytest.raises(ConnectionError):
+        pipeline.run()
+
+
+def test_stats_should_report_per_stage_counters() -> None:
+    pipeline = Pipeline(
+        source_name="source",
+        source=lambda: range(5),
+        stages=[PipelineStage("double", double, StageSettings(workers=2, batch_size=5))],
+    )
+
+    pipeline.run()
+    actual = {stats.name: stats for stats in pipeline.stats()}
+
+    assert list(actual.keys()) == ["source", "double"]
+    assert actual["source"].processed == 5
+    assert actual["double"].processed == 5
+    assert actual["double"].workers == 2
+    assert actual["double"].batch_size == 5
+    assert actual["double"].queue_depth == 0
+    assert actual["double"].max_queue_depth >= 1
@@ -1,23 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
 from unittest.mock import MagicMock, patch
 
 import pytest
 from requests.exceptions import ConnectionError
 
-from app.models.domains_map import DomainMapEntry
+from app.models.domains_map import DomainMapEntry, SyncMode
+from app.models.metadata.fhir import Bundle
+from app.models.pipeline import DomainRunStats
 from app.models.referrals import Referral
 from app.models.update_scheme import BsnUpdateScheme, UpdateScheme
+from app.services.metadata import MetadataService, UpdatePage
+from app.services.registration.referrals import ReferralRegistrationService
+from app.services.synchronization.domain_map import DomainsMapService
 from app.services.synchronization.synchronizer import Synchronizer
 
 PATCHED_METADATA_API = "app.services.metadata.MetadataService"
 PATCHED_NVI_API = "app.services.nvi.NviService"
 PATCHED_PSEUDONYM_API = "app.services.pseudonym.PseudonymService"
-PATCHED_REGISTER = "app.services.registration.referrals.ReferralRegistrationService.register"
+PATCHED_REGISTER = "app.services.registration.referrals.ReferralRegistrationService.register_subject"
+PATCHED_CALCULATE_SUBJECT = "app.services.registration.referrals.ReferralRegistrationService.calculate_subject"
 PATCHED_SYNCHRONIZE = "app.services.synchronization.synchronizer.Synchronizer.synchronize"
 PATCHED_SYNCHRONIZE_HEALTH = "app.services.synchronization.synchronizer.Synchronizer._healthcheck_apis"
 
 HEALTHY = {"nvi_api": True, "metadata_api": True, "pseudonym_api": True}
 
 
+def page(last_updated: str | None = None, *last_ids: str) -> UpdatePage:
+    return UpdatePage(
+        bundle=Bundle.model_construct(),
+        resource_type="ImagingStudy",
+        resources=[],
+        last_updated=last_updated,
+        last_ids=list(last_ids),
+    )
+
+
 @pytest.fixture
 def mock_domain_map_entry() -> DomainMapEntry:
     return DomainMapEntry()
@@ -60,13 +78,17 @@ def test_get_allowed_domains(
     assert synchronizer.get_allowed_domains() == data_domains
 
 
-@patch(f"{PATCHED_METADATA_API}.get_update_scheme")
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
 @patch(PATCHED_REGISTER)
 @patch(PATCHED_SYNCHRONIZE_HEALTH)
 def test_synchronize_should_succeed_when_there_is_data_from_metadata(
     mock_healthcheck: MagicMock,
     mock_register: MagicMock,
-    mock_metadata_get_update_scheme: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
     synchronizer: Synchronizer,
     mock_referral: Referral,
     mock_domain_map_entry: DomainMapEntry,
@@ -74,23 +96,27 @@ def test_synchronize_should_succeed_when_there_is_data_from_metadata(
     mock_bsn_number: str,
 ) -> None:
     mock_healthcheck.return_value = HEALTHY
-    mock_metadata_get_update_scheme.return_value = ([mock_bsn_number], None)
+    mock_metadata_parse_update_page.return_value = [mock_bsn_number]
     mock_register.return_value = mock_referral
 
     actual = synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
 
     assert actual == mock_update_scheme
-    mock_metadata_get_update_scheme.assert_called_once()
+    mock_metadata_parse_update_page.assert_called_once()
     mock_register.assert_called_once()
 
 
-@patch(f"{PATCHED_METADATA_API}.get_update_scheme")
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
 @patch(PATCHED_REGISTER)
 @patch(PATCHED_SYNCHRONIZE_HEALTH)
 def test_synchronize_should_update_timestamp_when_metadata_has_newer_timestamp(
     mock_healthcheck: MagicMock,
     mock_register: MagicMock,
-    mock_metadata_get_update_scheme: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
     synchronizer: Synchronizer,
     mock_referral: Referral,
     mock_domain_map_entry: DomainMapEntry,
@@ -98,28 +124,34 @@ def test_synchronize_should_update_timestamp_when_metadata_has_newer_timestamp(
     mock_bsn_number: str,
 ) -> None:
     mock_healthcheck.return_value = HEALTHY
-    mock_metadata_get_update_scheme.return_value = ([mock_bsn_number], datetime_now)
+    mock_metadata_search.return_value = [page(datetime_now, "example-imagingstudy")]
+    mock_metadata_parse_update_page.return_value = [mock_bsn_number]
     mock_register.return_value = mock_referral
 
     actual = synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
 
     assert actual.domain_entry.last_resource_update == datetime_now
+    assert actual.domain_entry.last_resource_ids == ["example-imagingstudy"]
     mock_register.assert_called_once()
 
 
-@patch(f"{PATCHED_METADATA_API}.get_update_scheme")
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
 @patch(PATCHED_REGISTER)
 @patch(PATCHED_SYNCHRONIZE_HEALTH)
 def test_synchronize_should_return_no_updates_when_no_patients_from_metadata(
     mock_healthcheck: MagicMock,
     mock_register: MagicMock,
-    mock_metadata_get_update_scheme: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
     synchronizer: Synchronizer,
     mock_domain_map_entry_with_timestamp: DomainMapEntry,
     datetime_now: str,
 ) -> None:
     mock_healthcheck.return_value = HEALTHY
-    mock_metadata_get_update_scheme.return_value = ([], datetime_now)
+    mock_metadata_parse_update_page.return_value = []
 
     actual = synchronizer.synchronize("ImagingStudy", mock_domain_map_entry_with_timestamp)
 
@@ -127,41 +159,51 @@ def test_synchronize_should_return_no_updates_when_no_patients_from_metadata(
     mock_register.assert_not_called()
 
 
-@patch(f"{PATCHED_METADATA_API}.get_update_scheme")
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
 @patch(PATCHED_REGISTER)
 @patch(PATCHED_SYNCHRONIZE_HEALTH)
 def test_synchronize_should_skip_when_referral_already_exists(
     mock_healthcheck: MagicMock,
     mock_register: MagicMock,
-    mock_metadata_get_update_scheme: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
     synchronizer: Synchronizer,
     mock_domain_map_entry: DomainMapEntry,
     mock_bsn_number: str,
     datetime_now: str,
 ) -> None:
     mock_healthcheck.return_value = HEALTHY
-    mock_metadata_get_update_scheme.return_value = ([mock_bsn_number], datetime_now)
+    mock_metadata_search.return_value = [page(datetime_now, "example-imagingstudy")]
+    mock_metadata_parse_update_page.return_value = [mock_bsn_number]
     mock_register.return_value = None
 
     actual = synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
 
     assert actual.updated_data == []
+    assert actual.domain_entry.last_resource_update == datetime_now
     mock_register.assert_called_once()
 
 
-@patch(f"{PATCHED_METADATA_API}.get_update_scheme")
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
 @patch(PATCHED_REGISTER)
 @patch(PATCHED_SYNCHRONIZE_HEALTH)
 def test_synchronize_should_fail_when_registration_is_unreachable(
     mock_healthcheck: MagicMock,
     mock_register: MagicMock,
-    mock_metadata_get_update_scheme: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
     synchronizer: Synchronizer,
     mock_domain_map_entry: DomainMapEntry,
     mock_bsn_number: str,
 ) -> None:
     mock_healthcheck.return_value = HEALTHY
-    mock_metadata_get_update_scheme.return_value = ([mock_bsn_number], None)
+    mock_metadata_parse_update_page.return_value = [mock_bsn_number]
     mock_register.side_effect = ConnectionError
 
     with pytest.raises(ConnectionError):
@@ -195,3 +237,251 @@ def test_synchronize_domain_should_fail_when_there_is_no_connection_established(
         synchronizer.synchronize_domain("ImagingStudy")
 
     mock_synchronize.assert_called()
+
+
+@patch(PATCHED_SYNCHRONIZE)
+def test_clear_cache_should_wait_for_synchronization_in_progress(
+    mock_synchronize: MagicMock,
+    synchronizer: Synchronizer,
+    domains_map_service: DomainsMapService,
+    mock_update_scheme: UpdateScheme,
+    datetime_now: str,
+) -> None:
+    running, cleared = Event(), Event()
+
+    def synchronize(data_domain: str, domain_entry: DomainMapEntry) -> UpdateScheme:
+        running.set()
+        assert not cleared.wait(0.1)
+        domains_map_service.update_entry(data_domain, DomainMapEntry(last_resource_update=datetime_now))
+        return mock_update_scheme
+
+    mock_synchronize.side_effect = synchronize
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        run = executor.submit(synchronizer.synchronize_domain, "ImagingStudy")
+        running.wait(1)
+        synchronizer.clear_cache("ImagingStudy")
+        cleared.set()
+        run.result()
+
+    assert domains_map_service.get_entry("ImagingStudy").last_resource_update is None
+
+
+@patch(f"{PATCHED_METADATA_API}.clear_patient_cache")
+def test_clear_cache_should_only_clear_patient_cache_with_all_domains(
+    mock_clear_patient_cache: MagicMock, synchronizer: Synchronizer
+) -> None:
+    synchronizer.clear_cache("ImagingStudy")
+    mock_clear_patient_cache.assert_not_called()
+
+    synchronizer.clear_cache()
+    mock_clear_patient_cache.assert_called_once()
+
+
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
+@patch(PATCHED_REGISTER)
+@patch(PATCHED_SYNCHRONIZE_HEALTH)
+def test_get_pipeline_stats_should_report_stages_of_last_run(
+    mock_healthcheck: MagicMock,
+    mock_register: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
+    synchronizer: Synchronizer,
+    mock_referral: Referral,
+    mock_domain_map_entry: DomainMapEntry,
+    mock_bsn_number: str,
+) -> None:
+    mock_healthcheck.return_value = HEALTHY
+    mock_metadata_parse_update_page.return_value = [mock_bsn_number, mock_bsn_number]
+    mock_register.return_value = mock_referral
+
+    synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
+    actual = synchronizer.get_pipeline_stats()
+
+    assert list(actual.keys()) == ["ImagingStudy"]
+    assert [stats.name for stats in actual["ImagingStudy"]] == ["metadata", "extract", "pseudonym", "referral"]
+    assert [stats.processed for stats in actual["ImagingStudy"]] == [1, 1, 2, 2]
+
+
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page(), page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
+@patch(PATCHED_REGISTER)
+@patch(PATCHED_SYNCHRONIZE_HEALTH)
+def test_synchronize_should_process_every_page(
+    mock_healthcheck: MagicMock,
+    mock_register: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
+    synchronizer: Synchronizer,
+    mock_referral: Referral,
+    mock_domain_map_entry: DomainMapEntry,
+    datetime_past: str,
+    datetime_now: str,
+) -> None:
+    mock_healthcheck.return_value = HEALTHY
+    mock_metadata_search.return_value = [page(datetime_past, "1"), page(datetime_now, "2")]
+    mock_metadata_parse_update_page.side_effect = [["200060429"], ["468467543"]]
+    mock_register.return_value = mock_referral
+
+    actual = synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
+
+    assert sorted(update.bsn for update in actual.updated_data) == ["200060429", "468467543"]
+    assert actual.domain_entry.last_resource_update == datetime_now
+
+
+@patch(f"{PATCHED_METADATA_API}.save_patient_cache")
+@patch(f"{PATCHED_METADATA_API}.search_updates")
+@patch(f"{PATCHED_METADATA_API}.parse_update_page")
+@patch(PATCHED_CALCULATE_SUBJECT, return_value="some_subject")
+@patch(PATCHED_REGISTER)
+@patch(PATCHED_SYNCHRONIZE_HEALTH)
+def test_synchronize_should_checkpoint_last_page_processed_before_failure(
+    mock_healthcheck: MagicMock,
+    mock_register: MagicMock,
+    mock_calculate_subject: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
+    mock_save_patient_cache: MagicMock,
+    synchronizer: Synchronizer,
+    mock_referral: Referral,
+    mock_domain_map_entry: DomainMapEntry,
+    datetime_past: str,
+    datetime_now: str,
+) -> None:
+    mock_healthcheck.return_value = HEALTHY
+    mock_metadata_search.return_value = [page(datetime_past, "1"), page(datetime_now, "2")]
+    mock_metadata_parse_update_page.side_effect = [["200060429"], ["468467543"]]
+    mock_register.side_effect = [mock_referral, ConnectionError]
+
+    with pytest.raises(ConnectionError):
+        synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
+
+    entry = synchronizer._domain_map_service.get_entry("ImagingStudy")
+    assert (entry.last_resource_update, entry.last_resource_ids) == (datetime_past, ["1"])
+    mock_save_patient_cache.assert_called_once()
+
+
+@patch(f"{PATCHED_METADATA_API}.search_history", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.search_updates")
+@patch(f"{PATCHED_METADATA_API}.parse_update_page", return_value=[])
+@patch(PATCHED_SYNCHRONIZE_HEALTH, return_value=HEALTHY)
+def test_synchronize_should_read_history_of_history_domains(
+    mock_healthcheck: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
+    mock_metadata_history: MagicMock,
+    domains_map_service: DomainsMapService,
+    metadata_service: MetadataService,
+    registration_service: ReferralRegistrationService,
+    mock_domain_map_entry: DomainMapEntry,
+) -> None:
+    synchronizer = Synchronizer(
+        registration_service=registration_service,
+        metadata_api=metadata_service,
+        domains_map_service=domains_map_service,
+        domain_modes={"ImagingStudy": SyncMode.history},
+    )
+
+    synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
+
+    mock_metadata_history.assert_called_once_with("ImagingStudy", None, [])
+    mock_metadata_search.assert_not_called()
+
+
+@patch(f"{PATCHED_METADATA_API}.export_updates", return_value=[page("2025-01-01T12:00:00+00:00")])
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page", return_value=[])
+@patch(PATCHED_SYNCHRONIZE_HEALTH, return_value=HEALTHY)
+def test_synchronize_should_seed_from_export_without_progress_only(
+    mock_healthcheck: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
+    mock_metadata_export: MagicMock,
+    domains_map_service: DomainsMapService,
+    metadata_service: MetadataService,
+    registration_service: ReferralRegistrationService,
+    mock_domain_map_entry: DomainMapEntry,
+) -> None:
+    synchronizer = Synchronizer(
+        registration_service=registration_service,
+        metadata_api=metadata_service,
+        domains_map_service=domains_map_service,
+        seed_with_export=True,
+    )
+
+    first = synchronizer.synchronize("ImagingStudy", mock_domain_map_entry)
+    synchronizer.synchronize("ImagingStudy", first.domain_entry)
+
+    assert first.domain_entry.last_resource_update == "2025-01-01T12:00:00+00:00"
+    mock_metadata_export.assert_called_once_with("ImagingStudy")
+    mock_metadata_search.assert_called_once_with("ImagingStudy", "2025-01-01T12:00:00+00:00", [])
+
+
+@pytest.mark.parametrize("count, runs", [(0, 0), (3, 1), (None, 1), (ConnectionError(), 1)])
+@patch(f"{PATCHED_METADATA_API}.count_updates")
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(PATCHED_SYNCHRONIZE_HEALTH, return_value=HEALTHY)
+def test_synchronize_should_skip_domain_without_counted_updates(
+    mock_healthcheck: MagicMock,
+    mock_metadata_search: MagicMock,
+    mock_metadata_count: MagicMock,
+    count: int | None | Exception,
+    runs: int,
+    domains_map_service: DomainsMapService,
+    metadata_service: MetadataService,
+    registration_service: ReferralRegistrationService,
+    mock_domain_map_entry_with_timestamp: DomainMapEntry,
+    datetime_now: str,
+) -> None:
+    mock_metadata_count.side_effect = [count]
+    synchronizer = Synchronizer(
+        registration_service=registration_service,
+        metadata_api=metadata_service,
+        domains_map_service=domains_map_service,
+        precheck=True,
+    )
+
+    synchronizer.synchronize("ImagingStudy", mock_domain_map_entry_with_timestamp)
+
+    mock_metadata_count.assert_called_once_with("ImagingStudy", datetime_now)
+    assert mock_metadata_search.call_count == runs
+    assert synchronizer.get_domain_stats()["ImagingStudy"] == DomainRunStats(runs=runs, skipped=1 - runs)
+
+
+@patch(f"{PATCHED_METADATA_API}.search_system_updates")
+@patch(f"{PATCHED_METADATA_API}.search_updates", return_value=[page()])
+@patch(f"{PATCHED_METADATA_API}.parse_update_page", return_value=[])
+@patch(PATCHED_SYNCHRONIZE_HEALTH, return_value=HEALTHY)
+def test_synchronize_all_domains_should_search_domains_together(
+    mock_healthcheck: MagicMock,
+    mock_metadata_parse_update_page: MagicMock,
+    mock_metadata_search: MagicMock,
+    mock_metadata_system_search: MagicMock,
+    metadata_service: MetadataService,
+    registration_service: ReferralRegistrationService,
+    datetime_now: str,
+) -> None:
+    domains_map_service = DomainsMapService(["ImagingStudy", "Observation", "Account"])
+    mock_metadata_search.return_value = [UpdatePage(Bundle.model_construct(), "Account", [], None, [])]
+    mock_metadata_system_search.return_value = [
+        UpdatePage(Bundle.model_construct(), "ImagingStudy", [], datetime_now, ["a"]),
+        UpdatePage(Bundle.model_construct(), "Observation", [], datetime_now, ["b"]),
+    ]
+    synchronizer = Synchronizer(
+        registration_service=registration_service,
+        metadata_api=metadata_service,
+        domains_map_service=domains_map_service,
+        system_search=True,
+    )
+
+    actual = synchronizer.synchronize_all_domains()
+
+    assert list(actual.keys()) == ["ImagingStudy", "Observation", "Account"]
+    mock_metadata_system_search.assert_called_once_with({"ImagingStudy": (None, []), "Observation": (None, [])})
+    mock_metadata_search.assert_called_once_with("Account", None, [])
+    assert domains_map_service.get_entry("ImagingStudy").last_resource_ids == ["a"]
+    assert domains_map_service.get_entry("Observation").last_resource_ids == ["b"]
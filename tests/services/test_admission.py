@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.exceptions.fhir_exception import FHIRException
+from app.services.admission import AdmissionController, AdmissionService
+
+
+def create_controller(max_in_flight: int = 1, max_queue: int = 1, max_wait_seconds: float = 1) -> AdmissionController:
+    return AdmissionController(
+        name="registration",
+        max_in_flight=max_in_flight,
+        max_queue=max_queue,
+        max_wait_seconds=max_wait_seconds,
+        retry_after_seconds=7,
+    )
+
+
+def test_admit_should_queue_requests_over_limit() -> None:
+    controller = create_controller()
+    order = []
+
+    async def request(name: str) -> None:
+        async with controller.admit():
+            order.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            order.append(f"end {name}")
+
+    async def run() -> None:
+        await asyncio.gather(request("first"), request("second"))
+
+    asyncio.run(run())
+
+    assert order == ["start first", "end first", "start second", "end second"]
+    stats = controller.stats()
+    assert (stats.admitted, stats.queued, stats.in_flight, stats.queue_depth) == (2, 1, 0, 0)
+
+
+def test_admit_should_reject_with_429_when_queue_is_full() -> None:
+    controller = create_controller(max_queue=0)
+
+    async def run() -> None:
+        async with controller.admit():
+            await controller.acquire()
+
+    with pytest.raises(FHIRException) as e:
+        asyncio.run(run())
+
+    assert e.value.status_code == 429
+    assert e.value.headers == {"Retry-After": "7"}
+    assert "Too many registration requests" in str(e.value.detail)
+    assert controller.stats().rejected_queue_full == 1
+    assert controller.stats().in_flight == 0
+
+
+def test_admit_should_reject_with_503_when_waiting_too_long() -> None:
+    controller = create_controller(max_wait_seconds=0.01)
+
+    async def run() -> None:
+        async with controller.admit():
+            await controller.acquire()
+
+    with pytest.raises(FHIRException) as e:
+        asyncio.run(run())
+
+    assert e.value.status_code == 503
+    assert e.value.headers == {"Retry-After": "7"}
+    stats = controller.stats()
+    assert (stats.rejected_wait_timeout, stats.queue_depth, stats.in_flight) == (1, 0, 0)
+
+
+def test_admit_should_release_slot_of_cancelled_waiter() -> None:
+    controller = create_controller()
+
+    async def run() -> None:
+        async with controller.admit():
+            waiting = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+
+        async with controller.admit():
+            pass
+
+    asyncio.run(run())
+
+    stats = controller.stats()
+    assert (stats.admitted, stats.in_flight, stats.queue_depth) == (2, 0, 0)
+
+
+def test_admission_service_should_return_stats_per_controller() -> None:
+    service = AdmissionService([create_controller()])
+
+    assert service.get("registration").name == "registration"
+    assert [stats.name for stats in service.stats()] == ["registration"]
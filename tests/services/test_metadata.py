@@ -1,68 +1,480 @@
+import json
+from typing import Any, Dict, List, Tuple
 from unittest.mock import MagicMock, patch
 
+import pytest
 from fhir.resources.R4B.bundle import Bundle
+from requests import HTTPError
 
-from app.services.metadata import MetadataService
+from app.data import BSN_SYSTEM
+from app.models.metadata.fhir import Resource
+from app.models.patient_cache import CachedPatient
+from app.services.metadata import MetadataError, MetadataService
+from app.services.synchronization.patient_cache import PatientCache
 
 PATCHED_MODULE = "app.services.metadata.FhirHttpService.do_request"
 
 
+def update_scheme(metadata_service: MetadataService, resource_type: str) -> Tuple[List[str], str | None]:
+    identifiers: List[str] = []
+    last_updated = None
+    for page in metadata_service.search_updates(resource_type):
+        identifiers.extend(metadata_service.parse_update_page(page))
+        last_updated = page.last_updated
+
+    return identifiers, last_updated
+
+
 @patch(PATCHED_MODULE)
-def test_get_update_scheme_should_succeed(
+def test_search_updates_should_return_bsns_and_watermark(
     mock_get: MagicMock,
     metadata_service: MetadataService,
     regular_bundle: Bundle,
     mock_bsn_number: str,
-    datetime_now: str,
+    datetime_past: str,
 ) -> None:
-    expected_bsn_scheme, expected_latest_timestamp = (
-        [mock_bsn_number],
-        datetime_now,
-    )
     mock_response = MagicMock()
     mock_response.status_code = 200
-    mock_response.json.return_value = regular_bundle.model_dump()
+    mock_response.content = regular_bundle.model_dump_json().encode()
     mock_get.return_value = mock_response
 
-    actual_bsn_scheme, actual_latest_timestamp = metadata_service.get_update_scheme("ImagingStudy")
+    actual_bsns, actual_latest_timestamp = update_scheme(metadata_service, "ImagingStudy")
 
-    assert expected_bsn_scheme == actual_bsn_scheme
-    assert expected_latest_timestamp == actual_latest_timestamp
+    assert [mock_bsn_number] == actual_bsns
+    assert datetime_past == actual_latest_timestamp
 
 
 @patch(PATCHED_MODULE)
-def test_get_update_scheme_should_succeed_and_return_empty_list_and_timestamp_when_patient_has_no_bsn_system(
+def test_search_updates_should_return_empty_list_and_watermark_when_patient_has_no_bsn_system(
     mock_get: MagicMock,
     metadata_service: MetadataService,
     bundle_without_bsn_system: Bundle,
     datetime_past: str,
 ) -> None:
-    expected_bsn_scheme, expected_latest_timestamp = [], datetime_past  # type: ignore
     mock_response = MagicMock()
     mock_response.status_code = 200
-    mock_response.json.return_value = bundle_without_bsn_system.model_dump()
+    mock_response.content = bundle_without_bsn_system.model_dump_json().encode()
     mock_get.return_value = mock_response
 
-    actual_bsn_scheme, actual_latest_timestamp = metadata_service.get_update_scheme("ImagingStudy")
-    assert expected_bsn_scheme == actual_bsn_scheme
-    assert expected_latest_timestamp == actual_latest_timestamp
+    actual_bsns, actual_latest_timestamp = update_scheme(metadata_service, "ImagingStudy")
+
+    assert [] == actual_bsns
+    assert datetime_past == actual_latest_timestamp
     mock_get.assert_called_once()
 
 
 @patch(PATCHED_MODULE)
-def test_get_update_scheme_should_succeed_and_return_empty_list_when_bundle_has_no_patient(
+def test_search_updates_should_return_empty_list_when_bundle_has_no_patient(
     mock_get: MagicMock,
     metadata_service: MetadataService,
     bundle_without_patient: Bundle,
     datetime_past: str,
 ) -> None:
-    expected_bsn_scheme, expected_timestamp = [], datetime_past  # type: ignore
     mock_response = MagicMock()
     mock_response.status_code = 200
-    mock_response.json.return_value = bundle_without_patient.model_dump()
+    mock_response.content = bundle_without_patient.model_dump_json().encode()
     mock_get.return_value = mock_response
 
-    actual_bsn_scheme, actual_timestamp = metadata_service.get_update_scheme("ImagingStudy")
-    assert expected_bsn_scheme == actual_bsn_scheme
-    assert expected_timestamp == actual_timestamp
+    actual_bsns, actual_timestamp = update_scheme(metadata_service, "ImagingStudy")
+
+    assert [] == actual_bsns
+    assert datetime_past == actual_timestamp
     mock_get.assert_called_once()
+
+
+T1 = "2025-01-01T10:00:00+00:00"
+T2 = "2025-01-01T11:00:00+00:00"
+T3 = "2025-01-01T12:00:00+00:00"
+
+
+def study(mock_imaging_study: Dict[str, Any], id: str, last_updated: str, patient: str = "example-patient") -> Any:
+    return {
+        **mock_imaging_study,
+        "id": id,
+        "meta": {"lastUpdated": last_updated},
+        "subject": {"reference": f"Patient/{patient}"},
+    }
+
+
+def search_response(resources: List[Dict[str, Any]], next_link: str | None = None) -> MagicMock:
+    link = [{"relation": "self", "url": "http://example.org/fhir/ImagingStudy/_search"}]
+    if next_link is not None:
+        link.append({"relation": "next", "url": next_link})
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = json.dumps(
+        {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "link": link,
+            "entry": [{"resource": resource} for resource in resources],
+        }
+    ).encode()
+    return mock_response
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_request_pages_by_keyset(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+    mock_patient: Dict[str, Any],
+) -> None:
+    mock_get.side_effect = [
+        search_response(
+            [study(mock_imaging_study, "a", T1), study(mock_imaging_study, "b", T2), mock_patient],
+            "http://example.org/fhir?_getpages=abc&_getpagesoffset=2",
+        ),
+        search_response([study(mock_imaging_study, "b", T2), study(mock_imaging_study, "c", T3), mock_patient]),
+    ]
+
+    pages = list(metadata_service.search_updates("ImagingStudy"))
+
+    assert [[resource.id for resource in page.resources] for page in pages] == [["a", "b"], ["c"]]
+    assert [(page.last_updated, page.last_ids) for page in pages] == [(T2, ["b"]), (T3, ["c"])]
+    assert "_lastUpdated" not in mock_get.call_args_list[0].kwargs["params"]
+    assert mock_get.call_args_list[1].kwargs["params"] == {
+        "_lastUpdated": f"ge{T2}",
+        "_include": "ImagingStudy:subject",
+        "_elements": "meta,identifier,subject",
+        "_sort": "_lastUpdated,_id",
+        "_count": 100,
+    }
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_follow_next_link_when_page_shares_one_timestamp(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+) -> None:
+    next_link = "http://example.org/fhir?_getpages=abc&_getpagesoffset=2"
+    mock_get.side_effect = [
+        search_response([study(mock_imaging_study, "a", T1), study(mock_imaging_study, "b", T1)], next_link),
+        search_response([study(mock_imaging_study, "c", T1), study(mock_imaging_study, "d", T2)]),
+    ]
+
+    pages = list(metadata_service.search_updates("ImagingStudy", T1, ["a"]))
+
+    assert [[resource.id for resource in page.resources] for page in pages] == [["b"], ["c", "d"]]
+    assert mock_get.call_args_list[0].kwargs["params"]["_lastUpdated"] == f"ge{T1}"
+    assert mock_get.call_args_list[1].kwargs["url"] == next_link
+
+
+@patch(PATCHED_MODULE)
+def test_parse_update_page_should_return_patients_of_new_resources_only(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+    mock_patient: Dict[str, Any],
+    mock_bsn_number: str,
+) -> None:
+    other_patient = {**mock_patient, "id": "other", "identifier": [{"system": BSN_SYSTEM, "value": "468467543"}]}
+    mock_get.return_value = search_response(
+        [
+            study(mock_imaging_study, "a", T1, patient="other"),
+            study(mock_imaging_study, "b", T2),
+            mock_patient,
+            other_patient,
+        ]
+    )
+
+    pages = list(metadata_service.search_updates("ImagingStudy", T1, ["a"]))
+
+    assert [metadata_service.parse_update_page(page) for page in pages] == [[mock_bsn_number]]
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_skip_resources_processed_at_watermark(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+) -> None:
+    mock_get.return_value = search_response(
+        [
+            study(mock_imaging_study, "0", T1),
+            study(mock_imaging_study, "a", T1),
+            study(mock_imaging_study, "b", T1),
+            study(mock_imaging_study, "c", T2),
+        ]
+    )
+
+    pages = list(metadata_service.search_updates("ImagingStudy", T1, ["a", "b"]))
+
+    assert [resource.id for resource in pages[0].resources] == ["0", "c"]
+    assert (pages[0].last_updated, pages[0].last_ids) == (T2, ["c"])
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_keep_all_ids_at_watermark(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+) -> None:
+    mock_get.return_value = search_response(
+        [study(mock_imaging_study, "b", T1), study(mock_imaging_study, "c", T2), study(mock_imaging_study, "d", T2)]
+    )
+
+    pages = list(metadata_service.search_updates("ImagingStudy", T1, ["a"]))
+
+    assert (pages[0].last_updated, pages[0].last_ids) == (T2, ["c", "d"])
+
+
+def test_get_update_elements_should_project_patient_reference_of_resource_type() -> None:
+    assert MetadataService.get_update_elements("ImagingStudy") == "meta,identifier,subject"
+    assert MetadataService.get_update_elements("AllergyIntolerance") == "meta,identifier,patient"
+    assert MetadataService.get_update_elements("Account") is None
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_search_full_resources_when_elements_are_rejected(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+) -> None:
+    rejected = MagicMock()
+    rejected.status_code = 400
+    rejected.raise_for_status.side_effect = HTTPError(response=rejected)
+    mock_get.side_effect = [
+        rejected,
+        search_response([study(mock_imaging_study, "a", T1)]),
+        search_response([study(mock_imaging_study, "b", T2)]),
+    ]
+
+    pages = list(metadata_service.search_updates("ImagingStudy"))
+    pages += list(metadata_service.search_updates("ImagingStudy", T1, ["a"]))
+
+    assert [[resource.id for resource in page.resources] for page in pages] == [["a"], ["b"]]
+    assert [call.kwargs["params"].get("_elements") for call in mock_get.call_args_list] == [
+        "meta,identifier,subject",
+        None,
+        None,
+    ]
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_not_retry_other_errors(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+) -> None:
+    failed = MagicMock()
+    failed.status_code = 500
+    failed.raise_for_status.side_effect = HTTPError(response=failed)
+    mock_get.return_value = failed
+
+    with pytest.raises(HTTPError):
+        list(metadata_service.search_updates("ImagingStudy"))
+
+    assert mock_get.call_count == 1
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_not_request_elements_when_disabled(
+    mock_get: MagicMock,
+    mock_url: str,
+    mock_imaging_study: Dict[str, Any],
+) -> None:
+    metadata_service = MetadataService(
+        endpoint=mock_url, timeout=1, mtls_cert=None, mtls_key=None, verify_ca=True, elements=False
+    )
+    mock_get.return_value = search_response([study(mock_imaging_study, "a", T1)])
+
+    list(metadata_service.search_updates("ImagingStudy"))
+
+    assert "_elements" not in mock_get.call_args.kwargs["params"]
+
+
+@patch(PATCHED_MODULE)
+def test_parse_update_page_should_look_up_unknown_patients_in_bulk(
+    mock_get: MagicMock,
+    mock_url: str,
+    mock_imaging_study: Dict[str, Any],
+    mock_patient: Dict[str, Any],
+    mock_bsn_number: str,
+) -> None:
+    patient_cache = PatientCache()
+    metadata_service = MetadataService(
+        endpoint=mock_url, timeout=1, mtls_cert=None, mtls_key=None, verify_ca=True, patient_cache=patient_cache
+    )
+    other_patient = {**mock_patient, "id": "other", "identifier": [{"system": BSN_SYSTEM, "value": "468467543"}]}
+    patient_cache.update([Resource.model_validate(other_patient)])
+    mock_get.side_effect = [
+        search_response(
+            [
+                study(mock_imaging_study, "a", T1),
+                study(mock_imaging_study, "b", T1, patient="other"),
+                study(mock_imaging_study, "c", T2),
+            ]
+        ),
+        search_response([mock_patient]),
+    ]
+
+    pages = list(metadata_service.search_updates("ImagingStudy"))
+    bsns = [metadata_service.parse_update_page(page) for page in pages]
+
+    assert bsns == [[mock_bsn_number, "468467543"]]
+    assert "_include" not in mock_get.call_args_list[0].kwargs["params"]
+    assert mock_get.call_args_list[1].kwargs["sub_route"] == "Patient/_search"
+    assert mock_get.call_args_list[1].kwargs["params"] == {
+        "_id": "example-patient",
+        "_elements": "meta,identifier",
+        "_count": 1,
+    }
+    assert patient_cache.get("example-patient") is not None
+
+
+@patch(PATCHED_MODULE)
+def test_refresh_patient_cache_should_update_known_patients_only(
+    mock_get: MagicMock,
+    mock_url: str,
+    mock_patient: Dict[str, Any],
+) -> None:
+    patient_cache = PatientCache()
+    metadata_service = MetadataService(
+        endpoint=mock_url, timeout=1, mtls_cert=None, mtls_key=None, verify_ca=True, patient_cache=patient_cache
+    )
+    patient_cache.update([Resource.model_validate({**mock_patient, "meta": {"lastUpdated": T1}})])
+    changed_patient = {
+        **mock_patient,
+        "meta": {"lastUpdated": T2},
+        "identifier": [{"system": BSN_SYSTEM, "value": "468467543"}],
+    }
+    mock_get.return_value = search_response([changed_patient, {**changed_patient, "id": "other"}])
+
+    metadata_service.refresh_patient_cache()
+
+    assert mock_get.call_args.kwargs["params"]["_lastUpdated"] == f"ge{T1}"
+    assert patient_cache.get("example-patient") == CachedPatient(bsn="468467543", last_updated=T2)
+    assert patient_cache.get("other") is None
+    assert patient_cache.last_updated == T2
+
+
+def version(mock_imaging_study: Dict[str, Any], id: str, version_id: str, last_updated: str, patient: str) -> Any:
+    return {
+        **study(mock_imaging_study, id, last_updated, patient),
+        "meta": {"versionId": version_id, "lastUpdated": last_updated},
+    }
+
+
+@patch(PATCHED_MODULE)
+def test_search_history_should_carry_watermark_on_last_page(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+) -> None:
+    next_link = "http://example.org/fhir?_getpages=abc&_getpagesoffset=2"
+    mock_get.side_effect = [
+        search_response(
+            [version(mock_imaging_study, "a", "3", T3, "p1"), version(mock_imaging_study, "b", "1", T2, "p2")],
+            next_link,
+        ),
+        search_response(
+            [version(mock_imaging_study, "a", "2", T2, "p1"), version(mock_imaging_study, "a", "1", T1, "p1")]
+        ),
+    ]
+
+    pages = list(metadata_service.search_history("ImagingStudy", T1, ["a/_history/1"]))
+
+    assert [[resource.id for resource in page.resources] for page in pages] == [["a", "b"], ["a"]]
+    assert [(page.last_updated, page.last_ids) for page in pages] == [(T1, ["a/_history/1"]), (T3, ["a/_history/3"])]
+    assert mock_get.call_args_list[0].kwargs["sub_route"] == "ImagingStudy/_history"
+    assert mock_get.call_args_list[0].kwargs["params"] == {"_since": T1, "_count": 100}
+    assert mock_get.call_args_list[1].kwargs["url"] == next_link
+
+
+@patch(PATCHED_MODULE)
+def test_parse_update_page_should_look_up_patients_of_history_page(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+    mock_patient: Dict[str, Any],
+    mock_bsn_number: str,
+) -> None:
+    mock_get.side_effect = [
+        search_response(
+            [
+                version(mock_imaging_study, "a", "2", T2, "example-patient"),
+                version(mock_imaging_study, "a", "1", T1, "example-patient"),
+            ]
+        ),
+        search_response([mock_patient]),
+    ]
+
+    pages = list(metadata_service.search_history("ImagingStudy"))
+
+    assert [metadata_service.parse_update_page(page) for page in pages] == [[mock_bsn_number]]
+    assert mock_get.call_args_list[1].kwargs["params"]["_id"] == "example-patient"
+
+
+def test_search_history_should_reject_resource_type_without_patient_reference(
+    metadata_service: MetadataService,
+) -> None:
+    with pytest.raises(MetadataError):
+        list(metadata_service.search_history("Account"))
+
+
+@patch(PATCHED_MODULE)
+def test_count_updates_should_count_resources_updated_after_watermark(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+) -> None:
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = json.dumps({"resourceType": "Bundle", "type": "searchset", "total": 3}).encode()
+    mock_get.return_value = mock_response
+
+    assert metadata_service.count_updates("ImagingStudy", T1) == 3
+    assert mock_get.call_args.kwargs["params"] == {"_lastUpdated": f"gt{T1}", "_summary": "count"}
+
+
+@patch(PATCHED_MODULE)
+def test_search_updates_should_bound_window_until(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+) -> None:
+    mock_get.return_value = search_response([study(mock_imaging_study, "a", T1)])
+
+    pages = list(metadata_service.search_updates("ImagingStudy", T1, until=T3))
+    metadata_service.count_range("ImagingStudy", T1, T3)
+
+    assert [[resource.id for resource in page.resources] for page in pages] == [["a"]]
+    assert mock_get.call_args_list[0].kwargs["params"]["_lastUpdated"] == [f"ge{T1}", f"lt{T3}"]
+    assert mock_get.call_args.kwargs["params"] == {"_lastUpdated": [f"ge{T1}", f"lt{T3}"], "_summary": "count"}
+
+
+@patch(PATCHED_MODULE)
+def test_search_system_updates_should_route_pages_to_resource_types(
+    mock_get: MagicMock,
+    metadata_service: MetadataService,
+    mock_imaging_study: Dict[str, Any],
+    mock_patient: Dict[str, Any],
+    mock_bsn_number: str,
+) -> None:
+    observation = {
+        "resourceType": "Observation",
+        "id": "o",
+        "meta": {"lastUpdated": T1},
+        "status": "final",
+        "subject": {"reference": "Patient/example-patient"},
+    }
+    mock_get.return_value = search_response(
+        [observation, study(mock_imaging_study, "a", T2), study(mock_imaging_study, "b", T3), mock_patient]
+    )
+
+    pages = list(metadata_service.search_system_updates({"ImagingStudy": (T2, ["a"]), "Observation": (None, [])}))
+
+    assert [(page.resource_type, [resource.id for resource in page.resources]) for page in pages] == [
+        ("ImagingStudy", ["b"]),
+        ("Observation", ["o"]),
+    ]
+    assert [(page.last_updated, page.last_ids) for page in pages] == [(T3, ["b"]), (T1, ["o"])]
+    assert [metadata_service.parse_update_page(page) for page in pages] == [[mock_bsn_number], [mock_bsn_number]]
+    assert mock_get.call_args.kwargs["sub_route"] == "_search"
+    assert mock_get.call_args.kwargs["params"] == {
+        "_type": "ImagingStudy,Observation",
+        "_include": ["ImagingStudy:subject", "Observation:subject"],
+        "_elements": "meta,identifier,subject",
+        "_sort": "_lastUpdated,_id",
+        "_count": 100,
+    }
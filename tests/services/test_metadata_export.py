@@ -0,0 +1,153 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Any, Dict, Iterator, List
+
+import pytest
+
+from app.data import BSN_SYSTEM
+from app.services.metadata import MetadataService
+from app.services.synchronization.patient_cache import PatientCache
+
+TRANSACTION_TIME = "2025-01-01T12:00:00+00:00"
+
+
+class ExportServer(ThreadingHTTPServer):
+    """
+    Stands in for the Bulk Data $export of a metadata server: an export is in progress on the first
+    status request and complete on the next.
+    """
+
+    def __init__(self, files: Dict[str, List[Dict[str, Any]]], retry_after: int = 0) -> None:
+        super().__init__(("127.0.0.1", 0), ExportHandler)
+        self.files = files
+        self.retry_after = retry_after
+        self.status_requests = 0
+        self.paths: List[str] = []
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/fhir"
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    server: ExportServer
+
+    def do_GET(self) -> None:
+        self.server.paths.append(self.path)
+        if self.path.startswith("/fhir/$export"):
+            self.send_response(202)
+            self.send_header("Content-Location", f"{self.server.endpoint}/export-status/1")
+            self.end_headers()
+        elif self.path == "/fhir/export-status/1":
+            self.server.status_requests += 1
+            if self.server.status_requests == 1 or self.server.retry_after > 0:
+                self.send_response(202)
+                self.send_header("Retry-After", str(self.server.retry_after))
+                self.end_headers()
+                return
+
+            manifest = {
+                "transactionTime": TRANSACTION_TIME,
+                "request": f"{self.server.endpoint}/$export",
+                "requiresAccessToken": False,
+                "output": [
+                    {"type": resource_type, "url": f"{self.server.endpoint}/files/{resource_type}.ndjson"}
+                    for resource_type in self.server.files
+                ],
+                "error": [],
+            }
+            self.__send(json.dumps(manifest).encode(), "application/json")
+        elif self.path.startswith("/fhir/files/"):
+            resource_type = self.path.removeprefix("/fhir/files/").removesuffix(".ndjson")
+            body = "\n".join(json.dumps(resource) for resource in self.server.files[resource_type])
+            self.__send(body.encode(), "application/fhir+ndjson")
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def __send(self, body: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(server: ExportServer) -> Iterator[ExportServer]:
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def study(id: str, patient: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "ImagingStudy",
+        "id": id,
+        "meta": {"lastUpdated": "2025-01-01T10:00:00+00:00"},
+        "status": "available",
+        "subject": {"reference": f"Patient/{patient}"},
+    }
+
+
+def patient(id: str, bsn: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "Patient",
+        "id": id,
+        "meta": {"lastUpdated": "2025-01-01T09:00:00+00:00"},
+        "identifier": [{"system": BSN_SYSTEM, "value": bsn}],
+    }
+
+
+@pytest.fixture
+def export_server() -> Iterator[ExportServer]:
+    files = {
+        "ImagingStudy": [study("a", "p1"), study("b", "p2"), study("c", "p1")],
+        "Patient": [patient("p1", "200060429"), patient("p2", "468467543")],
+    }
+    yield from serve(ExportServer(files))
+
+
+def test_export_updates_should_stream_export_in_pages(export_server: ExportServer) -> None:
+    metadata_service = MetadataService(
+        endpoint=export_server.endpoint,
+        timeout=5,
+        mtls_cert=None,
+        mtls_key=None,
+        verify_ca=True,
+        page_size=2,
+        patient_cache=PatientCache(),
+        export_poll_interval=0.01,
+    )
+
+    pages = list(metadata_service.export_updates("ImagingStudy"))
+    bsns = [metadata_service.parse_update_page(page) for page in pages]
+
+    assert [[resource.id for resource in page.resources] for page in pages] == [["a", "b"], ["c"], []]
+    assert [page.last_updated for page in pages] == [None, None, TRANSACTION_TIME]
+    assert bsns == [["200060429", "468467543"], ["200060429"], []]
+    assert export_server.paths[0] == "/fhir/$export?_type=ImagingStudy%2CPatient"
+    assert export_server.status_requests == 2
+    assert not any(path.startswith("/fhir/Patient") for path in export_server.paths)
+
+
+def test_export_updates_should_raise_when_export_does_not_complete_in_time() -> None:
+    for server in serve(ExportServer({}, retry_after=1)):
+        metadata_service = MetadataService(
+            endpoint=server.endpoint,
+            timeout=5,
+            mtls_cert=None,
+            mtls_key=None,
+            verify_ca=True,
+            export_timeout=0.5,
+        )
+
+        with pytest.raises(TimeoutError):
+            list(metadata_service.export_updates("ImagingStudy"))
+
+        assert server.paths[0] == "/fhir/$export?_type=ImagingStudy"
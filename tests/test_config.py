@@ -2,14 +2,15 @@ from app.config import (
     Config,
     ConfigApp,
     ConfigMetadataApi,
+    ConfigOauthApi,
     ConfigPseudonymApi,
     ConfigReferralApi,
-    ConfigOauthApi,
     ConfigScheduler,
     ConfigUvicorn,
     LogLevel,
     NviFhirSystems,
 )
+from app.models.domains_map import SyncMode
 
 
 def get_test_config() -> Config:
@@ -50,3 +51,10 @@ def get_test_config() -> Config:
         scheduler=ConfigScheduler(scheduled_delay=5),
         nvi_fhir_systems=NviFhirSystems(),
     )
+
+
+def test_config_app_should_split_data_domain_modes() -> None:
+    config = ConfigApp.model_validate({"data_domains": "ImagingStudy, Observation:history"})
+
+    assert config.data_domains == ["ImagingStudy", "Observation"]
+    assert config.data_domain_modes == {"Observation": SyncMode.history}